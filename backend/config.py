@@ -5,6 +5,96 @@ from functools import lru_cache
 class Settings(BaseSettings):
     # OpenRouter API
     openrouter_api_key: str = ""
+    # Адрес chat completions (для нагрузочных тестов - локальный bench/fake_openrouter.py)
+    openrouter_api_url: str = "https://openrouter.ai/api/v1/chat/completions"
+    # Пул HTTP-соединений к OpenRouter (общий на всё приложение)
+    openrouter_timeout: float = 60.0  # Таймаут ответа модели, сек
+    openrouter_connect_timeout: float = 10.0  # Таймаут установки соединения, сек
+    openrouter_max_connections: int = 20  # Максимум одновременных соединений
+    openrouter_max_keepalive_connections: int = 10  # Сколько соединений держать открытыми
+    openrouter_keepalive_expiry: float = 60.0  # Время жизни простаивающего соединения, сек
+    openrouter_http2: bool = True
+    # Structured output: формат ответа задаётся JSON-схемой (response_format)
+    ocr_structured_output: bool = True
+    # Планировщик запросов к OpenRouter
+    ocr_max_concurrency: int = 8  # Одновременных запросов на процесс
+    ocr_rate_limit_rps: float = 5.0  # Запросов в секунду на процесс (0 - без ограничения)
+    ocr_rate_limit_burst: int = 10  # Допустимый всплеск запросов
+    ocr_max_retries: int = 3  # Повторов при 429/5xx/сетевых ошибках
+    ocr_retry_base_delay: float = 1.0  # Базовая задержка экспоненциального повтора, сек
+    ocr_retry_max_delay: float = 30.0  # Максимальная задержка повтора, сек
+    # Цепочка моделей OCR через запятую: от дешёвой к сильной
+    ocr_model_chain: str = "google/gemini-2.0-flash-lite-001,google/gemini-2.0-flash-001"
+    ocr_hedge_after_seconds: float = 8.0  # Через сколько запускать страховочный запрос к следующей модели (0 - не запускать)
+    
+    # Кэш результатов OCR (по SHA-256 изображения)
+    ocr_cache_enabled: bool = True
+    ocr_cache_ttl_seconds: int = 7 * 24 * 60 * 60  # 7 дней
+    ocr_cache_max_entries: int = 256  # Размер LRU в памяти процесса
+    
+    # Нормализация изображений перед OCR
+    image_preprocess_enabled: bool = True
+    image_max_edge: int = 2000  # Максимальная длинная сторона, px
+    image_grayscale: bool = False
+    image_output_format: str = "JPEG"  # JPEG или WEBP
+    image_quality: int = 85
+    image_max_bytes: int = 1_500_000  # Верхняя граница размера после сжатия
+    
+    # Фоновые задачи OCR
+    ocr_job_workers: int = 4  # Размер пула воркеров на процесс
+    ocr_job_queue_size: int = 100  # Максимум задач в очереди (на все процессы)
+    ocr_job_lease_seconds: int = 120  # Аренда задачи воркером (продлевается, пока идёт распознавание)
+    ocr_job_max_attempts: int = 2  # Сколько раз запускать задачу, прерванную перезапуском
+    ocr_job_ttl_seconds: int = 24 * 60 * 60  # Сколько хранить задачи в MongoDB
+    
+    # Пакетная загрузка
+    ocr_batch_concurrency: int = 3  # Сколько OCR запросов одного пакета выполнять параллельно
+    
+    # Хранилище изображений: local (UPLOAD_DIR), gridfs или s3
+    storage_backend: str = "local"
+    gridfs_bucket: str = "images"
+    s3_endpoint_url: str = ""  # например: http://localhost:9000 для MinIO
+    s3_bucket: str = ""
+    s3_access_key: str = ""
+    s3_secret_key: str = ""
+    s3_region: str = "us-east-1"
+    image_cache_max_age: int = 30 * 24 * 60 * 60  # Cache-Control для изображений, сек
+    
+    # Архивное перекодирование оригиналов после сохранения заявки
+    image_archive_enabled: bool = True
+    image_archive_format: str = "WEBP"  # WEBP или AVIF (если Pillow собран с AVIF)
+    image_archive_quality: int = 80
+    image_archive_max_edge: int = 3000  # 0 - не уменьшать
+    
+    # Миниатюры и превью для админ-панели (дисковый кэш)
+    image_derivative_dir: str = "cache/derivatives"
+    image_derivative_cache_mb: int = 512
+    image_derivative_workers: int = 2  # Потоки для генерации
+    
+    # Брошенные загрузки (фото загружено, заявка не сохранена)
+    upload_pending_ttl_seconds: int = 24 * 60 * 60  # Через сколько удалять
+    upload_sweep_interval_seconds: int = 60 * 60  # Период сборщика, 0 - выключен
+    upload_deleted_retention_seconds: int = 30 * 24 * 60 * 60  # Сколько хранить записи удалённых
+    
+    # Поиск почти одинаковых фото перед OCR (перцептивный хэш)
+    duplicate_check_enabled: bool = True
+    duplicate_max_distance: int = 4  # Порог расстояния Хэмминга, бит из 64 (не больше 4)
+    
+    # Проверка качества фото перед OCR (размытие, экспозиция, размер листа в кадре)
+    quality_check_enabled: bool = True
+    quality_check_workers: int = 2  # Потоки для проверки
+    quality_min_sharpness: float = 25.0  # Дисперсия лапласиана на кадре 1024 px
+    quality_min_brightness: int = 70  # Яркость бумаги (95-й перцентиль), 0-255
+    quality_max_brightness: int = 250  # Средняя яркость кадра, 0-255
+    quality_min_coverage: float = 0.2  # Доля кадра, занятая листом
+    
+    # Пулы для CPU-bound работы (services/executors.py)
+    executor_threads: int = 4  # Потоки для хэшей, base64 и JSON в пути запроса
+    executor_process_workers: int = 2  # Процессы для обработки изображений, 0 - выполнять в потоках
+    event_loop_lag_interval_ms: int = 100  # Период замера задержки event loop, 0 - выключен
+    
+    # Счётчики заявок для /api/admin/stats: ночная сверка с коллекцией
+    stats_reconcile_hour_utc: int = 0  # Час сверки по UTC (0 - 03:00 МСК), -1 - выключена
     
     # MongoDB
     mongodb_uri: str = "mongodb://localhost:27017"
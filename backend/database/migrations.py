@@ -0,0 +1,418 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, TEXT, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+from backend.models.student import STUDENT_SCHEMA_VERSION
+from backend.services.search import search_fields
+
+settings = get_settings()
+
+# Коллекция состояния миграций (версия применённого набора индексов и блокировка)
+MIGRATIONS_COLLECTION = "migrations"
+INDEXES_STATE_ID = "indexes"
+# Сколько держится блокировка: воркер, упавший посреди миграции, не блокирует остальных навсегда
+MIGRATION_LOCK_SECONDS = 10 * 60
+# Сколько последних применений хранить в истории
+MIGRATION_HISTORY = 20
+STUDENTS_STATE_ID = "students_schema"
+# Заявок в одном bulk_write миграции схемы и пауза между пачками (не забирать всю базу у запросов)
+STUDENT_MIGRATION_BATCH = 500
+STUDENT_MIGRATION_PAUSE_SECONDS = 0.05
+
+
+class IndexSpec(NamedTuple):
+    """Объявление индекса: коллекция, ключи и параметры create_index"""
+    collection: str
+    keys: List[Tuple[str, Any]]
+    options: Dict[str, Any] = {}
+
+    @property
+    def name(self) -> str:
+        # Имя по умолчанию как у pymongo: уже созданные индексы узнаются и не перестраиваются
+        return self.options.get("name") or "_".join(f"{field}_{order}" for field, order in self.keys)
+
+
+def declared_indexes() -> List[IndexSpec]:
+    """
+    Все индексы приложения. Каждый индекс нужен конкретному запросу -
+    запросы админ-панели и AMO проверяет python -m backend.database.query_check.
+    """
+    return [
+        # Список заявок и экспорт: новые сверху, пагинация по (created_at, _id)
+        IndexSpec("students", [("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # То же с фильтром по AMO и отправка неотправленных
+        IndexSpec("students", [("sent_to_amo", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # Проверка сделок в AMO (sent_to_amo=true с amo_lead_id) и поиск заявки по сделке
+        IndexSpec("students", [("amo_lead_id", ASCENDING), ("sent_to_amo", ASCENDING)]),
+        # Замена пути оригинала архивной копией
+        IndexSpec("students", [("image_paths", ASCENDING)]),
+        # Поиск: начало слова, подстрока (триграммы), ранжирование с русской морфологией
+        IndexSpec("students", [("search.tokens", ASCENDING)]),
+        IndexSpec("students", [("search.trigrams", ASCENDING)]),
+        IndexSpec(
+            "students",
+            [("search.fio", TEXT), ("search.school", TEXT)],
+            {
+                "name": "search_text",
+                "weights": {"search.fio": 10, "search.school": 3},
+                "default_language": "russian"
+            }
+        ),
+        # Сборщик брошенных загрузок: pending по времени загрузки
+        IndexSpec("stored_images", [("state", ASCENDING), ("uploaded_at", ASCENDING)]),
+        # Записи оригиналов, заменённых архивной копией (удаляются вместе с копией)
+        IndexSpec("stored_images", [("replaced_by", ASCENDING)], {"sparse": True}),
+        # Оригиналы, заменённые архивной копией, объекты которых ещё не удалены
+        IndexSpec("stored_images", [("purge_after", ASCENDING)], {"sparse": True}),
+        # Почти дубликаты: точное совпадение полосы перцептивного хэша
+        IndexSpec("stored_images", [("phash_bands", ASCENDING)]),
+        # Временные данные - удаляет сама MongoDB (TTL). У stored_images - только
+        # удалённые объекты: записи заменённых оригиналов (replaced) нужны для редиректа
+        IndexSpec(
+            "stored_images", [("deleted_at", ASCENDING)],
+            {
+                "expireAfterSeconds": settings.upload_deleted_retention_seconds,
+                "partialFilterExpression": {"state": "deleted"}
+            }
+        ),
+        IndexSpec("ocr_cache", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        IndexSpec("ocr_jobs", [("created_at", ASCENDING)], {"expireAfterSeconds": settings.ocr_job_ttl_seconds}),
+        # Очередь фоновых задач: самая старая задача в статусе
+        IndexSpec("ocr_jobs", [("status", ASCENDING), ("created_at", ASCENDING)]),
+    ]
+
+
+# Индексы прежних версий, которые больше не нужны (покрыты префиксами составных)
+RETIRED_INDEXES = {
+    "students": ["created_at_1", "sent_to_amo_1"],
+}
+
+
+def indexes_fingerprint(specs: List[IndexSpec]) -> str:
+    """Версия набора индексов: меняется при любом изменении объявлений (в том числе TTL из настроек)"""
+    raw = json.dumps([[spec.collection, spec.keys, spec.options] for spec in specs], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _same_index(existing: Dict[str, Any], spec: IndexSpec) -> bool:
+    """Совпадает ли существующий индекс с объявлением (без учёта TTL - он меняется на месте)"""
+    if any(order == TEXT for _, order in spec.keys):
+        # У текстового индекса в key служебные поля _fts/_ftsx - сравниваем веса и язык
+        return (
+            existing.get("weights") == spec.options.get("weights")
+            and existing.get("default_language", "english") == spec.options.get("default_language", "english")
+        )
+    return (
+        [tuple(item) for item in existing["key"]] == [tuple(item) for item in spec.keys]
+        and bool(existing.get("sparse")) == bool(spec.options.get("sparse"))
+        and ("expireAfterSeconds" in existing) == ("expireAfterSeconds" in spec.options)
+        and existing.get("partialFilterExpression") == spec.options.get("partialFilterExpression")
+    )
+
+
+async def sync_indexes(database, collections: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Приведение индексов к объявленным (без версии и блокировки: это делает MigrationManager):
+    - недостающие создаются;
+    - индекс с тем же именем, но другими ключами пересоздаётся;
+    - у TTL-индекса меняется только срок (collMod, без перестроения);
+    - индексы из RETIRED_INDEXES удаляются.
+    Возвращает {"created", "updated", "dropped", "failed"} со списками имён.
+    """
+    report = {"created": [], "updated": [], "dropped": [], "failed": []}
+    specs = [spec for spec in declared_indexes() if collections is None or spec.collection in collections]
+    existing_by_collection: Dict[str, Dict[str, Any]] = {}
+
+    for spec in specs:
+        label = f"{spec.collection}.{spec.name}"
+        collection = database[spec.collection]
+        try:
+            if spec.collection not in existing_by_collection:
+                existing_by_collection[spec.collection] = await collection.index_information()
+            existing = existing_by_collection[spec.collection].get(spec.name)
+            if existing is not None and not _same_index(existing, spec):
+                await collection.drop_index(spec.name)
+                existing = None
+            if existing is None:
+                await collection.create_index(spec.keys, **{**spec.options, "name": spec.name})
+                report["created"].append(label)
+            elif existing.get("expireAfterSeconds") != spec.options.get("expireAfterSeconds"):
+                await database.command(
+                    "collMod", spec.collection,
+                    index={"name": spec.name, "expireAfterSeconds": spec.options["expireAfterSeconds"]}
+                )
+                report["updated"].append(label)
+        except Exception as e:
+            print(f"   Index {label} failed: {e}")
+            report["failed"].append(label)
+
+    for collection_name, names in RETIRED_INDEXES.items():
+        if collections is not None and collection_name not in collections:
+            continue
+        existing = existing_by_collection.get(collection_name)
+        if existing is None:
+            existing = await database[collection_name].index_information()
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                await database[collection_name].drop_index(name)
+                report["dropped"].append(f"{collection_name}.{name}")
+            except Exception as e:
+                print(f"   Index {collection_name}.{name} drop failed: {e}")
+                report["failed"].append(f"{collection_name}.{name}")
+    return report
+
+
+def _student_v2(student: Dict[str, Any]):
+    """v2: пути изображений только списком image_paths, ключи поиска (search)"""
+    if student.get("image_paths") is None:
+        legacy = student.get("image_path")
+        student["image_paths"] = [legacy] if legacy else []
+    student.pop("image_path", None)
+    student.update(search_fields(student))
+
+
+# Шаги обновления заявки: версия -> функция, которая переводит документ из предыдущей версии.
+# Документы без schema_version - версия 1 (до появления версий)
+STUDENT_UPGRADES = {
+    2: _student_v2,
+}
+# Поля, которые читают шаги обновления
+STUDENT_MIGRATION_FIELDS = ("schema_version", "image_path", "image_paths", "fio", "school", "phone", "parent_phone")
+
+
+def upgrade_student(student: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Обновление заявки до STUDENT_SCHEMA_VERSION: $set/$unset для update_one
+    (None - заявка уже в текущей схеме). Документ читается с проекцией
+    STUDENT_MIGRATION_FIELDS, в обновление попадают только изменённые поля.
+    """
+    version = student.get("schema_version", 1)
+    if version >= STUDENT_SCHEMA_VERSION:
+        return None
+    upgraded = dict(student)
+    for target in range(version + 1, STUDENT_SCHEMA_VERSION + 1):
+        STUDENT_UPGRADES[target](upgraded)
+    upgraded["schema_version"] = STUDENT_SCHEMA_VERSION
+
+    update: Dict[str, Any] = {
+        "$set": {key: value for key, value in upgraded.items() if key not in student or student[key] != value}
+    }
+    removed = [key for key in student if key not in upgraded]
+    if removed:
+        update["$unset"] = {key: "" for key in removed}
+    return update
+
+
+class MigrationManager:
+    """
+    Версионированные миграции: индексы и схема заявок.
+
+    Объявления (declared_indexes) - единственное место, где описаны индексы.
+    Применённая версия (отпечаток объявлений) хранится в коллекции migrations:
+    при старте воркер сравнивает её с текущей и, если ничего не менялось,
+    не трогает индексы вовсе. Иначе один воркер берёт блокировку
+    и в фоне приводит индексы к объявленным; старт приложения не ждёт
+    построения индексов на большой коллекции.
+
+    Затем заявки старых версий (schema_version < STUDENT_SCHEMA_VERSION)
+    обновляются на месте: обход по _id пачками, одна пачка - один bulk_write.
+    Позиция и число обновлённых сохраняются после каждой пачки - перезапуск
+    продолжает с того же места. Все записывающие пути пишут заявки сразу
+    в текущей схеме, поэтому после миграции код чтения совместимость
+    со старыми документами не поддерживает.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _collection():
+        return get_database()[MIGRATIONS_COLLECTION]
+
+    async def start(self):
+        """Фоновое применение миграций (вызывается в lifespan)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        try:
+            await self.apply_indexes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Index migration failed: {e}")
+        try:
+            await self.migrate_students()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Student schema migration failed: {e}")
+
+    async def _acquire(self, state_id: str, pending: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Блокировка миграции (документ состояния после захвата).
+        pending - условие «миграция ещё не завершена»; None - версия уже
+        применена или её применяет другой воркер.
+        """
+        now = datetime.utcnow()
+        try:
+            return await self._collection().find_one_and_update(
+                {
+                    "_id": state_id,
+                    **pending,
+                    "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+                },
+                {"$set": {"locked_until": now + timedelta(seconds=MIGRATION_LOCK_SECONDS), "locked_by": self.owner}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def apply_indexes(self) -> Optional[Dict[str, Any]]:
+        """Приведение индексов к объявленным, если их версия изменилась. None - делать нечего"""
+        specs = declared_indexes()
+        fingerprint = indexes_fingerprint(specs)
+        if await self._acquire(INDEXES_STATE_ID, {"fingerprint": {"$ne": fingerprint}}) is None:
+            return None
+
+        print(f"🗂  Applying indexes {fingerprint}...")
+        started = datetime.utcnow()
+        report = await sync_indexes(get_database())
+        report["elapsed_s"] = round((datetime.utcnow() - started).total_seconds(), 1)
+        self.last_report = report
+
+        update: Dict[str, Any] = {"$set": {"locked_until": None}}
+        if not report["failed"]:
+            # Версия записывается только при полном успехе - иначе следующий старт повторит
+            update["$set"].update({"fingerprint": fingerprint, "applied_at": datetime.utcnow()})
+            update["$inc"] = {"version": 1}
+            update["$push"] = {
+                "history": {
+                    "$each": [{"fingerprint": fingerprint, "applied_at": datetime.utcnow(), "by": self.owner,
+                               **{key: report[key] for key in ("created", "updated", "dropped")}}],
+                    "$slice": -MIGRATION_HISTORY
+                }
+            }
+        await self._collection().update_one({"_id": INDEXES_STATE_ID, "locked_by": self.owner}, update)
+        print(
+            f"✅ Indexes {fingerprint}: created {len(report['created'])}, updated {len(report['updated'])}, "
+            f"dropped {len(report['dropped'])}, failed {len(report['failed'])} ({report['elapsed_s']}s)"
+        )
+        return report
+
+    async def migrate_students(self) -> Optional[Dict[str, Any]]:
+        """
+        Обновление заявок до STUDENT_SCHEMA_VERSION (см. upgrade_student).
+        Возвращает итог или None, если миграция уже завершена или идёт в другом воркере.
+        """
+        state = await self._acquire(STUDENTS_STATE_ID, {"completed_version": {"$ne": STUDENT_SCHEMA_VERSION}})
+        if state is None:
+            return None
+        if state.get("target_version") != STUDENT_SCHEMA_VERSION:
+            # Новая целевая версия - обход с начала коллекции
+            state.update({"target_version": STUDENT_SCHEMA_VERSION, "last_id": None, "migrated": 0, "scanned": 0})
+            await self._collection().update_one(
+                {"_id": STUDENTS_STATE_ID},
+                {"$set": {
+                    "target_version": STUDENT_SCHEMA_VERSION, "last_id": None, "migrated": 0, "scanned": 0,
+                    "started_at": datetime.utcnow(), "finished_at": None
+                }}
+            )
+
+        students = get_database().students
+        projection = {field: 1 for field in STUDENT_MIGRATION_FIELDS}
+        outdated = {"schema_version": {"$not": {"$gte": STUDENT_SCHEMA_VERSION}}}
+        total = await students.estimated_document_count()
+        last_id, migrated, scanned = state.get("last_id"), state.get("migrated", 0), state.get("scanned", 0)
+        batches = 0
+        if last_id is not None:
+            print(f"🗂  Resuming student schema migration to v{STUDENT_SCHEMA_VERSION} after {last_id}")
+
+        while True:
+            query = dict(outdated)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = await students.find(query, projection).sort("_id", 1).limit(STUDENT_MIGRATION_BATCH).to_list(
+                length=STUDENT_MIGRATION_BATCH
+            )
+            if not batch:
+                break
+            requests = []
+            for student in batch:
+                update = upgrade_student(student)
+                if update is not None:
+                    # Условие на версию: заявку, которую уже переписали, не трогаем
+                    requests.append(UpdateOne({"_id": student["_id"], **outdated}, update))
+            if requests:
+                result = await students.bulk_write(requests, ordered=False)
+                migrated += result.modified_count
+            scanned += len(batch)
+            last_id = batch[-1]["_id"]
+            await self._collection().update_one(
+                {"_id": STUDENTS_STATE_ID, "locked_by": self.owner},
+                {"$set": {
+                    "last_id": last_id, "migrated": migrated, "scanned": scanned, "total": total,
+                    "updated_at": datetime.utcnow(),
+                    "locked_until": datetime.utcnow() + timedelta(seconds=MIGRATION_LOCK_SECONDS)
+                }}
+            )
+            batches += 1
+            if batches % 20 == 0:
+                print(f"🗂  Student schema v{STUDENT_SCHEMA_VERSION}: {migrated} migrated (~{total} students)")
+            await asyncio.sleep(STUDENT_MIGRATION_PAUSE_SECONDS)
+
+        await self._collection().update_one(
+            {"_id": STUDENTS_STATE_ID, "locked_by": self.owner},
+            {"$set": {
+                "completed_version": STUDENT_SCHEMA_VERSION, "finished_at": datetime.utcnow(),
+                "migrated": migrated, "scanned": scanned, "locked_until": None
+            }}
+        )
+        print(f"✅ Student schema v{STUDENT_SCHEMA_VERSION}: {migrated} students migrated")
+        return {"migrated": migrated, "scanned": scanned}
+
+    async def snapshot(self) -> dict:
+        state = await self._collection().find_one({"_id": INDEXES_STATE_ID}, {"history": 0}) or {}
+        students = await self._collection().find_one({"_id": STUDENTS_STATE_ID}) or {}
+        return {
+            "indexes": {
+                "declared": indexes_fingerprint(declared_indexes()),
+                "applied": state.get("fingerprint"),
+                "version": state.get("version", 0),
+                "applied_at": state.get("applied_at"),
+                "locked_by": state.get("locked_by") if state.get("locked_until") else None
+            },
+            "last_report": self.last_report,
+            "students": {
+                "schema_version": STUDENT_SCHEMA_VERSION,
+                "completed_version": students.get("completed_version"),
+                "migrated": students.get("migrated", 0),
+                "scanned": students.get("scanned", 0),
+                "total": students.get("total"),
+                "last_id": str(students["last_id"]) if students.get("last_id") else None,
+                "started_at": students.get("started_at"),
+                "finished_at": students.get("finished_at"),
+                "locked_by": students.get("locked_by") if students.get("locked_until") else None
+            }
+        }
+
+
+migrations = MigrationManager()
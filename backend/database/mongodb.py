@@ -51,13 +51,7 @@ async def connect_to_mongo():
         
         db.db = db.client[settings.mongodb_db_name]
         
-        # Создаем индексы (если их ещё нет)
-        try:
-            await db.db.students.create_index("created_at")
-            await db.db.students.create_index("sent_to_amo")
-        except Exception as idx_error:
-            # Индексы могут уже существовать - это нормально
-            print(f"   Note: {idx_error}")
+        # Индексы объявлены в backend/database/migrations.py и применяются в фоне из lifespan
         
         print(f"✅ Connected to MongoDB: {settings.mongodb_db_name}")
         
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Проверка планов запросов: каждый запрос к students из routes/admin.py
+и services/amo.py выполняется через explain(), и если в выбранном плане есть
+COLLSCAN (полный проход коллекции), проверка завершается с кодом 1.
+
+Фильтры берутся из тех же функций, что строят их в приложении, поэтому
+новый фильтр без подходящего индекса (declared_indexes) ловится здесь,
+а не медленной админ-панелью на большой базе.
+
+Запуск (нужна MongoDB; --apply сначала приводит индексы к объявленным -
+для пустой базы в CI):
+    python -m backend.database.query_check
+    python -m backend.database.query_check --apply
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from backend.config import get_settings
+from backend.database.migrations import sync_indexes
+from backend.routes.admin import students_filter
+from backend.services.amo import SENT_WITH_LEAD_QUERY, unsent_students_query
+from backend.services.search import search_filter
+from backend.utils.pagination import KEYSET_SORT, encode_cursor, keyset_query
+
+
+class QueryShape(NamedTuple):
+    name: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, Any]]] = None
+    limit: int = 0
+
+
+def _page(query: dict) -> Tuple[dict, list]:
+    """Фильтр и сортировка страницы списка, открытой по курсору"""
+    cursor = encode_cursor({"created_at": datetime.utcnow(), "_id": ObjectId()}, "next")
+    page_query, sort, _ = keyset_query(query, cursor)
+    return page_query, sort
+
+
+def query_shapes() -> List[QueryShape]:
+    """Запросы к коллекции students в том виде, в каком их строит приложение"""
+    student_id = ObjectId()
+    return [
+        # routes/admin.py: список заявок (первая и следующая страница), фильтры, поиск
+        QueryShape("admin.students", students_filter(), KEYSET_SORT, 51),
+        QueryShape("admin.students page", *_page(students_filter()), 51),
+        QueryShape("admin.students sent_to_amo", students_filter(False), KEYSET_SORT, 51),
+        QueryShape("admin.students sent_to_amo page", *_page(students_filter(True)), 51),
+        QueryShape("admin.students search", students_filter(None, "иванов"), KEYSET_SORT, 51),
+        QueryShape("admin.students search short", students_filter(None, "ив"), KEYSET_SORT, 51),
+        QueryShape("admin.students search phone", students_filter(None, "+7 916 123"), KEYSET_SORT, 51),
+        QueryShape("admin.students search + sent_to_amo", students_filter(False, "лицей 57"), KEYSET_SORT, 51),
+        QueryShape("admin.students total", students_filter(True, "иванов")),
+        QueryShape("admin.students/search text", {"$text": {"$search": "иванов"}}, None, 20),
+        QueryShape(
+            "admin.students/search fallback",
+            {"$and": [search_filter("иванов"), {"_id": {"$nin": [student_id]}}, {"sent_to_amo": False}]},
+            KEYSET_SORT, 20
+        ),
+        QueryShape("admin.student by id", {"_id": student_id}),
+        QueryShape("admin.export-csv", students_filter(), [("created_at", -1)]),
+        QueryShape("admin.export-csv filtered", students_filter(True, "петров"), [("created_at", -1)]),
+        # services/amo.py: отправка неотправленных, проверка сделок, обновление статуса
+        QueryShape("amo.send unsent", unsent_students_query(), None, 100),
+        QueryShape("amo.send selected", unsent_students_query([str(student_id)]), None, 100),
+        QueryShape("amo.verify sent", SENT_WITH_LEAD_QUERY),
+        QueryShape("amo.update status", {"_id": student_id}),
+    ]
+
+
+def plan_stages(plan: Any) -> List[str]:
+    """Все стадии плана (в том числе вложенные и планы SBE-движка)"""
+    stages = []
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+async def explain_shape(database, shape: QueryShape) -> List[str]:
+    command: Dict[str, Any] = {"find": "students", "filter": shape.filter}
+    if shape.sort:
+        command["sort"] = dict(shape.sort)
+    if shape.limit:
+        command["limit"] = shape.limit
+    report = await database.command("explain", command, verbosity="queryPlanner")
+    return plan_stages(report.get("queryPlanner", {}).get("winningPlan", {}))
+
+
+async def check(database) -> bool:
+    """Проверка всех запросов. True - ни одного COLLSCAN"""
+    ok = True
+    for shape in query_shapes():
+        try:
+            stages = await explain_shape(database, shape)
+        except Exception as e:
+            print(f"❌ {shape.name:<40} explain failed: {e}")
+            ok = False
+            continue
+        collscan = "COLLSCAN" in stages
+        ok = ok and not collscan
+        plan = " > ".join(dict.fromkeys(stages))
+        print(f"{'❌' if collscan else '✅'} {shape.name:<40} {plan}")
+    return ok
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail on COLLSCAN in admin and AMO queries")
+    parser.add_argument("--apply", action="store_true", help="Сначала привести индексы к объявленным")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    client = AsyncIOMotorClient(settings.mongodb_uri)
+    database = client[settings.mongodb_db_name]
+    try:
+        if args.apply:
+            report = await sync_indexes(database)
+            print(f"Indexes: {report}")
+        ok = await check(database)
+    finally:
+        client.close()
+    if not ok:
+        print("\nЕсть запросы без подходящего индекса - добавьте его в declared_indexes()")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
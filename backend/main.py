@@ -6,7 +6,15 @@ from contextlib import asynccontextmanager
 import os
 
 from backend.database.mongodb import connect_to_mongo, close_mongo_connection
-from backend.routes import upload, admin
+from backend.database.migrations import migrations
+from backend.services.http_client import init_openrouter_client, close_openrouter_client
+from backend.services.ocr_jobs import job_manager
+from backend.services.storage import storage
+from backend.services.images import image_store
+from backend.services.executors import executors, loop_monitor
+from backend.services.student_stats import student_stats
+from backend.routes import upload, admin, files
+from backend.utils.uploads import RequestSizeLimitMiddleware
 from backend.config import get_settings
 
 settings = get_settings()
@@ -14,9 +22,24 @@ settings = get_settings()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Lifecycle events для подключения/отключения от MongoDB"""
+    """Lifecycle events для подключения/отключения от MongoDB и OpenRouter"""
     await connect_to_mongo()
+    await migrations.start()
+    await init_openrouter_client()
+    executors.start()
+    await loop_monitor.start()
+    await job_manager.start()
+    await image_store.start()
+    await student_stats.start()
     yield
+    await student_stats.stop()
+    await image_store.stop()
+    await job_manager.stop()
+    await loop_monitor.stop()
+    await migrations.stop()
+    executors.shutdown()
+    await close_openrouter_client()
+    await storage.close()
     await close_mongo_connection()
 
 
@@ -39,13 +62,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Слишком большие загрузки отклоняются до разбора multipart
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    limits={f"/api{path}": limit for path, limit in upload.UPLOAD_BODY_LIMITS.items()}
+)
+
 # Подключаем роуты
 app.include_router(upload.router, prefix="/api", tags=["Upload"])
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
-
-# Статические файлы для изображений
-if os.path.exists("uploads"):
-    app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Изображения из хранилища (local / GridFS / S3) с ETag и Range
+app.include_router(files.router, tags=["Files"])
 
 # Статические файлы для frontend
 if os.path.exists("frontend"):
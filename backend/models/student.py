@@ -3,6 +3,12 @@ from typing import Optional
 from datetime import datetime
 from bson import ObjectId
 
+# Версия схемы документа заявки (поле schema_version):
+# 1 - без версии, путь изображения мог храниться строкой image_path
+# 2 - только список image_paths, ключи поиска в поле search
+# Старые документы обновляет миграция в backend/database/migrations.py
+STUDENT_SCHEMA_VERSION = 2
+
 
 class PyObjectId(ObjectId):
     @classmethod
@@ -41,7 +47,8 @@ class StudentCreate(StudentBase):
 
 class StudentInDB(StudentBase):
     id: str = Field(default=None, alias="_id")
-    image_paths: Optional[list[str]] = Field(default=None, description="Пути к изображениям (может быть несколько)")
+    schema_version: int = STUDENT_SCHEMA_VERSION
+    image_paths: list[str] = Field(default_factory=list, description="Пути к изображениям (может быть несколько)")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     sent_to_amo: bool = False
     amo_contact_id: Optional[str] = None
@@ -76,14 +83,21 @@ class StudentResponse(BaseModel):
         populate_by_name = True
 
 
+# Служебные поля результатов OCR, которые модель не заполняет
+OCR_SERVICE_FIELDS = {"raw_response", "from_cache", "preprocess"}
+
+
 class OCRResult(BaseModel):
-    fio: str = ""
-    school: str = ""
-    student_class: str = Field(default="", alias="class")
-    phone: str = ""
-    parent_name: Optional[str] = None
-    parent_phone: Optional[str] = None
+    # Описания полей попадают в JSON-схему ответа модели (structured output)
+    fio: str = Field(default="", description="ФИО ученика полностью, пустая строка если не распознано")
+    school: str = Field(default="", description="Название школы, пустая строка если не распознано")
+    student_class: str = Field(default="", alias="class", description='Номер и буква класса, например "5А" или "11Б"')
+    phone: str = Field(default="", description="Номер телефона ученика, пустая строка если не распознан")
+    parent_name: Optional[str] = Field(default=None, description="Имя родителя или null, если не указано")
+    parent_phone: Optional[str] = Field(default=None, description="Телефон родителя или null, если не указан")
     raw_response: Optional[dict] = None
+    from_cache: bool = False  # Результат взят из кэша OCR
+    preprocess: Optional[dict] = None  # Статистика нормализации изображения
 
     class Config:
         populate_by_name = True
@@ -91,10 +105,12 @@ class OCRResult(BaseModel):
 
 class FeedbackOCRResult(BaseModel):
     """Результат OCR для второй страницы (обратная связь)"""
-    masterclass_rating: Optional[int] = None  # Оценка мастер-класса (1-10)
-    speaker_rating: Optional[int] = None  # Оценка спикера (1-10)
-    feedback: str = ""  # Свободная форма обратной связи
+    masterclass_rating: Optional[int] = Field(default=None, description="Оценка мастер-класса от 1 до 10 или null")
+    speaker_rating: Optional[int] = Field(default=None, description="Оценка спикера от 1 до 10 или null")
+    feedback: str = Field(default="", description="Свободная форма обратной связи, пустая строка если нет")
     raw_response: Optional[dict] = None
+    from_cache: bool = False  # Результат взят из кэша OCR
+    preprocess: Optional[dict] = None  # Статистика нормализации изображения
 
     class Config:
         populate_by_name = True
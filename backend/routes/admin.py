@@ -1,13 +1,27 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Response, Request
 from fastapi.responses import JSONResponse, StreamingResponse
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 from datetime import timedelta
 from bson import ObjectId
 import csv
 import io
+import json
+import time
 from backend.database.mongodb import get_students_collection
+from backend.database.migrations import migrations
 from backend.services.amo import send_students_to_amo, verify_sent_to_amo
+from backend.services.ocr_scheduler import ocr_scheduler
+from backend.services.ocr_cache import ocr_cache
+from backend.services.ocr_routing import model_router
+from backend.services.images import image_store
+from backend.services.derivatives import derivative_cache
+from backend.services.duplicates import duplicate_detector
+from backend.services.image_quality import quality_gate
+from backend.services.executors import executors, loop_monitor
+from backend.services.student_stats import student_stats
+from backend.services.search import student_search, search_filter, search_fields, SEARCH_SOURCE_FIELDS
 from backend.utils.auth import authenticate_admin, get_current_admin, ACCESS_TOKEN_EXPIRE_MINUTES
+from backend.utils.pagination import keyset_query, page_cursors
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -58,42 +72,77 @@ async def admin_logout(response: Response):
     return {"success": True, "message": "Выход выполнен"}
 
 
+# Сколько секунд держать точное число заявок по фильтру (count_documents - полный проход по индексу)
+TOTAL_CACHE_SECONDS = 30
+_total_cache: Dict[str, Tuple[float, int]] = {}
+
+
+def students_filter(sent_to_amo: Optional[bool] = None, search: Optional[str] = None) -> dict:
+    """Фильтр заявок для списка и экспорта"""
+    query = {}
+    if sent_to_amo is not None:
+        query["sent_to_amo"] = sent_to_amo
+    if search:
+        query.update(search_filter(search) or {})
+    return query
+
+
+async def _count_students(students_collection, query: dict) -> int:
+    """Число заявок по фильтру с кэшем на TOTAL_CACHE_SECONDS"""
+    key = json.dumps(query, sort_keys=True, default=str)
+    cached = _total_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    if query:
+        total = await students_collection.count_documents(query)
+    else:
+        # Без фильтра - из метаданных коллекции, без прохода по документам
+        total = await students_collection.estimated_document_count()
+    _total_cache[key] = (time.monotonic() + TOTAL_CACHE_SECONDS, total)
+    return total
+
+
 @router.get("/students")
 async def get_students(
     request: Request,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 50,
     sent_to_amo: Optional[bool] = None,
     search: Optional[str] = None,
+    with_total: bool = False,
     _: bool = Depends(get_current_admin)
 ):
     """
-    Получение списка всех заявок учеников.
+    Получение списка всех заявок учеников (новые сверху).
     
     Query params:
-    - skip: Пропустить N записей (пагинация)
+    - cursor: Курсор страницы из next/prev предыдущего ответа (без него - первая страница)
     - limit: Количество записей (макс 100)
     - sent_to_amo: Фильтр по статусу отправки в AMO
-    - search: Поиск по ФИО
+    - search: Поиск по ФИО, школе и телефону (начало слова или подстрока, без учёта регистра и ё)
+    - with_total: Вернуть общее число заявок по фильтру (кэшируется на TOTAL_CACHE_SECONDS)
+    
+    Пагинация по ключу (created_at, _id) вместо skip: любая страница
+    читается по индексу так же быстро, как первая.
     """
     students_collection = await get_students_collection()
     
-    # Формируем фильтр
-    query = {}
-    if sent_to_amo is not None:
-        query["sent_to_amo"] = sent_to_amo
-    if search:
-        query["fio"] = {"$regex": search, "$options": "i"}
+    query = students_filter(sent_to_amo, search)
     
     # Ограничиваем limit
-    limit = min(limit, 100)
+    limit = max(1, min(limit, 100))
     
-    # Получаем общее количество
-    total = await students_collection.count_documents(query)
+    # Получаем записи: на одну больше, чтобы узнать, есть ли следующая страница
+    page_query, sort, direction = keyset_query(query, cursor)
+    students = await students_collection.find(page_query).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+    has_more = len(students) > limit
+    students = students[:limit]
+    if direction == "prev":
+        students.reverse()
+    next_cursor, prev_cursor = page_cursors(students, direction, has_more, from_cursor=bool(cursor))
     
-    # Получаем записи
-    cursor = students_collection.find(query).sort("created_at", -1).skip(skip).limit(limit)
-    students = await cursor.to_list(length=limit)
+    # Точное количество - только по запросу
+    total = await _count_students(students_collection, query) if with_total else None
     
     # Преобразуем ObjectId в строки
     result = []
@@ -101,22 +150,55 @@ async def get_students(
         student["id"] = str(student["_id"])
         student["_id"] = str(student["_id"])
         
-        # Обратная совместимость: если есть image_path, но нет image_paths, создаём массив
-        if "image_path" in student and "image_paths" not in student:
-            student["image_paths"] = [student["image_path"]] if student.get("image_path") else []
-        
-        # Удаляем сырые данные OCR из ответа (они большие)
+        # Удаляем сырые данные OCR (они большие) и служебные ключи поиска
         student.pop("ocr_raw", None)
+        student.pop("search", None)
         result.append(student)
     
     return {
         "students": result,
         "total": total,
-        "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next": next_cursor,
+        "prev": prev_cursor
     }
 
 
+@router.get("/students/search")
+async def search_students(
+    q: str,
+    limit: int = 20,
+    sent_to_amo: Optional[bool] = None,
+    _: bool = Depends(get_current_admin)
+):
+    """
+    Поиск заявок с ранжированием (лучшие совпадения сверху).
+    
+    Query params:
+    - q: Строка поиска (ФИО, школа, телефон)
+    - limit: Количество записей (макс 100)
+    - sent_to_amo: Фильтр по статусу отправки в AMO
+    
+    Сначала совпадения по текстовому индексу с русской морфологией
+    (ФИО весомее школы), затем совпадения по началу слова и подстроке.
+    """
+    limit = max(1, min(limit, 100))
+    base_query = {"sent_to_amo": sent_to_amo} if sent_to_amo is not None else None
+    
+    started = time.perf_counter()
+    students = await student_search.ranked(q, limit, base_query)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    for student in students:
+        student["id"] = str(student["_id"])
+        student["_id"] = str(student["_id"])
+        student.pop("search", None)
+        if "score" in student:
+            student["score"] = round(student["score"], 3)
+    
+    return {"students": students, "limit": limit, "took_ms": round(elapsed_ms, 2)}
+
+
 @router.get("/students/{student_id}")
 async def get_student(
     student_id: str,
@@ -140,6 +222,7 @@ async def get_student(
         )
     
     student["_id"] = str(student["_id"])
+    student.pop("search", None)
     return student
 
 
@@ -148,23 +231,30 @@ async def delete_student(
     student_id: str,
     _: bool = Depends(get_current_admin)
 ):
-    """Удаление заявки ученика"""
+    """Удаление заявки ученика (изображения удаляются, если на них больше никто не ссылается)"""
     students_collection = await get_students_collection()
     
     try:
-        result = await students_collection.delete_one({"_id": ObjectId(student_id)})
+        student = await students_collection.find_one_and_delete(
+            {"_id": ObjectId(student_id)},
+            projection={"image_paths": 1, "sent_to_amo": 1}
+        )
     except:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Неверный формат ID"
         )
     
-    if result.deleted_count == 0:
+    if student is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ученик не найден"
         )
     
+    await image_store.release(student.get("image_paths") or [], student["_id"])
+    await student_stats.student_deleted(student.get("sent_to_amo"))
+    _total_cache.clear()
+    
     return {"success": True, "message": "Заявка удалена"}
 
 
@@ -197,9 +287,9 @@ async def update_student(
         )
     
     try:
-        result = await students_collection.update_one(
+        current = await students_collection.find_one(
             {"_id": ObjectId(student_id)},
-            {"$set": update_data}
+            {field: 1 for field in SEARCH_SOURCE_FIELDS}
         )
     except:
         raise HTTPException(
@@ -207,7 +297,16 @@ async def update_student(
             detail="Неверный формат ID"
         )
     
-    if result.matched_count == 0:
+    result = None
+    if current:
+        # Ключи поиска пересчитываются вместе с полями, из которых они строятся
+        update_data.update(search_fields({**current, **update_data}))
+        result = await students_collection.update_one(
+            {"_id": current["_id"]},
+            {"$set": update_data}
+        )
+    
+    if result is None or result.matched_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ученик не найден"
@@ -245,17 +344,57 @@ async def send_to_amo(
 
 @router.get("/stats")
 async def get_stats(_: bool = Depends(get_current_admin)):
-    """Получение статистики по заявкам"""
-    students_collection = await get_students_collection()
-    
-    total = await students_collection.count_documents({})
-    sent = await students_collection.count_documents({"sent_to_amo": True})
-    not_sent = await students_collection.count_documents({"sent_to_amo": False})
+    """
+    Получение статистики по заявкам.
     
+    Счётчики читаются из одного документа (services/student_stats.py),
+    без подсчёта по коллекции.
+    """
+    return await student_stats.get()
+
+
+@router.post("/stats/reconcile")
+async def reconcile_stats(_: bool = Depends(get_current_admin)):
+    """Внеочередная сверка счётчиков статистики с коллекцией заявок"""
+    counters = await student_stats.reconcile()
+    return {"success": True, **counters, "drift": student_stats.last_reconcile["drift"]}
+
+
+@router.get("/metrics")
+async def get_metrics(_: bool = Depends(get_current_admin)):
+    """
+    Метрики: планировщик запросов к OpenRouter, маршрутизация по моделям, кэш OCR
+    хранилище изображений (объём, ссылки, экономия от перекодирования), кэш миниатюр
+    поиск повторно загруженных анкет, проверка качества фото (время каждой проверки),
+    пулы CPU-bound работы, задержка event loop, версия применённых индексов, счётчики заявок
+    """
     return {
-        "total": total,
-        "sent_to_amo": sent,
-        "not_sent": not_sent
+        "ocr_scheduler": ocr_scheduler.snapshot(),
+        "ocr_routing": model_router.snapshot(),
+        "ocr_cache": ocr_cache.stats,
+        "images": await image_store.usage(),
+        "image_derivatives": derivative_cache.snapshot(),
+        "ocr_duplicates": duplicate_detector.snapshot(),
+        "image_quality": quality_gate.snapshot(),
+        "executors": executors.snapshot(),
+        "event_loop": loop_monitor.snapshot(),
+        "migrations": await migrations.snapshot(),
+        "student_stats": await student_stats.snapshot()
+    }
+
+
+@router.post("/uploads/sweep")
+async def sweep_uploads(_: bool = Depends(get_current_admin)):
+    """
+    Немедленный запуск сборщика брошенных загрузок
+    (фото, по которым заявка так и не была сохранена).
+    Возвращает число удалённых объектов и освобождённый объём.
+    """
+    report = await image_store.sweep()
+    return {
+        "success": True,
+        "message": f"Удалено брошенных загрузок: {report['deleted']}",
+        **report
     }
 
 
@@ -307,16 +446,11 @@ async def export_to_csv(
     
     Query params:
     - sent_to_amo: Фильтр по статусу отправки в AMO
-    - search: Поиск по ФИО
+    - search: Поиск по ФИО, школе и телефону
     """
     students_collection = await get_students_collection()
     
-    # Формируем фильтр (аналогично get_students)
-    query = {}
-    if sent_to_amo is not None:
-        query["sent_to_amo"] = sent_to_amo
-    if search:
-        query["fio"] = {"$regex": search, "$options": "i"}
+    query = students_filter(sent_to_amo, search)
     
     # Получаем все записи (без пагинации для экспорта)
     cursor = students_collection.find(query).sort("created_at", -1)
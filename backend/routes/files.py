@@ -0,0 +1,139 @@
+import re
+from email.utils import format_datetime
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.responses import RedirectResponse, StreamingResponse
+from backend.config import get_settings
+from backend.services.derivatives import derivative_cache, DERIVATIVE_SIZES
+from backend.services.images import image_store
+from backend.services.storage import Storage, StoredObject, storage, image_path, IMAGE_URL_PREFIX
+
+settings = get_settings()
+router = APIRouter()
+
+# Поддерживается один диапазон: bytes=start-end, bytes=start- и bytes=-suffix
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Диапазон байт (start, end включительно) из заголовка Range.
+    None - диапазон невыполним (416).
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Последние N байт
+        length = int(end)
+        if length == 0 or size == 0:
+            return None
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = size - 1 if end == "" else min(int(end), size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Слабое сравнение: W/"..." совпадает с "..."
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+async def _serve(store: Storage, stored: StoredObject, request: Request):
+    """Ответ с объектом хранилища: ETag / 304, Cache-Control, Range (206 / 416), поток"""
+    etag = f'"{stored.etag}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={settings.image_cache_max_age}, immutable",
+        "Last-Modified": format_datetime(stored.last_modified, usegmt=True),
+        "Accept-Ranges": "bytes"
+    }
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end = 0, stored.size - 1
+    status_code = status.HTTP_200_OK
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # Несколько диапазонов не поддерживаем - по RFC 9110 можно отдать файл целиком
+    if range_header and "," not in range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, stored.size)
+        if byte_range is None:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{stored.size}"}
+            )
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+
+    headers["Content-Length"] = str(max(0, end - start + 1))
+    if request.method == "HEAD" or stored.size == 0:
+        return Response(status_code=status_code, headers=headers, media_type=stored.content_type)
+
+    return StreamingResponse(
+        store.get(stored.key, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=stored.content_type
+    )
+
+
+def _not_found() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Изображение не найдено"
+    )
+
+
+@router.api_route(f"/{IMAGE_URL_PREFIX}/{{key}}", methods=["GET", "HEAD"])
+async def get_image(key: str, request: Request):
+    """
+    Отдача изображения из хранилища.
+
+    - ETag / If-None-Match (304) и Cache-Control: ключ изображения - хэш
+      содержимого, объект под ключом не меняется, поэтому его можно долго кэшировать
+    - оригинал, заменённый архивной копией, перенаправляется на неё (301)
+    - Range: один диапазон байт (206 / 416)
+    - файл отдаётся потоком, целиком в памяти не собирается
+    """
+    stored = await storage.stat(key)
+    if stored is None:
+        # Оригинал заменён архивной копией - старые ссылки продолжают работать
+        replacement = await image_store.replacement(key)
+        if replacement:
+            return RedirectResponse(f"/{image_path(replacement)}", status_code=status.HTTP_301_MOVED_PERMANENTLY)
+        raise _not_found()
+
+    return await _serve(storage, stored, request)
+
+
+@router.api_route(f"/{IMAGE_URL_PREFIX}/{{variant}}/{{key}}", methods=["GET", "HEAD"])
+async def get_image_derivative(variant: str, key: str, request: Request):
+    """
+    Миниатюра (thumb) или превью (preview) изображения в WebP.
+    Создаётся при первом запросе и кэшируется (см. services/derivatives.py),
+    заголовки кэширования - как у оригинала.
+    """
+    if variant not in DERIVATIVE_SIZES:
+        raise _not_found()
+
+    stored = await derivative_cache.get(variant, key)
+    if stored is None:
+        replacement = await image_store.replacement(key)
+        if replacement:
+            return RedirectResponse(
+                f"/{image_path(f'{variant}/{replacement}')}",
+                status_code=status.HTTP_301_MOVED_PERMANENTLY
+            )
+        raise _not_found()
+
+    return await _serve(derivative_cache.storage, stored, request)
@@ -1,89 +1,143 @@
-import os
-import uuid
+import json
+import asyncio
 from datetime import datetime
-from typing import Optional
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status
-from backend.services.ocr import process_image_ocr, process_feedback_image_ocr
+from bson import ObjectId
+from typing import Optional, List
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from backend.services.ocr import (
+    process_combined_ocr,
+    stream_page_ocr,
+    ocr_result_payload,
+    feedback_result_payload
+)
+from backend.services.ocr_jobs import job_manager, JOB_KINDS, FINAL_STATUSES
+from backend.services.ocr_scheduler import OCRServiceUnavailable
 from backend.database.mongodb import get_students_collection
+from backend.services.storage import storage, image_path
+from backend.services.images import image_store
+from backend.services.duplicates import duplicate_detector, duplicate_events, duplicate_warning, recognize_stored_page
+from backend.services.image_quality import quality_gate
+from backend.services.search import search_fields
+from backend.services.student_stats import student_stats
+from backend.models.student import STUDENT_SCHEMA_VERSION
+from backend.utils.uploads import IngestedFile
+from backend.config import get_settings
 
+settings = get_settings()
 router = APIRouter()
 
-# Путь к директории загрузок
-# На Render используем временную директорию, в production лучше использовать GridFS
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_BATCH_FILES = 10  # Максимум файлов в одной пакетной загрузке
+# Запас на заголовки multipart и текстовые поля формы
+MULTIPART_OVERHEAD = 64 * 1024
+# Код 422 числом: название константы различается между версиями starlette
+HTTP_422_UNPROCESSABLE = 422
 
-# Создаем директорию для загрузок если не существует
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Ограничения размера тела запроса (проверяются до разбора multipart, см. RequestSizeLimitMiddleware)
+UPLOAD_BODY_LIMITS = {
+    "/upload": MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    "/upload/batch": MAX_BATCH_FILES * MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    "/upload/combined": 2 * MAX_FILE_SIZE + MULTIPART_OVERHEAD
+}
+
+# Интервал опроса статуса задачи в SSE потоке, сек
+# (задача может выполняться в другом воркере uvicorn - тогда узнаём о ней из MongoDB)
+SSE_POLL_SECONDS = 2
+# Интервал keep-alive комментариев в SSE потоке, сек
+SSE_KEEPALIVE_SECONDS = 15
+
+
+async def _save_upload_file(file: UploadFile) -> IngestedFile:
+    """
+    Проверка и сохранение загруженного изображения в хранилище.
+    Файл пишется потоково, целиком в памяти не держится:
+    тип проверяется по сигнатуре, размер - до начала записи.
+    Ключ - хэш содержимого: повторная загрузка того же фото не дублируется.
+    """
+    return await image_store.save_upload(file, MAX_FILE_SIZE)
+
+
+async def _remove_uploads(uploads: List[IngestedFile]):
+    """Удаление сохранённых файлов, если запрос не удался (чужие и уже используемые не трогаем)"""
+    await image_store.discard(uploads)
+
+
+async def _check_quality(file: UploadFile, uploads: List[IngestedFile]) -> Optional[dict]:
+    """
+    Проверка качества фото перед OCR. Если фото не пройдёт распознавание
+    (размыто, темно, лист далеко), сохранённые файлы запроса удаляются
+    и клиент сразу получает 422 с подсказкой, как переснять.
+    """
+    report = await quality_gate.check(file)
+    if report is not None and not report["passed"]:
+        await _remove_uploads(uploads)
+        raise HTTPException(
+            status_code=HTTP_422_UNPROCESSABLE,
+            detail=f"{file.filename}: {report['message']}" if len(uploads) > 1 else report["message"]
+        )
+    return report
+
+
+def _ocr_unavailable_error() -> HTTPException:
+    """Ответ на случай, когда OpenRouter недоступен после всех повторов"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервис распознавания перегружен, повторите попытку через минуту",
+        headers={"Retry-After": "60"}
+    )
 
 
 @router.post("/upload")
 async def upload_photo(
     file: UploadFile = File(...),
-    application_type: str = Form(...)
+    application_type: str = Form(...),
+    check_duplicates: bool = Form(True),
+    check_quality: bool = Form(True)
 ):
     """
     Загрузка фотографии с данными ученика и распознавание через OCR.
     
     - Принимает изображение (jpg, jpeg, png, webp)
     - Принимает тип заявки (application_type)
-    - Обрабатывает через OCR (OpenRouter + Gemini)
+    - Обрабатывает через OCR (OpenRouter, цепочка моделей ocr_model_chain)
+    - Если это же фото уже распознавалось, OCR не вызывается: возвращается
+      прежний результат и предупреждение duplicate; для похожего фото
+      распознавание идёт как обычно, а прежний результат приходит подсказкой
+      в duplicate.data (check_duplicates=false - без проверки)
+    - Размытое, тёмное или снятое издалека фото отклоняется до OCR (422 с подсказкой;
+      check_quality=false - отправить в OCR как есть)
     - Возвращает распознанные данные для редактирования (НЕ сохраняет в БД)
     
     Returns:
         Распознанные данные ученика (можно отредактировать перед сохранением)
     """
-    # Проверяем тип файла
-    allowed_types = ["image/jpeg", "image/png", "image/webp", "image/gif"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_types)}"
-        )
-    
-    # Читаем содержимое файла
-    contents = await file.read()
-    
-    # Проверяем размер (макс 10MB)
-    max_size = 10 * 1024 * 1024  # 10MB
-    if len(contents) > max_size:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Файл слишком большой. Максимальный размер: 10MB"
-        )
-    
-    # Генерируем уникальное имя файла
-    file_extension = os.path.splitext(file.filename)[1] or ".jpg"
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    # Сохраняем файл временно (будет сохранён после редактирования)
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    saved = await _save_upload_file(file)
+    file_path = image_path(saved.key)
+    quality = await _check_quality(file, [saved]) if check_quality else None
     
     try:
-        # Обрабатываем через OCR
-        ocr_result = await process_image_ocr(contents, file.filename)
+        # Обрабатываем через OCR (или берём результат того же фото)
+        payload = await recognize_stored_page("student", saved.key, file.filename, saved.sha256, check_duplicates)
         
         # Возвращаем данные для редактирования (НЕ сохраняем в БД)
         return {
             "success": True,
             "message": "Данные распознаны, проверьте и отредактируйте при необходимости",
             "image_path": file_path,  # Временный путь к файлу (для обратной совместимости)
-            "data": {
-                "fio": ocr_result.fio,
-                "school": ocr_result.school,
-                "class": ocr_result.student_class,
-                "phone": ocr_result.phone,
-                "parent_name": ocr_result.parent_name,
-                "parent_phone": ocr_result.parent_phone
-            },
-            "ocr_raw": ocr_result.raw_response
+            **payload,
+            "quality": quality
         }
         
+    except OCRServiceUnavailable:
+        # Распознавание не состоялось - удаляем файл, клиент повторит загрузку
+        await _remove_uploads([saved])
+        
+        raise _ocr_unavailable_error()
+        
     except Exception as e:
         # Удаляем файл при ошибке
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await _remove_uploads([saved])
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -93,67 +147,409 @@ async def upload_photo(
 
 @router.post("/upload/feedback")
 async def upload_feedback_photo(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    check_duplicates: bool = Form(True),
+    check_quality: bool = Form(True)
 ):
     """
     Загрузка фото второй страницы анкеты (обратная связь) и распознавание через OCR.
     
-    Возвращает оценки и отзывы для редактирования.
+    Возвращает оценки и отзывы для редактирования
+    (для того же фото - прежний результат, для похожего - подсказка в duplicate).
+    Непригодное для распознавания фото отклоняется до OCR, как в POST /api/upload.
+    """
+    saved = await _save_upload_file(file)
+    file_path = image_path(saved.key)
+    quality = await _check_quality(file, [saved]) if check_quality else None
+    
+    try:
+        # Обрабатываем через OCR (или берём результат того же фото)
+        payload = await recognize_stored_page("feedback", saved.key, file.filename, saved.sha256, check_duplicates)
+        
+        # Возвращаем данные для редактирования
+        return {
+            "success": True,
+            "message": "Данные обратной связи распознаны",
+            "image_path": file_path,
+            **payload,
+            "quality": quality
+        }
+        
+    except OCRServiceUnavailable:
+        # Распознавание не состоялось - удаляем файл, клиент повторит загрузку
+        await _remove_uploads([saved])
+        
+        raise _ocr_unavailable_error()
+        
+    except Exception as e:
+        # Удаляем файл при ошибке
+        await _remove_uploads([saved])
+        
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка обработки изображения: {str(e)}"
+        )
+
+
+@router.post("/upload/stream")
+async def upload_photo_stream(
+    file: UploadFile = File(...),
+    kind: str = Form("student"),
+    application_type: Optional[str] = Form(None),
+    check_duplicates: bool = Form(True),
+    check_quality: bool = Form(True)
+):
+    """
+    Загрузка фото с потоковым распознаванием (Server-Sent Events).
+    
+    Поля отправляются клиенту по мере того, как модель их генерирует:
+    - event: field - {"name": ..., "value": ...}
+    - event: done - итоговый результат (как в POST /api/upload) + image_path
+    
+    - kind: "student" (первая страница) или "feedback" (обратная связь)
+    - для того же фото поля приходят сразу из прошлого распознавания (done.duplicate),
+      для похожего - распознаются, а прежний результат приходит подсказкой в done.duplicate
+    - непригодное для распознавания фото отклоняется до начала потока (422)
     """
-    # Проверяем тип файла
-    allowed_types = ["image/jpeg", "image/png", "image/webp", "image/gif"]
-    if file.content_type not in allowed_types:
+    if kind not in JOB_KINDS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_types)}"
+            detail=f"Неизвестный тип страницы. Разрешены: {', '.join(JOB_KINDS)}"
+        )
+    
+    saved = await _save_upload_file(file)
+    file_path = image_path(saved.key)
+    if check_quality:
+        await _check_quality(file, [saved])
+    
+    # Поиск дубликата и начало ответа модели - до отправки заголовков: ошибки
+    # вернутся обычным HTTP статусом, а сохранённый файл удаляется, как в POST /api/upload
+    try:
+        duplicate = await duplicate_detector.find(saved.key, kind) if check_duplicates else None
+        if duplicate is not None and duplicate["exact"]:
+            events = duplicate_events(duplicate)
+        else:
+            events = stream_page_ocr(await storage.read(saved.key), file.filename, kind, image_hash=saved.sha256)
+        first_event = await events.__anext__()
+    except OCRServiceUnavailable:
+        await _remove_uploads([saved])
+        raise _ocr_unavailable_error()
+    except Exception as e:
+        await _remove_uploads([saved])
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка обработки изображения: {str(e)}"
         )
     
-    # Читаем содержимое файла
-    contents = await file.read()
+    def format_event(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
     
-    # Проверяем размер (макс 10MB)
-    max_size = 10 * 1024 * 1024  # 10MB
-    if len(contents) > max_size:
+    async def event_stream():
+        event, data = first_event
+        yield format_event(event, {**data, "image_path": file_path})
+        try:
+            async for event, data in events:
+                if event == "done":
+                    if duplicate is None or not duplicate["exact"]:
+                        await duplicate_detector.remember(saved.key, kind, data)
+                    if duplicate is not None and not duplicate["exact"]:
+                        data = {**data, "duplicate": duplicate_warning(duplicate)}
+                    data = {"success": True, "image_path": file_path, **data}
+                yield format_event(event, data)
+        except Exception as e:
+            print(f"Streaming OCR failed: {e}")
+            # Распознавание не завершилось - удаляем файл, как и до начала потока
+            await _remove_uploads([saved])
+            yield format_event("error", {"detail": f"Ошибка обработки изображения: {str(e)}"})
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/upload/jobs")
+async def create_ocr_job(
+    file: UploadFile = File(...),
+    kind: str = Form("student"),
+    application_type: Optional[str] = Form(None),
+    check_duplicates: bool = Form(True),
+    check_quality: bool = Form(True)
+):
+    """
+    Загрузка фото в режиме фоновой задачи.
+    
+    Сразу возвращает job_id, распознавание выполняется пулом воркеров.
+    Результат доступен через GET /api/upload/jobs/{job_id}
+    или поток событий GET /api/upload/jobs/{job_id}/events (SSE).
+    
+    - kind: "student" (первая страница) или "feedback" (обратная связь)
+    - качество фото проверяется сразу, до постановки в очередь (422 с подсказкой)
+    """
+    if kind not in JOB_KINDS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Файл слишком большой. Максимальный размер: 10MB"
+            detail=f"Неизвестный тип задачи. Разрешены: {', '.join(JOB_KINDS)}"
         )
     
-    # Генерируем уникальное имя файла
-    file_extension = os.path.splitext(file.filename)[1] or ".jpg"
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    saved = await _save_upload_file(file)
+    file_path = image_path(saved.key)
+    if check_quality:
+        await _check_quality(file, [saved])
     
-    # Сохраняем файл временно
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    try:
+        job = await job_manager.submit(kind, file_path, file.filename, application_type, check_duplicates)
+    except asyncio.QueueFull:
+        await _remove_uploads([saved])
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Очередь распознавания переполнена, повторите попытку позже"
+        )
+    
+    return {
+        "success": True,
+        "job_id": job["_id"],
+        "status": job["status"],
+        "image_path": file_path
+    }
+
+
+@router.get("/upload/jobs/{job_id}")
+async def get_ocr_job(job_id: str):
+    """Получение статуса и результата фоновой задачи распознавания"""
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задача не найдена"
+        )
+    return job
+
+
+@router.get("/upload/jobs/{job_id}/events")
+async def stream_ocr_job(job_id: str, request: Request):
+    """
+    Поток Server-Sent Events со статусом задачи.
+    Событие "status" отправляется при каждом изменении, поток закрывается
+    после перехода задачи в done/failed.
+    """
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задача не найдена"
+        )
+    
+    async def event_stream():
+        last_status = None
+        current = job
+        idle = 0.0
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                idle = 0.0
+                yield f"event: status\ndata: {json.dumps(current, default=str, ensure_ascii=False)}\n\n"
+                if last_status in FINAL_STATUSES:
+                    return
+            
+            if await request.is_disconnected():
+                return
+            
+            changed = await job_manager.wait_for_update(job_id, timeout=SSE_POLL_SECONDS)
+            if not changed:
+                idle += SSE_POLL_SECONDS
+                if idle >= SSE_KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+            
+            current = await job_manager.get(job_id)
+            if not current:
+                return
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    application_type: str = Form(...),
+    pages: Optional[str] = Form(None),
+    check_quality: bool = Form(True)
+):
+    """
+    Загрузка нескольких фото анкеты одним запросом.
+    
+    - files: изображения (все сохраняются)
+    - pages: JSON массив той же длины с типом каждого файла:
+      "student" (первая страница), "feedback" (обратная связь) или "skip" (только сохранить).
+      По умолчанию распознаётся только первый файл как первая страница.
+    
+    OCR выполняется параллельно (не более ocr_batch_concurrency одновременно)
+    и только для файлов, помеченных student/feedback. Страница, не прошедшая
+    проверку качества, в OCR не отправляется: в её элементе files приходят
+    error и quality с подсказкой, остальные страницы распознаются
+    (check_quality=false - отправить в OCR как есть).
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Слишком много файлов. Максимум: {MAX_BATCH_FILES}"
+        )
     
+    # Определяем, какие файлы нужно распознавать
+    if pages:
+        try:
+            page_kinds = json.loads(pages)
+        except json.JSONDecodeError:
+            page_kinds = None
+        if not isinstance(page_kinds, list) or len(page_kinds) != len(files):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="pages должен быть JSON массивом той же длины, что и files"
+            )
+        if any(kind not in (*JOB_KINDS, "skip") for kind in page_kinds):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Допустимые значения pages: student, feedback, skip"
+            )
+    else:
+        page_kinds = ["student"] + ["skip"] * (len(files) - 1)
+    
+    # Сохраняем все файлы (валидация как в одиночной загрузке)
+    saved = []
     try:
-        # Обрабатываем через OCR
-        feedback_result = await process_feedback_image_ocr(contents, file.filename)
-        
-        # Возвращаем данные для редактирования
-        return {
-            "success": True,
-            "message": "Данные обратной связи распознаны",
-            "image_path": file_path,
-            "data": {
-                "masterclass_rating": feedback_result.masterclass_rating,
-                "speaker_rating": feedback_result.speaker_rating,
-                "feedback": feedback_result.feedback
-            },
-            "ocr_raw": feedback_result.raw_response
+        for file in files:
+            saved.append(await _save_upload_file(file))
+    except HTTPException:
+        # Пакет принимается целиком: удаляем уже сохранённые файлы
+        await _remove_uploads(saved)
+        raise
+    
+    # Качество проверяем только у страниц, которые пойдут в OCR;
+    # непригодная страница - ошибка этой страницы, а не всего пакета
+    async def check_page(kind: str, file: UploadFile) -> Optional[dict]:
+        if not check_quality or kind == "skip":
+            return None
+        return await quality_gate.check(file)
+    
+    quality_reports = await asyncio.gather(*[check_page(kind, file) for kind, file in zip(page_kinds, files)])
+    
+    semaphore = asyncio.Semaphore(settings.ocr_batch_concurrency)
+    
+    async def recognize(kind: str, upload: IngestedFile, filename: str, quality: Optional[dict]) -> Optional[dict]:
+        if kind == "skip" or (quality is not None and not quality["passed"]):
+            return None
+        async with semaphore:
+            # Файл читается только на время распознавания - в памяти не больше ocr_batch_concurrency фото
+            return await recognize_stored_page(kind, upload.key, filename, upload.sha256)
+    
+    ocr_results = await asyncio.gather(
+        *[
+            recognize(kind, upload, file.filename, quality)
+            for kind, upload, file, quality in zip(page_kinds, saved, files, quality_reports)
+        ],
+        return_exceptions=True
+    )
+    
+    results = []
+    first_payload = {"student": None, "feedback": None}
+    for kind, upload, file, quality, ocr in zip(page_kinds, saved, files, quality_reports, ocr_results):
+        item = {
+            "filename": file.filename,
+            "image_path": image_path(upload.key),
+            "page": kind
         }
-        
+        if quality is not None:
+            item["quality"] = quality
+            if not quality["passed"]:
+                item["error"] = quality["message"]
+        if isinstance(ocr, Exception):
+            item["error"] = f"Ошибка обработки изображения: {str(ocr)}"
+        elif ocr is not None:
+            item.update(ocr)
+            if first_payload[kind] is None:
+                first_payload[kind] = ocr
+        results.append(item)
+    
+    return {
+        "success": True,
+        "message": "Файлы загружены",
+        "image_paths": [image_path(upload.key) for upload in saved],
+        "files": results,
+        # Данные первой распознанной страницы каждого типа - для формы редактирования
+        "student": first_payload["student"],
+        "feedback": first_payload["feedback"]
+    }
+
+
+@router.post("/upload/combined")
+async def upload_combined(
+    files: List[UploadFile] = File(...),
+    application_type: str = Form(...),
+    check_quality: bool = Form(True)
+):
+    """
+    Загрузка обеих страниц анкеты и распознавание одним запросом к модели.
+    
+    Фото можно передавать в любом порядке: модель сама определяет,
+    где данные ученика, а где обратная связь.
+    Непригодное для распознавания фото отклоняется до OCR, как в POST /api/upload
+    (check_quality=false - отправить в OCR как есть).
+    Возвращает данные обеих страниц и пути к изображениям каждой из них.
+    """
+    if len(files) != 2:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Нужно передать ровно два фото: первую страницу и обратную связь"
+        )
+    
+    saved = []
+    try:
+        for file in files:
+            saved.append(await _save_upload_file(file))
+    except HTTPException:
+        await _remove_uploads(saved)
+        raise
+    
+    if check_quality:
+        for file in files:
+            await _check_quality(file, saved)
+    
+    try:
+        ocr_result, feedback_result, pages = await process_combined_ocr(
+            [(await storage.read(upload.key), file.filename) for upload, file in zip(saved, files)]
+        )
+    except OCRServiceUnavailable:
+        await _remove_uploads(saved)
+        raise _ocr_unavailable_error()
     except Exception as e:
-        # Удаляем файл при ошибке
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
+        await _remove_uploads(saved)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка обработки изображения: {str(e)}"
         )
+    
+    image_paths = [image_path(upload.key) for upload in saved]
+    feedback_index = pages["feedback"]
+    
+    return {
+        "success": True,
+        "message": "Данные обеих страниц распознаны",
+        "image_paths": image_paths,
+        "pages": pages,
+        # Если модель не нашла обратную связь, все фото считаются первой страницей
+        "student_image_paths": [path for i, path in enumerate(image_paths) if i != feedback_index],
+        "feedback_image_paths": [image_paths[feedback_index]] if feedback_index is not None else [],
+        "student": ocr_result_payload(ocr_result),
+        "feedback": feedback_result_payload(feedback_result)
+    }
 
 
 @router.post("/upload/save")
@@ -176,8 +572,6 @@ async def save_student_data(
     
     Принимает отредактированные данные (включая обратную связь) и сохраняет их в MongoDB.
     """
-    import json
-    
     # Парсим image_paths (может быть один путь или массив)
     try:
         image_paths_list = json.loads(image_paths)
@@ -220,8 +614,15 @@ async def save_student_data(
     if parent_phone_clean == "":
         parent_phone_clean = None
     
+    # Загрузки привязываются к заявке (pending -> attached);
+    # пути уже перекодированных фото заменяются на архивные
+    student_id = ObjectId()
+    image_paths_list = await image_store.attach(image_paths_list, student_id)
+    
     # Подготавливаем данные для сохранения
     student_data = {
+        "_id": student_id,
+        "schema_version": STUDENT_SCHEMA_VERSION,
         "fio": fio,
         "school": school,
         "class": student_class,
@@ -239,10 +640,20 @@ async def save_student_data(
         "amo_lead_id": None,
         "ocr_raw": ocr_raw_data
     }
+    # Нормализованные ключи поиска пишутся вместе с заявкой
+    student_data.update(search_fields(student_data))
     
     # Сохраняем в MongoDB
     students_collection = await get_students_collection()
-    result = await students_collection.insert_one(student_data)
+    try:
+        result = await students_collection.insert_one(student_data)
+    except Exception:
+        await image_store.release(image_paths_list, student_id)
+        raise
+    await student_stats.student_created()
+    
+    # Оригиналы перекодируются в архивный формат в фоне
+    image_store.schedule_archive(image_paths_list)
     
     return {
         "success": True,
@@ -274,21 +685,24 @@ async def upload_manual(
     Полезно для добавления данных вручную.
     """
     student_data = {
+        "schema_version": STUDENT_SCHEMA_VERSION,
         "fio": fio,
         "school": school,
         "class": student_class,
         "phone": phone,
         "application_type": application_type,
-        "image_path": None,
+        "image_paths": [],
         "created_at": datetime.utcnow(),
         "sent_to_amo": False,
         "amo_contact_id": None,
         "amo_lead_id": None,
         "ocr_raw": None
     }
+    student_data.update(search_fields(student_data))
     
     students_collection = await get_students_collection()
     result = await students_collection.insert_one(student_data)
+    await student_stats.student_created()
     
     return {
         "success": True,
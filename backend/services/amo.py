@@ -3,10 +3,22 @@ import asyncio
 from typing import Optional, List, Dict, Any
 from backend.config import get_settings
 from backend.database.mongodb import get_students_collection
+from backend.services.student_stats import student_stats
 from bson import ObjectId
 
 settings = get_settings()
 
+# Заявки, отправленные в AMO: их сделки проверяет verify_sent_to_amo
+SENT_WITH_LEAD_QUERY = {"sent_to_amo": True, "amo_lead_id": {"$exists": True, "$ne": None}}
+
+
+def unsent_students_query(student_ids: Optional[List[str]] = None) -> dict:
+    """Заявки к отправке в AMO: все неотправленные или только выбранные из них"""
+    query = {"sent_to_amo": False}
+    if student_ids:
+        query["_id"] = {"$in": [ObjectId(sid) for sid in student_ids]}
+    return query
+
 
 class AMOCRMService:
     """Сервис для работы с AMO CRM API"""
@@ -418,8 +430,8 @@ async def _send_single_student_to_amo(
         
         await amo_service.add_note_to_lead(lead_id, note_text)
         
-        # Обновляем статус в БД
-        await students_collection.update_one(
+        # Обновляем статус в БД (значение до записи - для счётчиков статистики)
+        before = await students_collection.find_one_and_update(
             {"_id": student["_id"]},
             {
                 "$set": {
@@ -427,8 +439,11 @@ async def _send_single_student_to_amo(
                     "amo_contact_id": str(contact_id),
                     "amo_lead_id": str(lead_id)
                 }
-            }
+            },
+            projection={"sent_to_amo": 1}
         )
+        if before is not None:
+            await student_stats.amo_status_changed(before.get("sent_to_amo"), True)
         
         return {
             "success": True,
@@ -462,12 +477,7 @@ async def send_students_to_amo(student_ids: List[str] = None) -> Dict[str, Any]:
     amo_service = AMOCRMService()
     students_collection = await get_students_collection()
     
-    # Формируем запрос
-    query = {"sent_to_amo": False}
-    if student_ids:
-        query["_id"] = {"$in": [ObjectId(sid) for sid in student_ids]}
-    
-    students = await students_collection.find(query).to_list(length=100)
+    students = await students_collection.find(unsent_students_query(student_ids)).to_list(length=100)
     
     results = {
         "success": [],
@@ -538,8 +548,7 @@ async def verify_sent_to_amo() -> Dict[str, Any]:
     students_collection = await get_students_collection()
     
     # Получаем все заявки, помеченные как отправленные
-    query = {"sent_to_amo": True, "amo_lead_id": {"$exists": True, "$ne": None}}
-    students = await students_collection.find(query).to_list(length=None)
+    students = await students_collection.find(SENT_WITH_LEAD_QUERY).to_list(length=None)
     
     results = {
         "checked": 0,
@@ -628,14 +637,17 @@ async def verify_sent_to_amo() -> Dict[str, Any]:
                 
                 if should_update:
                     # Обновляем статус в БД
-                    await students_collection.update_one(
+                    before = await students_collection.find_one_and_update(
                         {"_id": student["_id"]},
                         {
                             "$set": {
                                 "sent_to_amo": False
                             }
-                        }
+                        },
+                        projection={"sent_to_amo": 1}
                     )
+                    if before is not None:
+                        await student_stats.amo_status_changed(before.get("sent_to_amo"), False)
                     results["updated"] += 1
                     
             except Exception as e:
@@ -0,0 +1,161 @@
+import asyncio
+import io
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+from PIL import Image, ImageOps
+from backend.config import get_settings
+from backend.services.executors import executors
+from backend.services.storage import LocalStorage, StoredObject, storage
+
+settings = get_settings()
+
+# Производные изображения: имя -> максимальная сторона, px
+DERIVATIVE_SIZES = {
+    "thumb": 160,
+    "preview": 1024
+}
+DERIVATIVE_QUALITY = 75
+DERIVATIVE_CONTENT_TYPE = "image/webp"
+
+
+def render_derivative(image_data: bytes, max_edge: int) -> bytes:
+    """Уменьшенная копия в WebP (синхронная, CPU-bound)"""
+    with Image.open(io.BytesIO(image_data)) as source:
+        # JPEG сразу декодируется в уменьшенном масштабе (1/2, 1/4, 1/8) - в разы быстрее
+        source.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=DERIVATIVE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+async def _single_chunk(data: bytes):
+    yield data
+
+
+class DerivativeCache:
+    """
+    Кэш миниатюр и превью для админ-панели.
+
+    Производные создаются по первому запросу в отдельном пуле потоков derivatives
+    (не блокируют event loop и не занимают потоки, нужные загрузке),
+    одновременные запросы одной миниатюры ждут одну генерацию.
+    Результат хранится на локальном диске (image_derivative_dir) -
+    это кэш, его потеря при перезапуске не страшна. Объём ограничен
+    image_derivative_cache_mb: при превышении удаляются давно не запрошенные файлы.
+    Учёт ведётся в памяти процесса, поэтому при нескольких воркерах uvicorn
+    граница соблюдается приблизительно.
+
+    Исходные ключи - хэши содержимого, значит производная под ключом
+    никогда не меняется и может кэшироваться браузером без ограничений.
+    При удалении исходного объекта ImageStore удаляет и его производные
+    (invalidate), а попадание в кэш проверяет, что исходный объект ещё есть, -
+    файл могла пережить удаление на другом воркере или хосте.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._storage: Optional[LocalStorage] = None
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def storage(self) -> LocalStorage:
+        if self._storage is None:
+            self._storage = LocalStorage(self.directory)
+            # Файлы с прошлого запуска учитываем сразу, старые - первыми на вытеснение
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, entry.name, stat.st_size))
+            for _, name, size in sorted(files):
+                self._entries[name] = size
+                self._total += size
+        return self._storage
+
+    @staticmethod
+    def key_for(variant: str, source_key: str) -> str:
+        return f"{variant}-{os.path.splitext(source_key)[0]}.webp"
+
+    async def get(self, variant: str, source_key: str) -> Optional[StoredObject]:
+        """
+        Производная изображения (создаётся при первом запросе).
+        None - исходного изображения нет.
+        """
+        key = self.key_for(variant, source_key)
+        stored = await self.storage.stat(key)
+        if stored is not None:
+            if await storage.stat(source_key) is None:
+                await self._drop(key)
+                return None
+            self.stats["hits"] += 1
+            self._touch(key, stored.size)
+            return stored
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._create(key, variant, source_key))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _create(self, key: str, variant: str, source_key: str) -> Optional[StoredObject]:
+        if await storage.stat(source_key) is None:
+            return None
+        self.stats["misses"] += 1
+        data = await storage.read(source_key)
+        rendered = await executors.run_thread("derivatives", render_derivative, data, DERIVATIVE_SIZES[variant])
+        await self.storage.put(key, _single_chunk(rendered), len(rendered), DERIVATIVE_CONTENT_TYPE)
+        self._touch(key, len(rendered))
+        await self._evict()
+        return await self.storage.stat(key)
+
+    def _touch(self, key: str, size: int):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = size
+        self._total += size
+
+    async def _drop(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total -= size
+        await self.storage.delete(key)
+
+    async def invalidate(self, source_key: str):
+        """Удаление всех производных исходного объекта (вызывается при его удалении)"""
+        for variant in DERIVATIVE_SIZES:
+            try:
+                await self._drop(self.key_for(variant, source_key))
+            except Exception as e:
+                print(f"Failed to remove {variant} of {source_key}: {e}")
+
+    async def _evict(self):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            self.stats["evictions"] += 1
+            await self.storage.delete(key)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes
+        }
+
+
+derivative_cache = DerivativeCache(
+    directory=settings.image_derivative_dir,
+    max_bytes=settings.image_derivative_cache_mb * 1024 * 1024
+)
@@ -0,0 +1,233 @@
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+from backend.services.storage import storage, image_path
+from backend.services.ocr import (
+    process_image_ocr,
+    process_feedback_image_ocr,
+    ocr_result_payload,
+    feedback_result_payload
+)
+
+settings = get_settings()
+
+# 64-битный dHash делится на 5 полос: если расстояние Хэмминга <= 4,
+# хотя бы одна полоса совпадает целиком (принцип Дирихле) - поиск идёт
+# точным совпадением полосы по multikey индексу, а не перебором коллекции
+PHASH_BITS = 64
+PHASH_BANDS = 5
+PHASH_MAX_DISTANCE = PHASH_BANDS - 1
+# Предел кандидатов на один поиск: полоса ~13 бит, для случайных хэшей на 100 тыс. фото
+# это десятки записей, у фото одного бланка совпадений больше. Кандидаты берутся
+# в порядке числа совпавших полос (чем больше, тем ближе хэш), так что предел
+# отсекает самые далёкие, а не случайные записи
+CANDIDATE_LIMIT = 200
+
+
+def phash_bands(phash: str) -> List[str]:
+    """Полосы хэша для индекса: "<номер>:<биты полосы hex>" """
+    value = int(phash, 16)
+    bands = []
+    start = 0
+    for index in range(PHASH_BANDS):
+        width = PHASH_BITS // PHASH_BANDS + (1 if index < PHASH_BITS % PHASH_BANDS else 0)
+        band = (value >> (PHASH_BITS - start - width)) & ((1 << width) - 1)
+        bands.append(f"{index}:{band:x}")
+        start += width
+    return bands
+
+
+def hamming(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+class DuplicateDetector:
+    """
+    Поиск почти одинаковых фото анкет перед OCR.
+
+    Перцептивный хэш считается при загрузке (ImageStore.save_upload) и хранится
+    в stored_images вместе с полосами (phash_bands, индекс). Успешное распознавание
+    запоминается в той же записи (ocr.<kind>.data - распознанные поля).
+
+    Прежний результат подставляется без запроса к модели только для того же
+    файла (совпал SHA-256, exact). Фото, отличающееся от уже распознанного не
+    больше чем на duplicate_max_distance бит, распознаётся как обычно, а прежний
+    результат приходит оператору как подсказка (duplicate) - принять её или нет,
+    решает он: похожий снимок может оказаться другой анкетой того же бланка.
+
+    Хэш ловит повторную отправку, пересжатие мессенджером, уменьшение и
+    серийные снимки. Снимки одного листа с заметно другого ракурса он не
+    отличает от других анкет того же бланка, поэтому порог держится низким.
+    """
+
+    def __init__(self):
+        self.stats = {"lookups": 0, "exact": 0, "matches": 0, "lookup_ms_total": 0.0}
+
+    @staticmethod
+    def _collection():
+        return get_database().stored_images
+
+    @property
+    def max_distance(self) -> int:
+        return min(settings.duplicate_max_distance, PHASH_MAX_DISTANCE)
+
+    async def find(self, key: str, kind: str) -> Optional[Dict[str, Any]]:
+        """
+        Ранее распознанное фото, совпадающее с загруженным (key) или почти совпадающее.
+        Возвращает {"result", "image_path", "distance", "exact", "student_ids", "state"} или None.
+        """
+        if not settings.duplicate_check_enabled:
+            return None
+        started = time.perf_counter()
+        record = await self._collection().find_one(
+            {"_id": key},
+            {"phash": 1, "phash_bands": 1, f"ocr.{kind}.data": 1, "student_ids": 1, "state": 1}
+        )
+        if not record:
+            return None
+
+        self.stats["lookups"] += 1
+        best = None
+        if (record.get("ocr") or {}).get(kind):
+            # Тот же файл (ключ - SHA-256 содержимого) уже распознавался
+            best = (0, record)
+        elif record.get("phash"):
+            bands = record.get("phash_bands") or phash_bands(record["phash"])
+            # Выборка по индексу phash_bands, первыми - кандидаты с большим числом общих полос.
+            # Сортируются только хэши: результат распознавания читается у одной лучшей записи
+            cursor = self._collection().aggregate([
+                {"$match": {"phash_bands": {"$in": bands}, "_id": {"$ne": key}, f"ocr.{kind}": {"$exists": True}}},
+                {"$project": {
+                    "phash": 1,
+                    "overlap": {"$size": {"$filter": {"input": "$phash_bands", "cond": {"$in": ["$$this", bands]}}}}
+                }},
+                {"$sort": {"overlap": -1}},
+                {"$limit": CANDIDATE_LIMIT}
+            ])
+            nearest = None
+            async for candidate in cursor:
+                if not candidate.get("phash"):
+                    continue
+                distance = hamming(record["phash"], candidate["phash"])
+                if distance <= self.max_distance and (nearest is None or distance < nearest[0]):
+                    nearest = (distance, candidate["_id"])
+            if nearest is not None:
+                match = await self._collection().find_one(
+                    {"_id": nearest[1], f"ocr.{kind}": {"$exists": True}},
+                    {f"ocr.{kind}.data": 1, "student_ids": 1, "state": 1}
+                )
+                if match is not None:
+                    best = (nearest[0], match)
+        self.stats["lookup_ms_total"] += (time.perf_counter() - started) * 1000
+
+        if best is None:
+            return None
+        distance, match = best
+        exact = match["_id"] == key
+        self.stats["exact" if exact else "matches"] += 1
+        return {
+            "result": match["ocr"][kind],
+            "image_path": image_path(match["_id"]),
+            "distance": distance,
+            "exact": exact,
+            "student_ids": [str(student_id) for student_id in match.get("student_ids", [])],
+            "state": match.get("state")
+        }
+
+    async def remember(self, key: str, kind: str, payload: Dict[str, Any]):
+        """
+        Сохранение успешного распознавания для будущих совпадений. Хранятся
+        только поля (data): ответ API лежит в заявке, а записи stored_images
+        читаются при каждом поиске дубликата.
+        """
+        if not any(value not in (None, "") for value in payload["data"].values()):
+            return
+        await self._collection().update_one(
+            {"_id": key},
+            {"$set": {f"ocr.{kind}": {"data": payload["data"]}}}
+        )
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["lookups"]
+        return {
+            "lookups": lookups,
+            "exact": self.stats["exact"],
+            "matches": self.stats["matches"],
+            "avg_lookup_ms": round(self.stats["lookup_ms_total"] / lookups, 2) if lookups else 0.0,
+            "max_distance": self.max_distance
+        }
+
+
+duplicate_detector = DuplicateDetector()
+
+
+def duplicate_warning(duplicate: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Предупреждение оператору для ответа API. Для похожего (не того же) фото
+    в data лежит прежний результат - подсказка, которую оператор может принять.
+    """
+    if duplicate["student_ids"]:
+        message = "Похоже, эта анкета уже сохранена - проверьте, не дублируется ли заявка"
+    elif duplicate["exact"]:
+        message = "Это фото уже загружалось - данные взяты из прошлого распознавания"
+    else:
+        message = "Похожее фото уже распознавалось - сравните данные с прошлым распознаванием"
+    warning = {
+        "message": message,
+        "image_path": duplicate["image_path"],
+        "distance": duplicate["distance"],
+        "exact": duplicate["exact"],
+        "student_ids": duplicate["student_ids"]
+    }
+    if not duplicate["exact"]:
+        warning["data"] = duplicate["result"]["data"]
+    return warning
+
+
+def duplicate_payload(duplicate: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload прежнего распознавания того же файла в формате ocr_result_payload / feedback_result_payload"""
+    return {
+        "data": duplicate["result"]["data"],
+        "ocr_raw": None,
+        "from_cache": True,
+        "preprocess": None,
+        "duplicate": duplicate_warning(duplicate)
+    }
+
+
+async def duplicate_events(duplicate: Dict[str, Any]) -> AsyncIterator[Tuple[str, dict]]:
+    """События как у stream_page_ocr для того же файла - без запроса к модели"""
+    payload = duplicate_payload(duplicate)
+    yield "started", {"from_cache": True, "duplicate": payload["duplicate"]}
+    for name, value in payload["data"].items():
+        yield "field", {"name": name, "value": value}
+    yield "done", payload
+
+
+async def recognize_stored_page(
+    kind: str,
+    key: str,
+    filename: str,
+    image_hash: Optional[str] = None,
+    check_duplicates: bool = True
+) -> dict:
+    """
+    Распознавание сохранённого фото страницы анкеты (kind: student / feedback)
+    с проверкой на дубликат. Возвращает payload как ocr_result_payload /
+    feedback_result_payload. Тот же файл не распознаётся повторно; для похожего
+    фото распознавание идёт как обычно, а в поле duplicate приходит подсказка.
+    """
+    duplicate = await duplicate_detector.find(key, kind) if check_duplicates else None
+    if duplicate is not None and duplicate["exact"]:
+        return duplicate_payload(duplicate)
+
+    contents = await storage.read(key)
+    if kind == "feedback":
+        payload = feedback_result_payload(await process_feedback_image_ocr(contents, filename, image_hash=image_hash))
+    else:
+        payload = ocr_result_payload(await process_image_ocr(contents, filename, image_hash=image_hash))
+    await duplicate_detector.remember(key, kind, payload)
+    if duplicate is not None:
+        payload["duplicate"] = duplicate_warning(duplicate)
+    return payload
@@ -0,0 +1,237 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+from backend.config import get_settings
+
+settings = get_settings()
+
+# Пул процессов в статистике
+PROCESS_POOL = "process"
+# Задержка event loop, после которой пробуждение считается «зависанием», мс
+LOOP_STALL_MS = 100
+# Сколько последних замеров задержки хранить (при интервале 100 мс - минута)
+LOOP_LAG_WINDOW = 600
+
+
+def _thread_pool_sizes() -> Dict[str, int]:
+    """
+    Потоковые пулы: имя -> число потоков.
+    - cpu - короткие шаги в пути запроса: хэши, base64 и JSON тела запроса к OpenRouter
+    - quality - проверка качества фото (services/image_quality.py)
+    - derivatives - миниатюры и превью для админ-панели (services/derivatives.py)
+    """
+    return {
+        "cpu": settings.executor_threads,
+        "quality": settings.quality_check_workers,
+        "derivatives": settings.image_derivative_workers
+    }
+
+
+def _warmup() -> int:
+    """Пустая задача: процесс пула поднимается и импортирует модули заранее"""
+    return os.getpid()
+
+
+class ExecutorManager:
+    """
+    Пулы для CPU-bound работы, которая иначе выполнялась бы в event loop.
+
+    Пул процессов - для тяжёлой обработки изображений (нормализация перед OCR,
+    архивное перекодирование): на фото 12 Мп это сотни миллисекунд, часть
+    которых Pillow держит GIL, и из потока такая работа задерживает event loop
+    до 200 мс. Аргументы и результат передаются через pickle, поэтому сюда
+    отправляются только функции уровня модуля с байтами на входе и выходе.
+    Процессы создаются через spawn: fork процесса с потоками и открытыми
+    соединениями MongoDB небезопасен.
+
+    Потоковые пулы - для работы над объектами, которые нельзя передать в другой
+    процесс (файл загрузки), и для коротких шагов, где копирование дороже
+    самой работы. Пулы разделены по назначению: генерация миниатюр для
+    админ-панели не занимает потоки, нужные загрузке.
+
+    Пулы создаются в lifespan (start/shutdown); вне приложения (скрипты, bench)
+    потоковые пулы создаются при первом обращении, а вместо пула процессов
+    используется пул cpu.
+    """
+
+    def __init__(self):
+        self._threads: Dict[str, ThreadPoolExecutor] = {}
+        self._process: Optional[ProcessPoolExecutor] = None
+        self._process_lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.process_restarts = 0
+
+    def start(self):
+        """Создание пулов (вызывается в lifespan)"""
+        for name in _thread_pool_sizes():
+            self._thread_pool(name)
+        if settings.executor_process_workers > 0 and self._process is None:
+            self._process = self._create_process_pool()
+        print(
+            f"✅ Executors started: threads {_thread_pool_sizes()}, "
+            f"processes {settings.executor_process_workers}"
+        )
+
+    def shutdown(self):
+        """Остановка пулов: ожидающие задачи отменяются"""
+        for pool in self._threads.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = {}
+        if self._process is not None:
+            self._process.shutdown(wait=False, cancel_futures=True)
+            self._process = None
+        print("Executors stopped")
+
+    @staticmethod
+    def _create_process_pool() -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(
+            max_workers=settings.executor_process_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        # Процессы поднимаются сразу, а не на первой загрузке
+        for _ in range(settings.executor_process_workers):
+            pool.submit(_warmup)
+        return pool
+
+    def _restart_process_pool(self, broken: ProcessPoolExecutor):
+        """
+        Замена сломанного пула процессов. Пересоздаёт пул только тот, кто первым
+        увидел именно этот экземпляр: остальные задачи, упавшие вместе с ним,
+        просто переходят на новый пул. Потоковые пулы не трогаются.
+        """
+        with self._process_lock:
+            if self._process is not broken:
+                return
+            print("⚠️ Process pool is broken, restarting")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._process = self._create_process_pool()
+            self.process_restarts += 1
+
+    def _thread_pool(self, name: str) -> ThreadPoolExecutor:
+        pool = self._threads.get(name)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=_thread_pool_sizes()[name], thread_name_prefix=name)
+            self._threads[name] = pool
+        return pool
+
+    async def _run(self, name: str, executor, func: Callable, *args) -> Any:
+        stats = self.stats.setdefault(
+            name, {"submitted": 0, "running": 0, "failed": 0, "ms_total": 0.0, "ms_max": 0.0}
+        )
+        stats["submitted"] += 1
+        stats["running"] += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            stats["running"] -= 1
+            stats["ms_total"] += elapsed
+            stats["ms_max"] = max(stats["ms_max"], elapsed)
+
+    async def run_thread(self, pool: str, func: Callable, *args) -> Any:
+        """Выполнение func(*args) в потоковом пуле pool (см. _thread_pool_sizes)"""
+        return await self._run(pool, self._thread_pool(pool), func, *args)
+
+    async def run_process(self, func: Callable, *args) -> Any:
+        """
+        Выполнение func(*args) в пуле процессов.
+        func и аргументы должны передаваться через pickle (функция уровня модуля, байты).
+        Без пула процессов (executor_process_workers=0 или вне lifespan) - в пуле cpu.
+        """
+        pool = self._process
+        if pool is None:
+            return await self.run_thread("cpu", func, *args)
+        try:
+            return await self._run(PROCESS_POOL, pool, func, *args)
+        except BrokenProcessPool:
+            # Процесс пула упал (например, OOM) - пересоздаём пул, эту задачу выполняем в потоке
+            self._restart_process_pool(pool)
+            return await self.run_thread("cpu", func, *args)
+
+    def snapshot(self) -> dict:
+        sizes = {**_thread_pool_sizes(), PROCESS_POOL: settings.executor_process_workers}
+        pools = {}
+        for name, size in sizes.items():
+            stats = self.stats.get(name) or {"submitted": 0, "running": 0, "failed": 0, "ms_total": 0.0, "ms_max": 0.0}
+            submitted = stats["submitted"]
+            pools[name] = {
+                "workers": size,
+                "submitted": submitted,
+                "running": stats["running"],
+                "failed": stats["failed"],
+                "avg_ms": round(stats["ms_total"] / submitted, 2) if submitted else 0.0,
+                "max_ms": round(stats["ms_max"], 2)
+            }
+        pools[PROCESS_POOL]["restarts"] = self.process_restarts
+        return pools
+
+
+class LoopLagMonitor:
+    """
+    Задержка event loop: задача раз в interval засыпает и замеряет, насколько
+    позже запланированного проснулась. Пока CPU-bound работа вынесена в пулы,
+    задержка держится в пределах миллисекунд и админ-панель отвечает
+    во время пачки загрузок; рост p99/max показывает, что что-то опять
+    выполняется прямо в event loop.
+    """
+
+    def __init__(self, interval_ms: int):
+        self.interval = interval_ms / 1000
+        self._samples: "deque[float]" = deque(maxlen=LOOP_LAG_WINDOW)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"stalls": 0, "max_ms": 0.0}
+
+    async def start(self):
+        """Запуск замеров (вызывается в lifespan)"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, (time.perf_counter() - started - self.interval) * 1000)
+            self._samples.append(lag)
+            self.stats["max_ms"] = max(self.stats["max_ms"], lag)
+            if lag >= LOOP_STALL_MS:
+                self.stats["stalls"] += 1
+
+    def snapshot(self) -> dict:
+        samples = sorted(self._samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+        return {
+            "interval_ms": round(self.interval * 1000),
+            "window_samples": len(samples),
+            "current_ms": round(self._samples[-1], 2) if self._samples else 0.0,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "window_max_ms": round(samples[-1], 2) if samples else 0.0,
+            "max_ms": round(self.stats["max_ms"], 2),
+            "stalls": self.stats["stalls"],
+            "stall_threshold_ms": LOOP_STALL_MS
+        }
+
+
+executors = ExecutorManager()
+loop_monitor = LoopLagMonitor(interval_ms=settings.event_loop_lag_interval_ms)
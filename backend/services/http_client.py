@@ -0,0 +1,61 @@
+import httpx
+from typing import Optional
+from backend.config import get_settings
+
+settings = get_settings()
+
+
+class OpenRouterHTTP:
+    client: Optional[httpx.AsyncClient] = None
+
+
+openrouter_http = OpenRouterHTTP()
+
+
+def _create_client() -> httpx.AsyncClient:
+    """Создание клиента с пулом keep-alive соединений к OpenRouter"""
+    timeout = httpx.Timeout(
+        settings.openrouter_timeout,
+        connect=settings.openrouter_connect_timeout
+    )
+    limits = httpx.Limits(
+        max_connections=settings.openrouter_max_connections,
+        max_keepalive_connections=settings.openrouter_max_keepalive_connections,
+        keepalive_expiry=settings.openrouter_keepalive_expiry
+    )
+    
+    http2 = settings.openrouter_http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            # Без пакета h2 httpx не умеет HTTP/2 - работаем по HTTP/1.1
+            print("⚠️  Package 'h2' is not installed, OpenRouter client falls back to HTTP/1.1")
+            http2 = False
+    
+    return httpx.AsyncClient(timeout=timeout, limits=limits, http2=http2)
+
+
+async def init_openrouter_client():
+    """Создание общего HTTP клиента OpenRouter (вызывается в lifespan)"""
+    if openrouter_http.client is None:
+        openrouter_http.client = _create_client()
+        print("✅ OpenRouter HTTP client initialized")
+
+
+async def close_openrouter_client():
+    """Закрытие общего HTTP клиента OpenRouter"""
+    if openrouter_http.client is not None:
+        await openrouter_http.client.aclose()
+        openrouter_http.client = None
+        print("OpenRouter HTTP client closed")
+
+
+def get_openrouter_client() -> httpx.AsyncClient:
+    """
+    Получение общего HTTP клиента OpenRouter.
+    Если lifespan не выполнялся (например, в скриптах), клиент создаётся лениво.
+    """
+    if openrouter_http.client is None:
+        openrouter_http.client = _create_client()
+    return openrouter_http.client
@@ -0,0 +1,194 @@
+import io
+import time
+from typing import Tuple, Dict, Any, Optional
+from PIL import Image, ImageOps, features
+from backend.config import get_settings
+from backend.services.executors import executors
+from backend.utils.uploads import detect_image_type
+
+settings = get_settings()
+
+# Минимальное качество при ужатии до лимита по размеру
+MIN_QUALITY = 40
+# Во сколько раз уменьшать сторону, если понижения качества не хватило
+DOWNSCALE_STEP = 0.75
+# EXIF тег ориентации снимка
+ORIENTATION_TAG = 0x0112
+
+
+def guess_mime_type(filename: str) -> str:
+    """Определение MIME типа по расширению файла"""
+    mime_type = "image/jpeg"
+    if filename.lower().endswith(".png"):
+        mime_type = "image/png"
+    elif filename.lower().endswith(".webp"):
+        mime_type = "image/webp"
+    elif filename.lower().endswith(".gif"):
+        mime_type = "image/gif"
+    return mime_type
+
+
+def original_mime_type(image_data: bytes, filename: str) -> str:
+    """
+    MIME тип оригинала для data URL: по сигнатуре, как при приёме загрузки
+    (ingest_upload), - PNG с именем .jpg уходит как image/png. Расширение
+    используется, только если сигнатура не распознана.
+    """
+    return detect_image_type(image_data[:16]) or guess_mime_type(filename)
+
+
+def _encode(image: Image.Image, output_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if output_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def perceptual_hash(source) -> str:
+    """
+    Перцептивный хэш изображения (dHash, 64 бита, hex) - синхронная, CPU-bound.
+    Снимок уменьшается до 9x8 в оттенках серого, каждый бит - «левый пиксель ярче правого».
+    Пересжатие, уменьшение и небольшая обрезка меняют лишь несколько бит.
+    source - байты или файловый объект.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        # Для хэша хватает грубого масштаба - JPEG декодируется сразу уменьшенным
+        image.draft("L", (64, 64))
+        small = ImageOps.exif_transpose(image).convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def archive_format() -> str:
+    """Формат архивного хранения: AVIF только если Pillow собран с его поддержкой"""
+    output_format = settings.image_archive_format.upper()
+    if output_format == "AVIF" and features.check("avif"):
+        return "AVIF"
+    return "WEBP"
+
+
+def archive_image(image_data: bytes) -> Optional[Tuple[bytes, str]]:
+    """
+    Перекодирование оригинала для долговременного хранения (синхронная, CPU-bound).
+    В отличие от normalize_image цель - не OCR, а архив: разрешение сохраняется
+    (кроме слишком больших снимков, см. image_archive_max_edge), качество высокое.
+    Возвращает (байты, MIME тип) или None, если формат и так архивный.
+    """
+    output_format = archive_format()
+    with Image.open(io.BytesIO(image_data)) as source:
+        if source.format in ("WEBP", "AVIF"):
+            return None
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        max_edge = settings.image_archive_max_edge
+        if max_edge and max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        if output_format == "AVIF":
+            image.save(buffer, format="AVIF", quality=settings.image_archive_quality)
+        else:
+            image.save(buffer, format="WEBP", quality=settings.image_archive_quality, method=6)
+    return buffer.getvalue(), f"image/{output_format.lower()}"
+
+
+def normalize_image(image_data: bytes) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Нормализация фото перед OCR (синхронная, CPU-bound):
+    - поворот по EXIF
+    - уменьшение до image_max_edge по длинной стороне
+    - опционально перевод в оттенки серого
+    - перекодирование в JPEG/WebP с ужатием до image_max_bytes
+
+    Возвращает (байты, MIME тип, статистика).
+    """
+    started = time.perf_counter()
+    output_format = settings.image_output_format.upper()
+    if output_format not in ("JPEG", "WEBP"):
+        output_format = "JPEG"
+
+    with Image.open(io.BytesIO(image_data)) as source:
+        rotated = source.getexif().get(ORIENTATION_TAG, 1) != 1
+        image = ImageOps.exif_transpose(source)
+        original_size = image.size
+
+        if settings.image_grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        max_edge = settings.image_max_edge
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        # Понижаем качество, а затем размер, пока не уложимся в лимит
+        quality = settings.image_quality
+        encoded = _encode(image, output_format, quality)
+        while len(encoded) > settings.image_max_bytes:
+            if quality > MIN_QUALITY:
+                quality = max(MIN_QUALITY, quality - 10)
+            else:
+                new_size = (
+                    max(1, int(image.size[0] * DOWNSCALE_STEP)),
+                    max(1, int(image.size[1] * DOWNSCALE_STEP))
+                )
+                image = image.resize(new_size, Image.LANCZOS)
+            encoded = _encode(image, output_format, quality)
+            if max(image.size) < 256:
+                break
+
+    stats = {
+        "original_bytes": len(image_data),
+        "processed_bytes": len(encoded),
+        "saved_bytes": len(image_data) - len(encoded),
+        "original_size": list(original_size),
+        "processed_size": list(image.size),
+        "rotated": rotated,
+        "format": output_format,
+        "quality": quality,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+    mime_type = "image/webp" if output_format == "WEBP" else "image/jpeg"
+    return encoded, mime_type, stats
+
+
+async def prepare_image_for_ocr(image_data: bytes, filename: str) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Подготовка изображения к отправке в OCR.
+    Оригинал на диске не трогаем - меняется только то, что уходит в модель.
+    Если нормализация выключена или изображение не читается, отдаём оригинал.
+    """
+    if not settings.image_preprocess_enabled:
+        return image_data, original_mime_type(image_data, filename), {"skipped": True}
+
+    try:
+        # Декодирование и сжатие - CPU-bound и частично под GIL: выполняем в пуле процессов
+        processed, mime_type, stats = await executors.run_process(normalize_image, image_data)
+    except Exception as e:
+        print(f"Image preprocessing failed for {filename}: {e}")
+        return image_data, original_mime_type(image_data, filename), {"skipped": True, "error": str(e)}
+
+    # Если перекодирование не дало выигрыша и поворот не нужен, отправляем оригинал
+    if (
+        not stats["rotated"]
+        and stats["processed_bytes"] >= stats["original_bytes"]
+        and stats["original_bytes"] <= settings.image_max_bytes
+    ):
+        stats.update({"processed_bytes": len(image_data), "saved_bytes": 0, "kept_original": True})
+        return image_data, original_mime_type(image_data, filename), stats
+
+    print(
+        f"🖼  {filename}: {stats['original_bytes'] // 1024} KB -> {stats['processed_bytes'] // 1024} KB "
+        f"in {stats['elapsed_ms']} ms"
+    )
+    return processed, mime_type, stats
@@ -0,0 +1,195 @@
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+from backend.config import get_settings
+from backend.services.executors import executors
+
+settings = get_settings()
+
+# Длинная сторона кадра для анализа, px: резкость (дисперсия лапласиана)
+# зависит от масштаба, поэтому все фото сравниваются в одном разрешении
+QUALITY_ANALYSIS_EDGE = 1024
+# Ярче этого перцентиля в кадре - бумага: по нему судим о недосвете
+BRIGHTNESS_PERCENTILE = 95
+
+# Проверки и подсказки оператору (что сделать, чтобы переснять)
+QUALITY_MESSAGES = {
+    "sharpness": "Фото размыто - держите телефон неподвижно и дождитесь фокусировки на листе",
+    "dark": "Фото слишком тёмное - включите свет или переснимите у окна",
+    "overexposed": "Фото пересвечено - уберите вспышку и блики с листа",
+    "coverage": "Лист занимает малую часть кадра - поднесите телефон ближе, чтобы анкета заполнила кадр"
+}
+QUALITY_CHECKS = ("decode", "sharpness", "exposure", "coverage")
+
+
+def _otsu_threshold(histogram: np.ndarray) -> int:
+    """Порог Оцу по гистограмме яркости: делит кадр на светлую (бумага) и тёмную части"""
+    levels = np.arange(256, dtype=np.float64)
+    weight = np.cumsum(histogram, dtype=np.float64)
+    total = weight[-1]
+    mass = np.cumsum(histogram * levels)
+    background = weight[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    if not valid.any():
+        return 127
+    mean_background = mass[:-1] / np.where(valid, background, 1)
+    mean_foreground = (mass[-1] - mass[:-1]) / np.where(valid, foreground, 1)
+    variance = np.where(valid, background * foreground * (mean_background - mean_foreground) ** 2, 0)
+    return int(np.argmax(variance))
+
+
+def analyze_image(source) -> Dict[str, Any]:
+    """
+    Быстрая оценка снимка анкеты (синхронная, CPU-bound):
+    - sharpness - дисперсия лапласиана (чем меньше, тем сильнее размыто)
+    - brightness - яркость бумаги (95-й перцентиль) и средняя яркость кадра
+    - coverage - доля кадра, которую занимает светлая бумага (порог Оцу)
+
+    source - файловый объект или путь. Возвращает {"metrics": ..., "timings_ms": ...}.
+    """
+    timings = {}
+    started = time.perf_counter()
+    with Image.open(source) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе - основная экономия времени
+        image.draft("L", (QUALITY_ANALYSIS_EDGE, QUALITY_ANALYSIS_EDGE))
+        gray = ImageOps.exif_transpose(image).convert("L")
+        gray.thumbnail((QUALITY_ANALYSIS_EDGE, QUALITY_ANALYSIS_EDGE), Image.BILINEAR)
+        pixels = np.asarray(gray, dtype=np.float32)
+    timings["decode"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    laplacian = (
+        pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+        - 4 * pixels[1:-1, 1:-1]
+    )
+    sharpness = float(laplacian.var())
+    timings["sharpness"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256)
+    cumulative = np.cumsum(histogram) / pixels.size
+    paper_brightness = int(np.searchsorted(cumulative, BRIGHTNESS_PERCENTILE / 100))
+    mean_brightness = float(pixels.mean())
+    timings["exposure"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    threshold = _otsu_threshold(histogram)
+    coverage = float(histogram[threshold + 1:].sum() / pixels.size)
+    timings["coverage"] = (time.perf_counter() - started) * 1000
+
+    return {
+        "metrics": {
+            "sharpness": round(sharpness, 1),
+            "paper_brightness": paper_brightness,
+            "mean_brightness": round(mean_brightness, 1),
+            "coverage": round(coverage, 3),
+            "analyzed_size": list(gray.size)
+        },
+        "timings_ms": {name: round(value, 2) for name, value in timings.items()}
+    }
+
+
+def quality_issues(metrics: Dict[str, Any]) -> List[str]:
+    """Проваленные проверки (ключи QUALITY_MESSAGES) по порогам из настроек"""
+    issues = []
+    if metrics["paper_brightness"] < settings.quality_min_brightness:
+        # В тёмном кадре шум и размытие не отличить - сначала свет
+        return ["dark"]
+    if metrics["mean_brightness"] > settings.quality_max_brightness:
+        issues.append("overexposed")
+    if metrics["sharpness"] < settings.quality_min_sharpness:
+        issues.append("sharpness")
+    if metrics["coverage"] < settings.quality_min_coverage:
+        issues.append("coverage")
+    return issues
+
+
+def _analyze_upload(file: UploadFile) -> Dict[str, Any]:
+    file.file.seek(0)
+    return analyze_image(file.file)
+
+
+class QualityGate:
+    """
+    Проверка качества фото до запроса к OCR.
+
+    Размытое, тёмное или снятое издалека фото модель всё равно не прочитает,
+    а ответ с пустыми полями занимает 5-20 секунд и стоит денег. Проверка
+    считается на уменьшенной копии в пуле потоков quality (NumPy и Pillow
+    отпускают GIL, а файл загрузки нельзя передать в другой процесс)
+    и занимает десятки миллисекунд. Время каждой проверки попадает в ответ
+    (quality.timings_ms) и в /api/admin/metrics.
+
+    Пороги (quality_min_*) подобраны с запасом: отклоняются только снимки,
+    на которых текст заведомо не читается.
+    """
+
+    def __init__(self):
+        self.stats = {
+            "checked": 0,
+            "rejected": 0,
+            "errors": 0,
+            "issues": {name: 0 for name in QUALITY_MESSAGES},
+            "ms_total": {name: 0.0 for name in QUALITY_CHECKS},
+            "ms_max": {name: 0.0 for name in QUALITY_CHECKS}
+        }
+
+    async def check(self, file: UploadFile) -> Optional[Dict[str, Any]]:
+        """
+        Оценка загруженного фото.
+        Возвращает {"passed", "issues", "message", "metrics", "timings_ms"}
+        или None, если проверка выключена или изображение не удалось разобрать.
+        """
+        if not settings.quality_check_enabled:
+            return None
+        try:
+            report = await executors.run_thread("quality", _analyze_upload, file)
+        except Exception as e:
+            # Проверка не должна мешать распознаванию: непонятный файл уйдёт в OCR как раньше
+            self.stats["errors"] += 1
+            print(f"Quality check failed for {file.filename}: {e}")
+            return None
+
+        issues = quality_issues(report["metrics"])
+        self.stats["checked"] += 1
+        for name, elapsed in report["timings_ms"].items():
+            self.stats["ms_total"][name] += elapsed
+            self.stats["ms_max"][name] = max(self.stats["ms_max"][name], elapsed)
+        if issues:
+            self.stats["rejected"] += 1
+            for name in issues:
+                self.stats["issues"][name] += 1
+            print(f"📷 {file.filename} rejected by quality check: {', '.join(issues)} {report['metrics']}")
+
+        return {
+            "passed": not issues,
+            "issues": issues,
+            "message": " ".join(QUALITY_MESSAGES[name] + "." for name in issues) or None,
+            **report
+        }
+
+    def snapshot(self) -> dict:
+        checked = self.stats["checked"]
+        return {
+            "checked": checked,
+            "rejected": self.stats["rejected"],
+            "errors": self.stats["errors"],
+            "issues": dict(self.stats["issues"]),
+            "avg_ms": {
+                name: round(total / checked, 2) if checked else 0.0
+                for name, total in self.stats["ms_total"].items()
+            },
+            "max_ms": {name: round(value, 2) for name, value in self.stats["ms_max"].items()},
+            "thresholds": {
+                "min_sharpness": settings.quality_min_sharpness,
+                "min_brightness": settings.quality_min_brightness,
+                "max_brightness": settings.quality_max_brightness,
+                "min_coverage": settings.quality_min_coverage
+            }
+        }
+
+
+quality_gate = QualityGate()
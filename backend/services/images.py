@@ -0,0 +1,588 @@
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from fastapi import UploadFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+from backend.services.image_processing import archive_image, perceptual_hash
+from backend.services.derivatives import derivative_cache
+from backend.services.duplicates import phash_bands
+from backend.services.executors import executors
+from backend.services.storage import storage, image_path, storage_key
+from backend.utils.uploads import IngestedFile, ingest_upload
+
+settings = get_settings()
+
+# Состояния загрузки: сохранена и ждёт заявку / привязана к заявке / объект удалён /
+# заменён архивной копией (запись нужна для перенаправления старых ссылок)
+UPLOAD_STATES = ("pending", "attached", "deleted", "replaced")
+
+# Размер очереди архивного перекодирования на процесс
+ARCHIVE_QUEUE_SIZE = 1000
+# Архивная копия заменяет оригинал, только если она меньше хотя бы на 10%
+ARCHIVE_MIN_SAVING = 0.1
+# Через сколько незавершённое перекодирование (упавший воркер) можно начать заново
+ARCHIVE_CLAIM_TIMEOUT = timedelta(minutes=10)
+# Оригинал удаляется не сразу после замены: заявка, получившая его путь в attach()
+# до замены, может записаться уже после переписывания путей
+ARCHIVE_PURGE_DELAY = timedelta(minutes=10)
+# Глубина цепочки замен оригинал -> архивная копия (на практике одна)
+MAX_REPLACEMENTS = 5
+# Сколько брошенных загрузок удаляется за один проход сборщика
+SWEEP_BATCH = 1000
+
+
+async def _single_chunk(data: bytes):
+    yield data
+
+
+def _upload_phash(file: UploadFile) -> Optional[str]:
+    """Перцептивный хэш загрузки из временного файла запроса (синхронная, CPU-bound)"""
+    try:
+        file.file.seek(0)
+        return perceptual_hash(file.file)
+    except Exception as e:
+        print(f"Perceptual hash failed for {file.filename}: {e}")
+        return None
+
+
+class ImageStore:
+    """
+    Контентно-адресуемое хранение изображений поверх storage.
+
+    Ключ объекта - SHA-256 содержимого + расширение: повторная загрузка
+    того же фото не создаёт новый объект. На каждый объект в коллекции
+    stored_images есть запись:
+    - state: pending (сохранён при загрузке, заявки ещё нет),
+      attached (на него ссылаются заявки), deleted (объект удалён),
+      replaced (заменён архивной копией)
+    - uploaded_at / attached_at / deleted_at - время переходов
+    - refcount и student_ids - ссылающиеся заявки
+    Объект удаляется вместе с последней ссылающейся заявкой, а брошенные
+    загрузки (форма не была сохранена) - периодическим сборщиком (sweep).
+
+    После сохранения заявки её оригиналы в фоне перекодируются в WebP/AVIF.
+    Архивная копия - новый объект со своим хэшем; пути в заявках переписываются,
+    а запись оригинала остаётся с replaced_by (state=replaced, без deleted_at -
+    TTL её не удаляет) - по ней старые ссылки перенаправляются (routes/files.py),
+    а повторная загрузка того же оригинала сразу получает архивную копию.
+    Запись удаляется вместе с архивной копией (release). Сам объект оригинала
+    удаляет сборщик (purge_replaced) через ARCHIVE_PURGE_DELAY после замены,
+    когда ни одна заявка на него больше не ссылается.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self.last_sweep: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _collection():
+        return get_database().stored_images
+
+    async def start(self):
+        """Запуск воркера перекодирования и сборщика брошенных загрузок (вызывается в lifespan)"""
+        if self._worker_task is None and settings.image_archive_enabled:
+            self._queue = asyncio.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+            self._worker_task = asyncio.create_task(self._worker())
+            print("✅ Image archive worker started")
+        if self._sweeper_task is None and settings.upload_sweep_interval_seconds > 0:
+            self._sweeper_task = asyncio.create_task(self._sweeper())
+            print(f"✅ Upload sweeper started: every {settings.upload_sweep_interval_seconds}s")
+
+    async def stop(self):
+        """Остановка фоновых задач (незаконченное перекодирование подхватится по claim timeout)"""
+        tasks = [task for task in (self._worker_task, self._sweeper_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_task = None
+        self._sweeper_task = None
+        if tasks:
+            print("Image background tasks stopped")
+
+    async def _resolve(self, key: str) -> Optional[Dict[str, Any]]:
+        """Запись объекта с учётом замены на архивную копию"""
+        record = await self._collection().find_one({"_id": key})
+        for _ in range(MAX_REPLACEMENTS):
+            if not record or not record.get("replaced_by"):
+                break
+            record = await self._collection().find_one({"_id": record["replaced_by"]})
+        return record
+
+    async def replacement(self, key: str) -> Optional[str]:
+        """Ключ архивной копии, заменившей объект (None - объект не заменялся)"""
+        record = await self._collection().find_one({"_id": key}, {"replaced_by": 1})
+        if not record or not record.get("replaced_by"):
+            return None
+        resolved = await self._resolve(record["replaced_by"])
+        return resolved["_id"] if resolved else record["replaced_by"]
+
+    async def save_upload(self, file: UploadFile, max_size: int) -> IngestedFile:
+        """
+        Потоковое сохранение загрузки под ключом по содержимому.
+        Хэш известен только после записи, поэтому файл сначала пишется
+        под временным ключом, а затем переносится (или удаляется, если такой
+        объект уже есть).
+        """
+        upload = await ingest_upload(file, storage, max_size)
+        extension = os.path.splitext(upload.key)[1]
+        key = f"{upload.sha256}{extension}"
+        # Хэш для поиска почти дубликатов (services/duplicates.py)
+        phash = await executors.run_thread("cpu", _upload_phash, file) if settings.duplicate_check_enabled else None
+
+        existing = await self._resolve(key)
+        if existing is None and await storage.stat(key) is not None:
+            # Объект есть, а записи нет (запись не успела создаться) - используем объект
+            existing = {"_id": key, "size": upload.size, "mime_type": upload.mime_type}
+
+        # Отметка о новой загрузке; если объект тем временем удалён - сохраняем свою копию
+        if existing is not None and existing.get("state") != "deleted" and await self._touch(existing["_id"], upload, phash):
+            await storage.delete(upload.key)
+            return IngestedFile(
+                key=existing["_id"],
+                size=existing.get("size", upload.size),
+                sha256=upload.sha256,
+                mime_type=existing.get("mime_type", upload.mime_type),
+                deduplicated=True
+            )
+
+        try:
+            await storage.rename(upload.key, key)
+        except Exception:
+            # Параллельная загрузка того же фото успела раньше
+            if await storage.stat(key) is None:
+                await storage.delete(upload.key)
+                raise
+            await storage.delete(upload.key)
+        await self._register(key, upload, phash)
+        return upload._replace(key=key)
+
+    @staticmethod
+    def _upload_fields(upload: IngestedFile) -> Dict[str, Any]:
+        return {"sha256": upload.sha256, "size": upload.size, "mime_type": upload.mime_type}
+
+    async def _touch(self, key: str, upload: IngestedFile, phash: Optional[str] = None) -> bool:
+        """Отметка времени загрузки (продлевает жизнь pending). False - объект уже удалён"""
+        now = datetime.utcnow()
+        fields = {"uploaded_at": now}
+        if phash:
+            fields.update({"phash": phash, "phash_bands": phash_bands(phash)})
+        try:
+            await self._collection().update_one(
+                {"_id": key, "state": {"$ne": "deleted"}},
+                {
+                    "$set": fields,
+                    "$setOnInsert": {
+                        **self._upload_fields(upload),
+                        "state": "pending",
+                        "refcount": 0,
+                        "created_at": now
+                    }
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _register(self, key: str, upload: IngestedFile, phash: Optional[str] = None):
+        """Запись о новом объекте (в том числе повторно загруженном после удаления)"""
+        now = datetime.utcnow()
+        await self._collection().update_one(
+            {"_id": key, "state": {"$in": ["deleted", "replaced"]}},
+            {
+                "$set": {
+                    **self._upload_fields(upload),
+                    "state": "pending",
+                    "refcount": 0,
+                    "created_at": now,
+                    "uploaded_at": now
+                },
+                "$unset": {
+                    "replaced_by": "", "deleted_at": "", "student_ids": "",
+                    "archived": "", "archived_size": "", "archived_at": ""
+                }
+            }
+        )
+        await self._touch(key, upload, phash)
+
+    async def _mark_deleted(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Атомарный переход в deleted: объект удаляет только тот, кто перевёл запись"""
+        return await self._collection().find_one_and_update(
+            query,
+            {"$set": {"state": "deleted", "deleted_at": datetime.utcnow()}},
+            projection={"size": 1}
+        )
+
+    @staticmethod
+    async def _delete_object(key: str):
+        """Удаление объекта из хранилища вместе с его миниатюрами и превью"""
+        await storage.delete(key)
+        await derivative_cache.invalidate(key)
+
+    async def discard(self, uploads: List[IngestedFile]):
+        """
+        Удаление загрузок неудавшегося запроса. Объект удаляется, только если
+        он создан этим запросом и на него не ссылается ни одна заявка.
+        """
+        for upload in uploads:
+            if upload.deduplicated:
+                continue
+            try:
+                record = await self._mark_deleted({
+                    "_id": upload.key,
+                    "state": "pending",
+                    "refcount": {"$lte": 0},
+                    "replaced_by": {"$exists": False}
+                })
+                if record is not None:
+                    await self._delete_object(upload.key)
+            except Exception as e:
+                print(f"Failed to remove upload {upload.key}: {e}")
+
+    async def attach(self, paths: List[Any], student_id: ObjectId) -> List[Any]:
+        """
+        Привязка изображений к сохраняемой заявке: state=attached, refcount+1, student_ids.
+        Возвращает пути с учётом замены на архивные копии - их и нужно сохранить.
+        Изображения старого формата (uuid ключи без записи) регистрируются здесь же.
+        """
+        attached = []
+        now = datetime.utcnow()
+        for path in paths:
+            if not isinstance(path, str) or not storage_key(path):
+                attached.append(path)
+                continue
+            key = storage_key(path)
+            for _ in range(MAX_REPLACEMENTS):
+                try:
+                    # Фильтр по replaced_by: заменённый объект не совпадёт, upsert упадёт
+                    # на существующем _id - тогда идём по цепочке к архивной копии
+                    before = await self._collection().find_one_and_update(
+                        {"_id": key, "replaced_by": {"$exists": False}},
+                        {
+                            "$inc": {"refcount": 1},
+                            "$set": {"state": "attached", "attached_at": now},
+                            "$addToSet": {"student_ids": student_id},
+                            "$setOnInsert": {"created_at": now, "uploaded_at": now}
+                        },
+                        projection={"state": 1},
+                        upsert=True
+                    )
+                    if before is not None and before.get("state") == "deleted":
+                        print(f"⚠️  Image {key} was removed before the student was saved")
+                    break
+                except DuplicateKeyError:
+                    key = await self.replacement(key) or key
+            attached.append(image_path(key))
+        return attached
+
+    async def release(self, paths: List[Any], student_id: ObjectId):
+        """Отвязка изображений удалённой заявки; объекты без ссылок удаляются"""
+        for path in paths:
+            if not isinstance(path, str) or not storage_key(path):
+                continue
+            record = await self._resolve(storage_key(path))
+            if record is None or record.get("state") == "deleted":
+                continue
+            key = record["_id"]
+            await self._collection().update_one(
+                {"_id": key},
+                {"$inc": {"refcount": -1}, "$pull": {"student_ids": student_id}}
+            )
+            orphan = await self._mark_deleted({"_id": key, "state": "attached", "refcount": {"$lte": 0}})
+            if orphan is not None:
+                await self._delete_object(key)
+                # Записи оригиналов, заменённых этой копией, больше не нужны для редиректа;
+                # оригиналы, которые сборщик ещё не удалил, удаляются здесь же
+                async for original in self._collection().find({"replaced_by": key, "purge_after": {"$exists": True}}, {"_id": 1}):
+                    await self._delete_object(original["_id"])
+                await self._collection().delete_many({"replaced_by": key})
+                print(f"🗑  Image {key} removed: no references left")
+
+    async def sweep(self) -> Dict[str, Any]:
+        """
+        Удаление брошенных загрузок: pending дольше upload_pending_ttl_seconds.
+        Выборка идёт по индексу (state, uploaded_at), каталог хранилища не сканируется.
+        Каждая запись захватывается атомарно - сборщики разных воркеров не мешают друг другу.
+        """
+        started = time.perf_counter()
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.upload_pending_ttl_seconds)
+        report = {"deleted": 0, "reclaimed_bytes": 0, "failed": 0}
+        failed_keys = []
+        for _ in range(SWEEP_BATCH):
+            record = await self._mark_deleted({
+                "state": "pending",
+                "uploaded_at": {"$lt": cutoff},
+                "refcount": {"$lte": 0},
+                "_id": {"$nin": failed_keys}
+            })
+            if record is None:
+                break
+            try:
+                await self._delete_object(record["_id"])
+            except Exception as e:
+                # Вернём в pending - следующий проход попробует снова
+                print(f"Failed to sweep upload {record['_id']}: {e}")
+                failed_keys.append(record["_id"])
+                await self._collection().update_one(
+                    {"_id": record["_id"]},
+                    {"$set": {"state": "pending"}, "$unset": {"deleted_at": ""}}
+                )
+                report["failed"] += 1
+            else:
+                report["deleted"] += 1
+                report["reclaimed_bytes"] += record.get("size") or 0
+
+        report["purged_originals"] = await self.purge_replaced()
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        report["finished_at"] = datetime.utcnow()
+        self.last_sweep = report
+        if report["deleted"] or report["failed"] or report["purged_originals"]:
+            print(
+                f"🧹 Upload sweep: removed {report['deleted']} abandoned uploads, "
+                f"reclaimed {report['reclaimed_bytes'] // 1024} KB, failed {report['failed']}, "
+                f"purged {report['purged_originals']} replaced originals"
+            )
+        return report
+
+    async def _rewrite_paths(self, key: str, new_key: str) -> int:
+        """Замена пути оригинала на путь архивной копии во всех заявках"""
+        old_path, new_path = image_path(key), image_path(new_key)
+        result = await get_database().students.update_many(
+            {"image_paths": old_path},
+            {"$set": {"image_paths.$[path]": new_path}},
+            array_filters=[{"path": old_path}]
+        )
+        return result.modified_count
+
+    async def purge_replaced(self) -> int:
+        """
+        Удаление объектов оригиналов, заменённых архивной копией (purge_after истёк).
+        Пути заявок переписываются ещё раз - это подхватывает заявки, сохранённые
+        между attach() и заменой; объект удаляется, только если ссылок на него не осталось.
+        Запись захватывается сдвигом purge_after, как перекодирование - archiving_at.
+        """
+        purged = 0
+        for _ in range(SWEEP_BATCH):
+            now = datetime.utcnow()
+            record = await self._collection().find_one_and_update(
+                {"purge_after": {"$lt": now}},
+                {"$set": {"purge_after": now + ARCHIVE_PURGE_DELAY}},
+                projection={"replaced_by": 1}
+            )
+            if record is None:
+                break
+            key = record["_id"]
+            try:
+                new_key = await self.replacement(key)
+                if new_key:
+                    rewritten = await self._rewrite_paths(key, new_key)
+                    if rewritten:
+                        print(f"⚠️  {rewritten} students still referenced replaced image {key}, paths rewritten")
+                if await get_database().students.find_one({"image_paths": image_path(key)}, {"_id": 1}) is not None:
+                    # Ссылка появилась после переписывания - попробуем на следующем проходе
+                    continue
+                await self._delete_object(key)
+                await self._collection().update_one({"_id": key}, {"$unset": {"purge_after": ""}})
+                purged += 1
+            except Exception as e:
+                print(f"Failed to purge replaced image {key}: {e}")
+        return purged
+
+    async def _sweeper(self):
+        # Записи без состояния (сохранены до появления жизненного цикла)
+        try:
+            await self._collection().update_many(
+                {"state": {"$exists": False}, "refcount": {"$gt": 0}},
+                {"$set": {"state": "attached"}}
+            )
+            # Заменённые оригиналы: раньше они помечались deleted с deleted_at и попадали под TTL
+            await self._collection().update_many(
+                {"replaced_by": {"$exists": True}, "state": {"$in": [None, "deleted"]}},
+                {"$set": {"state": "replaced"}, "$unset": {"deleted_at": ""}}
+            )
+            # Ответ API при распознавании раньше копировался и сюда - он есть в заявке
+            for kind in ("student", "feedback"):
+                await self._collection().update_many(
+                    {f"ocr.{kind}.ocr_raw": {"$exists": True}},
+                    {"$unset": {f"ocr.{kind}.ocr_raw": ""}}
+                )
+            async for record in self._collection().find({"state": {"$exists": False}}, {"created_at": 1}):
+                await self._collection().update_one(
+                    {"_id": record["_id"]},
+                    {"$set": {"state": "pending", "uploaded_at": record.get("created_at") or datetime.utcnow()}}
+                )
+        except Exception as e:
+            print(f"Upload state backfill failed: {e}")
+
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Upload sweep failed: {e}")
+            await asyncio.sleep(settings.upload_sweep_interval_seconds)
+
+    def schedule_archive(self, paths: List[Any]):
+        """Постановка изображений сохранённой заявки в очередь перекодирования"""
+        if self._queue is None:
+            return
+        for path in paths:
+            if not isinstance(path, str) or not storage_key(path):
+                continue
+            try:
+                self._queue.put_nowait(storage_key(path))
+            except asyncio.QueueFull:
+                print(f"⚠️  Image archive queue is full, {path} stays as original")
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                await self.archive(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Image archive failed for {key}: {e}")
+                await self._collection().update_one({"_id": key}, {"$unset": {"archiving_at": ""}})
+            finally:
+                self._queue.task_done()
+
+    async def archive(self, key: str) -> Optional[str]:
+        """
+        Перекодирование оригинала в архивный формат.
+        Возвращает ключ архивной копии или None, если замена не понадобилась.
+        """
+        now = datetime.utcnow()
+        # Захват записи: при нескольких воркерах uvicorn объект перекодирует только один
+        record = await self._collection().find_one_and_update(
+            {
+                "_id": key,
+                "state": "attached",
+                "archived": {"$ne": True},
+                "replaced_by": {"$exists": False},
+                "$or": [
+                    {"archiving_at": {"$exists": False}},
+                    {"archiving_at": {"$lt": now - ARCHIVE_CLAIM_TIMEOUT}}
+                ]
+            },
+            {"$set": {"archiving_at": now}}
+        )
+        if record is None:
+            return None
+
+        data = await storage.read(key)
+        encoded = await executors.run_process(archive_image, data)
+        if encoded is None or len(encoded[0]) > len(data) * (1 - ARCHIVE_MIN_SAVING):
+            await self._collection().update_one(
+                {"_id": key},
+                {"$set": {"archived": True, "size": len(data)}, "$unset": {"archiving_at": ""}}
+            )
+            return None
+
+        archived, mime_type = encoded
+        sha256 = hashlib.sha256(archived).hexdigest()
+        new_key = f"{sha256}.{mime_type.split('/')[1]}"
+        if await storage.stat(new_key) is None:
+            await storage.put(new_key, _single_chunk(archived), len(archived), mime_type)
+        await self._collection().update_one(
+            {"_id": new_key},
+            {"$setOnInsert": {
+                "sha256": sha256,
+                "size": len(archived),
+                "mime_type": mime_type,
+                "refcount": 0,
+                "state": "pending",
+                "archived": True,
+                "created_at": datetime.utcnow(),
+                "uploaded_at": datetime.utcnow(),
+                # Та же картинка: хэш и распознавание переходят к архивной копии
+                **{field: record[field] for field in ("phash", "phash_bands", "ocr") if record.get(field)}
+            }},
+            upsert=True
+        )
+
+        # Атомарно помечаем оригинал заменённым и забираем его счётчик:
+        # новые ссылки после этого момента attach() направит на архивную копию
+        original = await self._collection().find_one_and_update(
+            {"_id": key},
+            {
+                "$set": {
+                    "replaced_by": new_key,
+                    "state": "replaced",
+                    "archived": True,
+                    "refcount": 0,
+                    "size": len(data),
+                    "archived_size": len(archived),
+                    "archived_at": datetime.utcnow(),
+                    "purge_after": datetime.utcnow() + ARCHIVE_PURGE_DELAY
+                },
+                "$unset": {"archiving_at": "", "deleted_at": ""}
+            },
+            return_document=ReturnDocument.BEFORE
+        )
+        if original is not None and original.get("refcount", 0):
+            await self._collection().update_one(
+                {"_id": new_key},
+                {
+                    "$inc": {"refcount": original["refcount"]},
+                    "$set": {"state": "attached", "attached_at": datetime.utcnow()},
+                    "$addToSet": {"student_ids": {"$each": original.get("student_ids", [])}}
+                }
+            )
+
+        # Объект оригинала остаётся до purge_replaced: заявка, привязавшая его
+        # до замены, может записаться уже после этого переписывания
+        await self._rewrite_paths(key, new_key)
+
+        print(f"🗜  {key}: {len(data) // 1024} KB -> {new_key} {len(archived) // 1024} KB")
+        return new_key
+
+    async def usage(self) -> Dict[str, Any]:
+        """
+        Объём хранилища по записям stored_images: объекты и байты по состояниям,
+        экономия от перекодирования, результат последнего прохода сборщика
+        """
+        groups = await self._collection().aggregate([
+            {"$group": {
+                "_id": "$state",
+                "count": {"$sum": 1},
+                "bytes": {"$sum": {"$ifNull": ["$size", 0]}},
+                "references": {"$sum": {"$ifNull": ["$refcount", 0]}},
+                "archived": {"$sum": {"$cond": [{"$ifNull": ["$replaced_by", False]}, 1, 0]}},
+                "archive_saved_bytes": {"$sum": {
+                    "$subtract": [{"$ifNull": ["$size", 0]}, {"$ifNull": ["$archived_size", "$size"]}]
+                }}
+            }}
+        ]).to_list(None)
+
+        states = {state: {"count": 0, "bytes": 0} for state in UPLOAD_STATES}
+        stats = {"objects": 0, "bytes": 0, "references": 0, "archived": 0, "archive_saved_bytes": 0}
+        for group in groups:
+            state = group["_id"] or "pending"
+            states.setdefault(state, {"count": 0, "bytes": 0})
+            states[state]["count"] += group["count"]
+            states[state]["bytes"] += group["bytes"]
+            if state not in ("deleted", "replaced"):
+                stats["objects"] += group["count"]
+                stats["bytes"] += group["bytes"]
+            stats["references"] += group["references"]
+            stats["archived"] += group["archived"]
+            stats["archive_saved_bytes"] += group["archive_saved_bytes"]
+
+        stats["states"] = states
+        stats["archive_queue"] = self._queue.qsize() if self._queue is not None else 0
+        stats["last_sweep"] = self.last_sweep
+        return stats
+
+
+image_store = ImageStore()
@@ -1,259 +1,583 @@
-import httpx
-import base64
+import asyncio
+import hashlib
 import json
-from typing import Optional
+import time
+from typing import Optional, List, Tuple, AsyncIterator
 from backend.config import get_settings
-from backend.models.student import OCRResult, FeedbackOCRResult
+from backend.models.student import OCRResult, FeedbackOCRResult, OCR_SERVICE_FIELDS
+from backend.services.http_client import get_openrouter_client
+from backend.services.ocr_cache import ocr_cache
+from backend.services.image_processing import prepare_image_for_ocr
+from backend.services.ocr_scheduler import OCRServiceUnavailable, ocr_scheduler
+from backend.services.ocr_routing import model_router
+from backend.services.executors import executors
+from backend.utils.json_stream import JSONFieldStream, extract_json_object
+from backend.utils.json_body import InlineImage, build_json_body, iter_body
 
 settings = get_settings()
 
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = settings.openrouter_api_url
+# Ответы OpenRouter больше этого размера разбираются вне event loop, байт
+JSON_OFFLOAD_BYTES = 256 * 1024
 
+# Промпты описывают только задачу: формат ответа задаётся JSON-схемой (structured output)
+# Промпт для извлечения данных ученика (первая страница)
+STUDENT_PROMPT = """Проанализируй изображение анкеты и извлеки данные ученика: ФИО, школу, класс, номер телефона, а также имя и телефон родителя, если они указаны.
+Если обязательное поле не удалось распознать, оставь пустую строку; отсутствующие данные родителя - null.
+Если это не анкета с данными ученика, верни пустые значения для всех полей."""
 
-async def process_image_ocr(image_data: bytes, filename: str) -> OCRResult:
+# Промпт для извлечения данных обратной связи (вторая страница)
+FEEDBACK_PROMPT = """Проанализируй изображение анкеты обратной связи после мастер-класса: оценку мастер-класса и оценку спикера по 10-балльной шкале и свободный текст отзыва (что улучшить, что сделано классно).
+Нераспознанные оценки - null, нераспознанный отзыв - пустая строка.
+Если это не анкета обратной связи, верни null для оценок и пустую строку для отзыва."""
+
+# Промпт для распознавания обеих страниц анкеты одним запросом
+COMBINED_PROMPT = """Тебе переданы фотографии двух страниц одной анкеты в произвольном порядке (нумерация изображений с 0).
+Одна страница - данные ученика (ФИО, школа, класс, телефон, данные родителя), другая - обратная связь после мастер-класса (оценки мастер-класса и спикера по 10-балльной шкале и текст отзыва).
+Определи, какое изображение какой странице соответствует (pages), и извлеки данные обеих страниц.
+Нераспознанные текстовые поля - пустая строка, отсутствующие данные родителя и оценки - null.
+Если какой-то страницы среди изображений нет, верни null в pages для неё."""
+
+
+def _response_schema(model) -> dict:
     """
-    Обрабатывает изображение через OpenRouter API с моделью Gemini 3 Pro
-    и извлекает структурированные данные ученика.
+    JSON-схема ответа модели, построенная по pydantic модели результата.
+    Служебные поля исключаются, все поля обязательны (требование strict режима).
     """
-    # Конвертируем изображение в base64
-    base64_image = base64.b64encode(image_data).decode("utf-8")
-    
-    # Определяем MIME тип
-    mime_type = "image/jpeg"
-    if filename.lower().endswith(".png"):
-        mime_type = "image/png"
-    elif filename.lower().endswith(".webp"):
-        mime_type = "image/webp"
-    elif filename.lower().endswith(".gif"):
-        mime_type = "image/gif"
-    
-    # Формируем промпт для извлечения данных
-    prompt = """Проанализируй изображение и извлеки данные ученика. 
-На изображении должна быть информация о:
-- ФИО (полное имя ученика)
-- Школа (название школы)
-- Класс (номер и буква класса, например "5А" или "11Б")
-- Номер телефона
-- Имя родителя (опционально, может быть не указано)
-- Телефон родителя (опционально, может быть не указано)
-
-Верни данные ТОЛЬКО в формате JSON без дополнительного текста:
-{
-    "fio": "Фамилия Имя Отчество",
-    "school": "Название школы",
-    "class": "Класс",
-    "phone": "Номер телефона",
-    "parent_name": "Имя родителя или null",
-    "parent_phone": "Телефон родителя или null"
+    schema = model.model_json_schema(by_alias=True)
+    properties = {}
+    for name, prop in schema["properties"].items():
+        if name in OCR_SERVICE_FIELDS:
+            continue
+        prop = {key: value for key, value in prop.items() if key not in ("default", "title")}
+        if "anyOf" in prop:
+            prop["type"] = [option["type"] for option in prop.pop("anyOf")]
+        properties[name] = prop
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+STUDENT_SCHEMA = _response_schema(OCRResult)
+FEEDBACK_SCHEMA = _response_schema(FeedbackOCRResult)
+COMBINED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "pages": {
+            "type": "object",
+            "properties": {
+                "student": {"type": ["integer", "null"], "description": "Номер изображения с данными ученика"},
+                "feedback": {"type": ["integer", "null"], "description": "Номер изображения с обратной связью"}
+            },
+            "required": ["student", "feedback"],
+            "additionalProperties": False
+        },
+        "student": STUDENT_SCHEMA,
+        "feedback": FEEDBACK_SCHEMA
+    },
+    "required": ["pages", "student", "feedback"],
+    "additionalProperties": False
 }
 
-Если какое-то обязательное поле (fio, school, class, phone) не удалось распознать, оставь пустую строку.
-Если опциональные поля (parent_name, parent_phone) не найдены в анкете, верни null для них.
-Если это не изображение с данными ученика, верни пустые значения для всех полей."""
+# Параметры распознавания по типу запроса: промпт, схема ответа и лимит токенов ответа
+PAGE_KINDS = {
+    "student": (STUDENT_PROMPT, STUDENT_SCHEMA, 1000),
+    "feedback": (FEEDBACK_PROMPT, FEEDBACK_SCHEMA, 1500),
+    "combined": (COMBINED_PROMPT, COMBINED_SCHEMA, 2500)
+}
+
+
+def _page_prompt(kind: str) -> str:
+    """
+    Итоговый текст промпта.
+    Без structured output схема ответа дописывается в промпт.
+    """
+    prompt, schema, _ = PAGE_KINDS[kind]
+    if settings.ocr_structured_output:
+        return prompt
+    return (
+        f"{prompt}\n\nВерни ТОЛЬКО JSON без дополнительного текста по схеме:\n"
+        f"{json.dumps(schema, ensure_ascii=False)}"
+    )
+
+
+def _cache_key(image_data: bytes, kind: str, image_hash: Optional[str] = None) -> str:
+    """Ключ кэша OCR: изображение + цепочка моделей + промпт и схема ответа"""
+    _, schema, _ = PAGE_KINDS[kind]
+    version = f"{_page_prompt(kind)}\n{json.dumps(schema, sort_keys=True)}\n{settings.ocr_structured_output}"
+    return ocr_cache.make_key(image_data, kind, ",".join(model_router.models), version, image_hash)
 
-    headers = {
+
+def _headers() -> dict:
+    """Заголовки запроса к OpenRouter"""
+    return {
         "Authorization": f"Bearer {settings.openrouter_api_key}",
         "Content-Type": "application/json",
         "HTTP-Referer": "https://ocr-crm.local",
         "X-Title": "OCR CRM"
     }
+
+
+def _image_part(image_data: bytes, mime_type: str) -> dict:
+    """
+    Изображение в формате content-части сообщения (data URL).
+    base64 не строится заранее: build_json_body кодирует его сразу в тело запроса.
+    """
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": InlineImage(image_data, mime_type)
+        }
+    }
+
+
+async def _request_body(payload: dict) -> Tuple[bytearray, dict]:
+    """
+    Тело запроса одним буфером и заголовки к нему (с Content-Length - без chunked).
+    base64 и JSON мегабайтных изображений собираются в пуле потоков, а не в event loop.
+    """
+    body = await executors.run_thread("cpu", build_json_body, payload)
+    return body, {**_headers(), "Content-Length": str(len(body))}
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+async def _image_hash(image_data: bytes, image_hash: Optional[str] = None) -> str:
+    """SHA-256 изображения (если не посчитан при загрузке) - в пуле потоков, hashlib отпускает GIL"""
+    return image_hash or await executors.run_thread("cpu", _sha256_hex, image_data)
+
+
+async def _parse_response(response) -> dict:
+    """Разбор JSON ответа OpenRouter; большие ответы - в пуле потоков"""
+    if len(response.content) < JSON_OFFLOAD_BYTES:
+        return response.json()
+    return await executors.run_thread("cpu", json.loads, response.content)
+
+
+def _normalize_rating(value) -> Optional[int]:
+    """Оценка по 10-балльной шкале: int от 1 до 10 или None"""
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (ValueError, TypeError):
+        return None
+    if value < 1 or value > 10:
+        return None
+    return value
+
+
+def _build_ocr_result(parsed_data: dict, raw_response: dict, preprocess: Optional[dict]) -> OCRResult:
+    """Сборка OCRResult из распарсенного ответа модели"""
+    # Обрабатываем опциональные поля родителя
+    parent_name = parsed_data.get("parent_name")
+    parent_phone = parsed_data.get("parent_phone")
     
+    # Преобразуем пустые строки в None для опциональных полей
+    if parent_name == "" or parent_name is None:
+        parent_name = None
+    if parent_phone == "" or parent_phone is None:
+        parent_phone = None
+    
+    return OCRResult(
+        fio=parsed_data.get("fio") or "",
+        school=parsed_data.get("school") or "",
+        student_class=parsed_data.get("class") or "",
+        phone=parsed_data.get("phone") or "",
+        parent_name=parent_name,
+        parent_phone=parent_phone,
+        raw_response=raw_response,
+        preprocess=preprocess
+    )
+
+
+def _build_feedback_result(parsed_data: dict, raw_response: dict, preprocess: Optional[dict]) -> FeedbackOCRResult:
+    """Сборка FeedbackOCRResult из распарсенного ответа модели"""
+    return FeedbackOCRResult(
+        masterclass_rating=_normalize_rating(parsed_data.get("masterclass_rating")),
+        speaker_rating=_normalize_rating(parsed_data.get("speaker_rating")),
+        feedback=parsed_data.get("feedback") or "",
+        raw_response=raw_response,
+        preprocess=preprocess
+    )
+
+
+def _completion_payload(kind: str, images: list, model: str, stream: bool = False) -> dict:
+    """Тело запроса chat completion: модель, промпт, изображения и формат ответа"""
+    _, schema, max_tokens = PAGE_KINDS[kind]
     payload = {
-        "model": "google/gemini-2.0-flash-001",
+        "model": model,
         "messages": [
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}"
-                        }
-                    }
-                ]
+                "content": [{"type": "text", "text": _page_prompt(kind)}, *images]
             }
         ],
-        "max_tokens": 1000,
+        "max_tokens": max_tokens,
         "temperature": 0.1
     }
+    if settings.ocr_structured_output:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": f"{kind}_form",
+                "strict": True,
+                "schema": schema
+            }
+        }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+
+async def _request_completion(kind: str, images: list, model: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Запрос к OpenRouter.
+    Возвращает (ответ, None) при успехе или (None, текст ошибки).
+    Если провайдер недоступен после всех повторов - бросает OCRServiceUnavailable.
+    """
+    body, headers = await _request_body(_completion_payload(kind, images, model))
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
+    client = get_openrouter_client()
+    # Допуск через общий планировщик: лимит параллельности, частоты и повторы 429/5xx.
+    # Поток тела создаётся заново на каждую попытку, сам буфер переиспользуется
+    response = await ocr_scheduler.run(
+        lambda: client.post(
             OPENROUTER_API_URL,
             headers=headers,
-            json=payload
+            content=iter_body(body)
         )
-        
-        if response.status_code != 200:
-            print(f"OpenRouter API error: {response.status_code} - {response.text}")
-            return OCRResult(raw_response={"error": response.text})
-        
-        result = response.json()
-        
-        # Извлекаем текст ответа
+    )
+    
+    if response.status_code != 200:
+        print(f"OpenRouter API error: {response.status_code} - {response.text}")
+        return None, response.text
+    
+    return await _parse_response(response), None
+
+
+def _model_call(kind: str, images: list):
+    """
+    Вызов одной модели для маршрутизатора: запрос и разбор JSON ответа.
+    Возвращает (распарсенные данные, сырой ответ, ошибка).
+    """
+    async def call(model: str):
+        result, error = await _request_completion(kind, images, model)
+        if error is not None:
+            return None, {"error": error}, error
         try:
             content = result["choices"][0]["message"]["content"]
-            
-            # Пытаемся распарсить JSON из ответа
-            # Иногда модель может вернуть JSON обернутый в markdown блок
-            json_str = content
-            if "```json" in content:
-                json_str = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                json_str = content.split("```")[1].split("```")[0].strip()
-            
-            parsed_data = json.loads(json_str)
-            
-            # Обрабатываем опциональные поля родителя
-            parent_name = parsed_data.get("parent_name")
-            parent_phone = parsed_data.get("parent_phone")
-            
-            # Преобразуем пустые строки в None для опциональных полей
-            if parent_name == "" or parent_name is None:
-                parent_name = None
-            if parent_phone == "" or parent_phone is None:
-                parent_phone = None
-            
-            return OCRResult(
-                fio=parsed_data.get("fio", ""),
-                school=parsed_data.get("school", ""),
-                student_class=parsed_data.get("class", ""),
-                phone=parsed_data.get("phone", ""),
-                parent_name=parent_name,
-                parent_phone=parent_phone,
-                raw_response=result
-            )
-            
-        except (json.JSONDecodeError, KeyError, IndexError) as e:
-            print(f"Error parsing OCR response: {e}")
-            return OCRResult(raw_response=result)
+            return extract_json_object(content), result, None
+        except (json.JSONDecodeError, KeyError, IndexError, AttributeError, TypeError) as e:
+            print(f"Error parsing OCR response from {model}: {e}")
+            return None, result, str(e)
+    return call
+
+
+async def _recognize(kind: str, images: list) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Распознавание по цепочке моделей (см. ModelRouter).
+    Возвращает (распарсенные данные или None, сырой ответ с описанием маршрута).
+    """
+    (parsed_data, raw_response, _), routing = await model_router.run(kind, _model_call(kind, images))
+    return parsed_data, {**(raw_response or {}), "routing": routing}
+
+
+async def process_image_ocr(image_data: bytes, filename: str, image_hash: Optional[str] = None) -> OCRResult:
+    """
+    Обрабатывает изображение через OpenRouter API и извлекает структурированные
+    данные ученика. Модели выбираются по цепочке ocr_model_chain (ModelRouter):
+    начинаем с дешёвой, при недоступности или неразобранном ответе страница
+    уходит следующей, а не прошедшие проверку поля перераспознаются более сильными.
+    Повторная загрузка того же изображения отдаётся из кэша без запроса к модели.
+    """
+    # Проверяем кэш по хешу изображения
+    cache_key = _cache_key(image_data, "student", await _image_hash(image_data, image_hash))
+    cached = await ocr_cache.get(cache_key)
+    if cached is not None:
+        return OCRResult(**cached, from_cache=True)
+    
+    # Нормализуем изображение (поворот, уменьшение, сжатие)
+    prepared_image, mime_type, preprocess_stats = await prepare_image_for_ocr(image_data, filename)
+    
+    parsed_data, raw_response = await _recognize("student", [_image_part(prepared_image, mime_type)])
+    if parsed_data is None:
+        return OCRResult(raw_response=raw_response, preprocess=preprocess_stats)
+    
+    ocr_result = _build_ocr_result(parsed_data, raw_response, preprocess_stats)
+    await ocr_cache.set(cache_key, ocr_result.model_dump(exclude={"from_cache", "preprocess"}))
+    return ocr_result
 
 
-async def process_feedback_image_ocr(image_data: bytes, filename: str) -> FeedbackOCRResult:
+async def process_feedback_image_ocr(
+    image_data: bytes,
+    filename: str,
+    image_hash: Optional[str] = None
+) -> FeedbackOCRResult:
     """
     Обрабатывает изображение второй страницы анкеты (обратная связь)
     и извлекает оценки и отзывы.
     """
-    # Конвертируем изображение в base64
-    base64_image = base64.b64encode(image_data).decode("utf-8")
+    # Проверяем кэш по хешу изображения
+    cache_key = _cache_key(image_data, "feedback", await _image_hash(image_data, image_hash))
+    cached = await ocr_cache.get(cache_key)
+    if cached is not None:
+        return FeedbackOCRResult(**cached, from_cache=True)
     
-    # Определяем MIME тип
-    mime_type = "image/jpeg"
-    if filename.lower().endswith(".png"):
-        mime_type = "image/png"
-    elif filename.lower().endswith(".webp"):
-        mime_type = "image/webp"
-    elif filename.lower().endswith(".gif"):
-        mime_type = "image/gif"
+    # Нормализуем изображение (поворот, уменьшение, сжатие)
+    prepared_image, mime_type, preprocess_stats = await prepare_image_for_ocr(image_data, filename)
     
-    # Формируем промпт для извлечения данных обратной связи
-    prompt = """Проанализируй изображение анкеты обратной связи после мастер-класса.
-На изображении должны быть:
-1. Оценка мастер-класса по 10-балльной шкале (число от 1 до 10)
-2. Оценка спикера по 10-балльной шкале (число от 1 до 10)
-3. Свободная форма обратной связи (текст с мыслями, что улучшить, что сделано классно)
-
-Верни данные ТОЛЬКО в формате JSON без дополнительного текста:
-{
-    "masterclass_rating": 8,
-    "speaker_rating": 9,
-    "feedback": "Текст обратной связи..."
-}
-
-Если какое-то поле не удалось распознать:
-- Для оценок верни null
-- Для feedback верни пустую строку ""
+    parsed_data, raw_response = await _recognize("feedback", [_image_part(prepared_image, mime_type)])
+    if parsed_data is None:
+        return FeedbackOCRResult(raw_response=raw_response, preprocess=preprocess_stats)
+    
+    feedback_result = _build_feedback_result(parsed_data, raw_response, preprocess_stats)
+    await ocr_cache.set(cache_key, feedback_result.model_dump(exclude={"from_cache", "preprocess"}))
+    return feedback_result
 
-Если это не анкета обратной связи, верни null для всех полей."""
 
-    headers = {
-        "Authorization": f"Bearer {settings.openrouter_api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://ocr-crm.local",
-        "X-Title": "OCR CRM"
-    }
+async def process_combined_ocr(images: List[Tuple[bytes, str]]) -> Tuple[OCRResult, FeedbackOCRResult, dict]:
+    """
+    Распознаёт обе страницы анкеты одним запросом к модели.
+    Изображения можно передавать в любом порядке - модель сама определяет,
+    где данные ученика, а где обратная связь.
     
-    payload = {
-        "model": "google/gemini-2.0-flash-001",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ],
-        "max_tokens": 1500,
-        "temperature": 0.1
+    Returns:
+        (OCRResult, FeedbackOCRResult, pages), где pages - индексы изображений
+        {"student": int | None, "feedback": int | None}
+    """
+    # Ключ кэша не зависит от порядка изображений
+    order = [await _image_hash(image_data) for image_data, _ in images]
+    digests = sorted(bytes.fromhex(image_hash) for image_hash in order)
+    cache_key = _cache_key(b"".join(digests), "combined")
+    cached = await ocr_cache.get(cache_key)
+    if cached is not None:
+        # Индексы страниц в кэше относятся к порядку первой загрузки - пересчитываем
+        pages = {
+            kind: order.index(image_hash) if image_hash in order else None
+            for kind, image_hash in cached["page_hashes"].items()
+        }
+        return (
+            OCRResult(**cached["student"], from_cache=True),
+            FeedbackOCRResult(**cached["feedback"], from_cache=True),
+            pages
+        )
+    
+    # Нормализуем все изображения параллельно
+    prepared = await asyncio.gather(
+        *[prepare_image_for_ocr(image_data, filename) for image_data, filename in images]
+    )
+    preprocess_stats = {"images": [stats for _, _, stats in prepared]}
+    
+    parsed_data, raw_response = await _recognize(
+        "combined",
+        [_image_part(prepared_image, mime_type) for prepared_image, mime_type, _ in prepared]
+    )
+    if parsed_data is None:
+        return (
+            OCRResult(raw_response=raw_response, preprocess=preprocess_stats),
+            FeedbackOCRResult(raw_response=raw_response, preprocess=preprocess_stats),
+            {"student": None, "feedback": None}
+        )
+    
+    pages = {}
+    for kind in ("student", "feedback"):
+        index = (parsed_data.get("pages") or {}).get(kind)
+        pages[kind] = index if isinstance(index, int) and 0 <= index < len(images) else None
+    
+    ocr_result = _build_ocr_result(parsed_data.get("student") or {}, raw_response, preprocess_stats)
+    feedback_result = _build_feedback_result(parsed_data.get("feedback") or {}, raw_response, preprocess_stats)
+    
+    page_hashes = {
+        kind: order[index] if index is not None else None
+        for kind, index in pages.items()
     }
+    await ocr_cache.set(cache_key, {
+        "student": ocr_result.model_dump(exclude={"from_cache", "preprocess"}),
+        "feedback": feedback_result.model_dump(exclude={"from_cache", "preprocess"}),
+        "page_hashes": page_hashes
+    })
+    return ocr_result, feedback_result, pages
+
+
+def _stream_field_value(kind: str, name: str, value):
+    """Нормализация отдельного поля так же, как при сборке полного результата"""
+    if kind == "feedback" and name in ("masterclass_rating", "speaker_rating"):
+        return _normalize_rating(value)
+    if name in ("parent_name", "parent_phone"):
+        return value or None
+    # Обязательные текстовые поля: null от модели превращаем в пустую строку
+    return "" if value is None else value
+
+
+async def stream_page_ocr(
+    image_data: bytes,
+    filename: str,
+    kind: str,
+    image_hash: Optional[str] = None
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Потоковое распознавание страницы анкеты.
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            OPENROUTER_API_URL,
-            headers=headers,
-            json=payload
+    Читает SSE поток OpenRouter и разбирает JSON по мере генерации:
+    каждое поле отдаётся сразу, как только модель его закончила.
+    Если первая модель недоступна, ответила ошибкой или вернула неразборчивый
+    JSON, страница распознаётся остальной цепочкой (как в ModelRouter.run),
+    а её поля досылаются событиями field.
+    
+    Yields:
+        ("started", {...}) - запрос принят моделью (или найден в кэше)
+        ("field", {"name": ..., "value": ...}) - очередное распознанное поле
+        ("done", payload) - итоговый результат в формате ocr_result_payload/feedback_result_payload
+    """
+    build_result = _build_feedback_result if kind == "feedback" else _build_ocr_result
+    result_model = FeedbackOCRResult if kind == "feedback" else OCRResult
+    to_payload = feedback_result_payload if kind == "feedback" else ocr_result_payload
+    
+    cache_key = _cache_key(image_data, kind, await _image_hash(image_data, image_hash))
+    cached = await ocr_cache.get(cache_key)
+    if cached is not None:
+        payload = to_payload(result_model(**cached, from_cache=True))
+        yield "started", {"from_cache": True}
+        for name, value in payload["data"].items():
+            yield "field", {"name": name, "value": value}
+        yield "done", payload
+        return
+    
+    prepared_image, mime_type, preprocess_stats = await prepare_image_for_ocr(image_data, filename)
+    images = [_image_part(prepared_image, mime_type)]
+    # Поток идёт от первой (быстрой) модели, проблемные поля дозапрашиваются после
+    model = model_router.models[0]
+    body, headers = await _request_body(_completion_payload(kind, images, model, stream=True))
+    
+    client = get_openrouter_client()
+    model_router.stats["requests"] += 1
+    started = time.monotonic()
+    try:
+        response = await ocr_scheduler.run(
+            lambda: client.send(
+                client.build_request("POST", OPENROUTER_API_URL, headers=headers, content=iter_body(body)),
+                stream=True
+            )
         )
-        
-        if response.status_code != 200:
-            print(f"OpenRouter API error: {response.status_code} - {response.text}")
-            return FeedbackOCRResult(raw_response={"error": response.text})
-        
-        result = response.json()
-        
-        # Извлекаем текст ответа
+    except OCRServiceUnavailable as e:
+        # Первая модель недоступна (лимиты, 5xx после повторов) - страница уйдёт остальной цепочке
+        response = None
+        stream_error = str(e)
+    
+    yield "started", {"from_cache": False}
+    
+    content_parts = []
+    meta = {}
+    if response is not None:
         try:
-            content = result["choices"][0]["message"]["content"]
-            
-            # Пытаемся распарсить JSON из ответа
-            json_str = content
-            if "```json" in content:
-                json_str = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                json_str = content.split("```")[1].split("```")[0].strip()
-            
-            parsed_data = json.loads(json_str)
-            
-            # Преобразуем оценки в int, если они есть
-            masterclass_rating = parsed_data.get("masterclass_rating")
-            speaker_rating = parsed_data.get("speaker_rating")
-            
-            if masterclass_rating is not None:
-                try:
-                    masterclass_rating = int(masterclass_rating)
-                    if masterclass_rating < 1 or masterclass_rating > 10:
-                        masterclass_rating = None
-                except (ValueError, TypeError):
-                    masterclass_rating = None
-            
-            if speaker_rating is not None:
-                try:
-                    speaker_rating = int(speaker_rating)
-                    if speaker_rating < 1 or speaker_rating > 10:
-                        speaker_rating = None
-                except (ValueError, TypeError):
-                    speaker_rating = None
-            
-            return FeedbackOCRResult(
-                masterclass_rating=masterclass_rating,
-                speaker_rating=speaker_rating,
-                feedback=parsed_data.get("feedback", ""),
-                raw_response=result
-            )
-            
-        except (json.JSONDecodeError, KeyError, IndexError) as e:
-            print(f"Error parsing feedback OCR response: {e}")
-            return FeedbackOCRResult(raw_response=result)
+            if response.status_code != 200:
+                stream_error = (await response.aread()).decode("utf-8", errors="replace")
+                print(f"OpenRouter API error: {response.status_code} - {stream_error}")
+            else:
+                stream_error = None
+                parser = JSONFieldStream()
+                async for line in response.aiter_lines():
+                    # SSE: полезные строки начинаются с "data: ", остальное - комментарии/keep-alive
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    
+                    for key in ("id", "model", "usage"):
+                        if chunk.get(key):
+                            meta[key] = chunk[key]
+                    choices = chunk.get("choices") or []
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if not delta:
+                        continue
+                    
+                    content_parts.append(delta)
+                    for name, value in parser.feed(delta):
+                        yield "field", {"name": name, "value": _stream_field_value(kind, name, value)}
+        finally:
+            await response.aclose()
+    
+    routing = {"models": [model], "escalated_fields": []}
+    if stream_error is not None:
+        model_router.record(model, started, None, stream_error)
+        raw_response = {"error": stream_error}
+        parsed_data = None
+    else:
+        content = "".join(content_parts)
+        raw_response = {**meta, "choices": [{"message": {"role": "assistant", "content": content}}]}
+        model_router.record(model, started, raw_response, None)
+        try:
+            parsed_data = extract_json_object(content)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing streamed OCR response: {e}")
+            parsed_data = None
+    
+    if parsed_data is None:
+        # Быстрая модель недоступна или не справилась - распознаём страницу остальной цепочкой
+        (parsed_data, escalated_raw, _), routing = await model_router.run(
+            kind, _model_call(kind, images), start_index=1
+        )
+        raw_response = escalated_raw or raw_response
+        if parsed_data is not None:
+            for name, value in parsed_data.items():
+                yield "field", {"name": name, "value": _stream_field_value(kind, name, value)}
+    else:
+        # Поля, не прошедшие проверку, перераспознаём сильной моделью и досылаем исправления
+        before = dict(parsed_data)
+        parsed_data, raw_response = await model_router.escalate(
+            kind, parsed_data, raw_response, _model_call(kind, images), 1, routing
+        )
+        for name in routing["escalated_fields"]:
+            if parsed_data.get(name) != before.get(name):
+                yield "field", {"name": name, "value": _stream_field_value(kind, name, parsed_data.get(name))}
+    
+    raw_response = {**(raw_response or {}), "routing": routing}
+    if parsed_data is not None:
+        result = build_result(parsed_data, raw_response, preprocess_stats)
+        await ocr_cache.set(cache_key, result.model_dump(exclude={"from_cache", "preprocess"}))
+    else:
+        result = result_model(raw_response=raw_response, preprocess=preprocess_stats)
+    
+    yield "done", to_payload(result)
 
+
+def ocr_result_payload(ocr_result: OCRResult) -> dict:
+    """Представление результата OCR первой страницы для ответа API"""
+    return {
+        "data": {
+            "fio": ocr_result.fio,
+            "school": ocr_result.school,
+            "class": ocr_result.student_class,
+            "phone": ocr_result.phone,
+            "parent_name": ocr_result.parent_name,
+            "parent_phone": ocr_result.parent_phone
+        },
+        "ocr_raw": ocr_result.raw_response,
+        "from_cache": ocr_result.from_cache,
+        "preprocess": ocr_result.preprocess
+    }
+
+
+def feedback_result_payload(feedback_result: FeedbackOCRResult) -> dict:
+    """Представление результата OCR обратной связи для ответа API"""
+    return {
+        "data": {
+            "masterclass_rating": feedback_result.masterclass_rating,
+            "speaker_rating": feedback_result.speaker_rating,
+            "feedback": feedback_result.feedback
+        },
+        "ocr_raw": feedback_result.raw_response,
+        "from_cache": feedback_result.from_cache,
+        "preprocess": feedback_result.preprocess
+    }
@@ -0,0 +1,113 @@
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+
+settings = get_settings()
+
+
+class OCRCache:
+    """
+    Кэш результатов OCR по содержимому изображения.
+
+    Два уровня:
+    - LRU в памяти процесса (ограничен по количеству записей и TTL)
+    - коллекция ocr_cache в MongoDB (общая для всех воркеров uvicorn, TTL-индекс)
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(image_data: bytes, kind: str, model: str, prompt: str, image_hash: Optional[str] = None) -> str:
+        """
+        Ключ кэша: SHA-256 изображения + тип страницы + версия модели и промпта.
+        Смена промпта или модели автоматически инвалидирует старые записи.
+        image_hash - уже посчитанный SHA-256 изображения (например, при приёме загрузки).
+        """
+        image_hash = image_hash or hashlib.sha256(image_data).hexdigest()
+        version_hash = hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()[:16]
+        return f"{kind}:{image_hash}:{version_hash}"
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def _set_memory(self, key: str, data: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Поиск результата сначала в памяти, затем в MongoDB"""
+        if not settings.ocr_cache_enabled:
+            return None
+
+        data = self._get_memory(key)
+        if data is not None:
+            self.stats["memory_hits"] += 1
+            return data
+
+        database = get_database()
+        if database is not None:
+            try:
+                doc = await database.ocr_cache.find_one(
+                    {"_id": key, "expires_at": {"$gt": datetime.utcnow()}}
+                )
+            except Exception as e:
+                print(f"OCR cache lookup error: {e}")
+                doc = None
+
+            if doc:
+                self._set_memory(key, doc["data"])
+                self.stats["mongo_hits"] += 1
+                return doc["data"]
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, data: Dict[str, Any]):
+        """Сохранение результата в оба уровня кэша"""
+        if not settings.ocr_cache_enabled:
+            return
+
+        self._set_memory(key, data)
+
+        database = get_database()
+        if database is None:
+            return
+
+        now = datetime.utcnow()
+        try:
+            await database.ocr_cache.replace_one(
+                {"_id": key},
+                {
+                    "data": data,
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                },
+                upsert=True
+            )
+        except Exception as e:
+            # Кэш не должен ломать распознавание
+            print(f"OCR cache store error: {e}")
+
+
+ocr_cache = OCRCache(
+    max_entries=settings.ocr_cache_max_entries,
+    ttl_seconds=settings.ocr_cache_ttl_seconds
+)
@@ -0,0 +1,275 @@
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+from bson import ObjectId
+from pymongo import ReturnDocument
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+from backend.services.storage import storage_key
+from backend.services.duplicates import recognize_stored_page
+
+settings = get_settings()
+
+JOB_KINDS = ("student", "feedback")
+FINAL_STATUSES = ("done", "failed")
+
+# Как часто свободный воркер сам заглядывает в коллекцию: задачи, поставленные
+# другим процессом, и задачи с истёкшей арендой (воркер упал или перезапущен)
+JOB_POLL_SECONDS = 5.0
+
+
+class OCRJobManager:
+    """
+    Фоновые задачи распознавания.
+
+    Очередь - сама коллекция ocr_jobs: воркер атомарно забирает самую старую
+    задачу в статусе queued (find_one_and_update) и берёт её в аренду на
+    ocr_job_lease_seconds, продлевая аренду, пока распознавание идёт. Событие
+    в памяти процесса только будит воркеры после submit; задачи других
+    воркеров uvicorn и задачи, брошенные при перезапуске (аренда истекла),
+    подхватываются опросом коллекции. Задача, прерванная ocr_job_max_attempts
+    раз, помечается failed, а не запускается снова.
+
+    Подписчики в этом процессе узнают об изменениях сразу,
+    подписчики из других воркеров uvicorn - опросом MongoDB.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._updates: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self._last_recovery = 0.0
+
+    @staticmethod
+    def _collection():
+        return get_database().ocr_jobs
+
+    @property
+    def _lease(self) -> timedelta:
+        return timedelta(seconds=settings.ocr_job_lease_seconds)
+
+    async def start(self):
+        """Запуск пула воркеров (вызывается в lifespan)"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        try:
+            await self._recover()
+        except Exception as e:
+            print(f"OCR job recovery failed: {e}")
+        for i in range(settings.ocr_job_workers):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        print(f"✅ OCR job workers started: {settings.ocr_job_workers}")
+
+    async def stop(self):
+        """Остановка пула воркеров (прерванные задачи подхватятся по истечении аренды)"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print("OCR job workers stopped")
+
+    async def submit(
+        self,
+        kind: str,
+        image_path: str,
+        filename: str,
+        application_type: Optional[str] = None,
+        check_duplicates: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Создание задачи и постановка в очередь.
+        Бросает asyncio.QueueFull, если в очереди уже ocr_job_queue_size задач.
+        """
+        if not self._workers:
+            await self.start()
+        queued = await self._collection().count_documents(
+            {"status": "queued"}, limit=settings.ocr_job_queue_size
+        )
+        if queued >= settings.ocr_job_queue_size:
+            raise asyncio.QueueFull()
+
+        now = datetime.utcnow()
+        job = {
+            "_id": str(ObjectId()),
+            "kind": kind,
+            "status": "queued",
+            "image_path": image_path,
+            "filename": filename,
+            "application_type": application_type,
+            "check_duplicates": check_duplicates,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self._collection().insert_one(job)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Получение задачи по ID"""
+        return await self._collection().find_one({"_id": job_id})
+
+    async def wait_for_update(self, job_id: str, timeout: float) -> bool:
+        """
+        Ожидание изменения задачи в этом процессе.
+        Возвращает False по таймауту.
+        """
+        event = self._updates.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # Последний ожидающий убирает событие: иначе оно остаётся навсегда,
+            # если задача меняется в другом процессе или подписчик ушёл
+            left = self._waiters.pop(job_id) - 1
+            if left > 0:
+                self._waiters[job_id] = left
+            elif self._updates.get(job_id) is event:
+                del self._updates[job_id]
+
+    def _notify(self, job_id: str):
+        # Будим всех ожидающих; следующее ожидание создаст новое событие
+        event = self._updates.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _update(self, job_id: str, **fields):
+        """Запись результата задачи, которую держит этот процесс"""
+        fields["updated_at"] = datetime.utcnow()
+        update: Dict[str, Any] = {"$set": fields}
+        if fields.get("status") in FINAL_STATUSES:
+            update["$unset"] = {"lease_until": "", "worker": ""}
+        await self._collection().update_one({"_id": job_id, "worker": self.owner}, update)
+        self._notify(job_id)
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Самая старая задача в очереди или с истёкшей арендой - в аренду этому процессу"""
+        now = datetime.utcnow()
+        job = await self._collection().find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_until": {"$lt": now}}
+                ],
+                "attempts": {"$lt": settings.ocr_job_max_attempts}
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": self.owner,
+                    "lease_until": now + self._lease,
+                    "started_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            if job["attempts"] > 1:
+                print(f"🔁 OCR job {job['_id']} resumed after an interrupted run (attempt {job['attempts']})")
+            self._notify(job["_id"])
+        return job
+
+    async def _recover(self):
+        """
+        Задачи, которые прерывались уже ocr_job_max_attempts раз, - в failed:
+        _claim их больше не возьмёт, а без этого они остались бы running навсегда
+        """
+        self._last_recovery = time.monotonic()
+        now = datetime.utcnow()
+        result = await self._collection().update_many(
+            {
+                "status": {"$in": ["queued", "running"]},
+                "attempts": {"$gte": settings.ocr_job_max_attempts},
+                "lease_until": {"$lt": now}
+            },
+            {
+                "$set": {
+                    "status": "failed",
+                    "error": "Распознавание прервано перезапуском сервера, загрузите фото ещё раз",
+                    "updated_at": now
+                },
+                "$unset": {"lease_until": "", "worker": ""}
+            }
+        )
+        if result.modified_count:
+            print(f"⚠️  {result.modified_count} interrupted OCR jobs marked as failed")
+
+    async def _heartbeat(self, job_id: str):
+        """Продление аренды, пока задача выполняется"""
+        while True:
+            await asyncio.sleep(settings.ocr_job_lease_seconds / 3)
+            try:
+                await self._collection().update_one(
+                    {"_id": job_id, "status": "running", "worker": self.owner},
+                    {"$set": {"lease_until": datetime.utcnow() + self._lease}}
+                )
+            except Exception as e:
+                print(f"OCR job {job_id} lease renewal failed: {e}")
+
+    async def _run(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        payload = await recognize_stored_page(
+            job["kind"],
+            storage_key(job["image_path"]),
+            job["filename"],
+            check_duplicates=job.get("check_duplicates", True)
+        )
+        return {"image_path": job["image_path"], **payload}
+
+    async def _next(self) -> Dict[str, Any]:
+        """Ожидание задачи: по сигналу submit в этом процессе или опросом коллекции"""
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"OCR job claim failed: {e}")
+                job = None
+            if job is not None:
+                # Возможно, в очереди есть ещё задачи - будим следующий воркер
+                self._wakeup.set()
+                return job
+            if time.monotonic() - self._last_recovery >= settings.ocr_job_lease_seconds:
+                try:
+                    await self._recover()
+                except Exception as e:
+                    print(f"OCR job recovery failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._next()
+            job_id = job["_id"]
+            heartbeat = asyncio.create_task(self._heartbeat(job_id))
+            try:
+                result = await self._run(job)
+                await self._update(job_id, status="done", result=result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"OCR job {job_id} failed: {e}")
+                try:
+                    await self._update(job_id, status="failed", error=str(e))
+                except Exception as update_error:
+                    print(f"Failed to mark OCR job {job_id} as failed: {update_error}")
+            finally:
+                heartbeat.cancel()
+
+
+job_manager = OCRJobManager()
@@ -0,0 +1,292 @@
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, Dict, Any, List, Tuple
+from backend.config import get_settings
+from backend.services.ocr_scheduler import OCRServiceUnavailable
+
+settings = get_settings()
+
+# Сколько последних замеров задержки хранить на модель
+LATENCY_WINDOW = 200
+# Класс: номер 1-11 и необязательная буква, например "5", "5А", "11 Б"
+CLASS_PATTERN = re.compile(r"^(?:[1-9]|1[01])\s*-?\s*[А-ЯЁA-Z]?$", re.IGNORECASE)
+
+# Результат одного вызова модели: (распарсенные данные, сырой ответ, ошибка)
+CallResult = Tuple[Optional[dict], Optional[dict], Optional[str]]
+
+
+def _phone_is_valid(phone: Optional[str]) -> bool:
+    digits = re.sub(r"\D", "", phone or "")
+    return len(digits) == 10 or (len(digits) == 11 and digits[0] in "78")
+
+
+def _rating_is_valid(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    try:
+        return 1 <= int(value) <= 10
+    except (ValueError, TypeError):
+        return False
+
+
+def validate_student(data: dict) -> List[str]:
+    """Поля первой страницы, не прошедшие проверку"""
+    failing = []
+    if not (data.get("fio") or "").strip():
+        failing.append("fio")
+    if not CLASS_PATTERN.match((data.get("class") or "").strip()):
+        failing.append("class")
+    if not _phone_is_valid(data.get("phone")):
+        failing.append("phone")
+    parent_phone = data.get("parent_phone")
+    if parent_phone and not _phone_is_valid(parent_phone):
+        failing.append("parent_phone")
+    return failing
+
+
+def validate_feedback(data: dict) -> List[str]:
+    """Поля обратной связи, не прошедшие проверку"""
+    failing = []
+    for name in ("masterclass_rating", "speaker_rating"):
+        value = data.get(name)
+        if value is not None and not _rating_is_valid(value):
+            failing.append(name)
+    # Пустая страница целиком - вероятно, слабая модель её не прочитала
+    if data.get("masterclass_rating") is None and data.get("speaker_rating") is None and not data.get("feedback"):
+        failing += ["masterclass_rating", "speaker_rating", "feedback"]
+    return failing
+
+
+def validate_combined(data: dict) -> List[str]:
+    """Поля обеих страниц (в виде "student.phone"), не прошедшие проверку"""
+    failing = [f"student.{name}" for name in validate_student(data.get("student") or {})]
+    failing += [f"feedback.{name}" for name in validate_feedback(data.get("feedback") or {})]
+    pages = data.get("pages") or {}
+    if pages.get("student") is None or pages.get("feedback") is None:
+        failing.append("pages")
+    return failing
+
+
+VALIDATORS: Dict[str, Callable[[dict], List[str]]] = {
+    "student": validate_student,
+    "feedback": validate_feedback,
+    "combined": validate_combined
+}
+
+
+def _get_path(data: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def _set_path(data: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+class ModelRouter:
+    """
+    Маршрутизация OCR по цепочке моделей от дешёвой к сильной.
+
+    - сначала работает первая (быстрая и дешёвая) модель
+    - если она не ответила за hedge_after секунд, параллельно запускается
+      следующая модель; берётся первый успешный ответ
+    - результат проверяется валидаторами; только не прошедшие проверку поля
+      перераспознаются следующей моделью цепочки
+    """
+
+    def __init__(self, models: List[str], hedge_after: float):
+        self.models = models
+        self.hedge_after = hedge_after
+        self._latencies: Dict[str, deque] = {}
+        self.model_stats: Dict[str, Dict[str, int]] = {}
+        self.stats = {
+            "requests": 0,
+            "escalations": 0,
+            "escalated_fields": 0,
+            "hedges": 0,
+            "hedge_wins": 0
+        }
+
+    def record(self, model: str, started: float, raw: Optional[dict], error: Optional[str]):
+        stats = self.model_stats.setdefault(
+            model, {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        )
+        stats["calls"] += 1
+        if error is not None:
+            stats["errors"] += 1
+        usage = (raw or {}).get("usage") or {}
+        stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        stats["completion_tokens"] += usage.get("completion_tokens") or 0
+        self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(time.monotonic() - started)
+
+    async def _timed_call(self, call: Callable[[str], Awaitable[CallResult]], model: str) -> CallResult:
+        started = time.monotonic()
+        try:
+            parsed, raw, error = await call(model)
+        except asyncio.CancelledError:
+            # Проигравший страховочный запрос отменён - в метрики не попадает
+            raise
+        except Exception as e:
+            self.record(model, started, None, str(e))
+            raise
+        self.record(model, started, raw, error)
+        return parsed, raw, error
+
+    async def _hedged(self, call: Callable[[str], Awaitable[CallResult]], index: int) -> Tuple[CallResult, int]:
+        """Вызов модели index со страховочным запросом к следующей по истечении бюджета"""
+        primary = asyncio.create_task(self._timed_call(call, self.models[index]))
+        if index + 1 >= len(self.models) or self.hedge_after <= 0:
+            return await primary, index
+
+        backup: Optional[asyncio.Task] = None
+        fallback: Optional[Tuple[CallResult, int]] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+            if done:
+                return primary.result(), index
+
+            self.stats["hedges"] += 1
+            backup = asyncio.create_task(self._timed_call(call, self.models[index + 1]))
+            tasks = {primary: index, backup: index + 1}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    result = task.result()
+                    if result[2] is None:
+                        if task is backup:
+                            self.stats["hedge_wins"] += 1
+                        return result, tasks[task]
+                    fallback = fallback or (result, tasks[task])
+        finally:
+            # asyncio.wait не отменяет ожидаемые задачи: при победе одной модели
+            # или отмене самого вызова незавершённые запросы отменяем явно, иначе
+            # они продолжают занимать слот планировщика и соединение
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+
+        if fallback is not None:
+            return fallback
+        # Обе модели недоступны - дальше по цепочке идёт модель после страховочной
+        backup_error = backup.exception()
+        if isinstance(primary.exception(), OCRServiceUnavailable) and isinstance(backup_error, OCRServiceUnavailable):
+            return (None, None, str(backup_error)), index + 1
+        # Иное исключение - пробрасываем исключение основной
+        return primary.result(), index
+
+    async def run(
+        self,
+        kind: str,
+        call: Callable[[str], Awaitable[CallResult]],
+        start_index: int = 0
+    ) -> Tuple[CallResult, dict]:
+        """
+        Распознавание по цепочке моделей, начиная с модели start_index.
+        call(model) выполняет запрос к указанной модели и возвращает CallResult.
+
+        Returns:
+            (CallResult, routing) - routing описывает использованные модели и эскалации
+        """
+        routing = {"models": [], "escalated_fields": []}
+        if start_index >= len(self.models):
+            return (None, None, "Нет моделей для распознавания"), routing
+        if start_index == 0:
+            self.stats["requests"] += 1
+
+        try:
+            (parsed, raw, error), index = await self._hedged(call, start_index)
+        except OCRServiceUnavailable as e:
+            # Первая модель недоступна - как и при неразобранном ответе, идём дальше по цепочке
+            (parsed, raw, error), index = (None, None, str(e)), start_index
+        routing["models"].append(self.models[index])
+
+        # Ответ не получен или не разобран - вся страница уходит следующей модели
+        while parsed is None and index + 1 < len(self.models):
+            index += 1
+            self.stats["escalations"] += 1
+            routing["models"].append(self.models[index])
+            routing["escalated_fields"] = ["*"]
+            try:
+                parsed, raw, error = await self._timed_call(call, self.models[index])
+            except OCRServiceUnavailable as e:
+                error = str(e)
+        if parsed is None:
+            return (None, raw, error), routing
+
+        parsed, raw = await self.escalate(kind, parsed, raw, call, index + 1, routing)
+        return (parsed, raw, None), routing
+
+    async def escalate(
+        self,
+        kind: str,
+        parsed: dict,
+        raw: Optional[dict],
+        call: Callable[[str], Awaitable[CallResult]],
+        start_index: int,
+        routing: dict
+    ) -> Tuple[dict, Optional[dict]]:
+        """Перераспознавание не прошедших проверку полей более сильными моделями"""
+        validate = VALIDATORS[kind]
+        failing = validate(parsed)
+        for model in self.models[start_index:]:
+            if not failing:
+                break
+            self.stats["escalations"] += 1
+            self.stats["escalated_fields"] += len(failing)
+            routing["models"].append(model)
+            routing["escalated_fields"] += [name for name in failing if name not in routing["escalated_fields"]]
+
+            try:
+                stronger, stronger_raw, error = await self._timed_call(call, model)
+            except OCRServiceUnavailable as e:
+                # Сильная модель недоступна - оставляем результат предыдущей
+                print(f"OCR escalation to {model} failed: {e}")
+                continue
+            if error is not None or stronger is None:
+                continue
+
+            # Берём у сильной модели только проблемные поля, остальное оставляем
+            for path in failing:
+                value = _get_path(stronger, path)
+                if value is not None:
+                    _set_path(parsed, path, value)
+            raw = stronger_raw
+            failing = validate(parsed)
+        return parsed, raw
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Метрики маршрутизации: задержки и токены по моделям, доля эскалаций"""
+        models = {}
+        for model, stats in self.model_stats.items():
+            latencies = sorted(self._latencies.get(model) or [])
+            latency = {}
+            if latencies:
+                latency = {
+                    "avg_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+                    "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+                }
+            models[model] = {**stats, "latency": latency}
+        requests = self.stats["requests"]
+        return {
+            **self.stats,
+            "escalation_rate": round(self.stats["escalations"] / requests, 3) if requests else 0.0,
+            "chain": self.models,
+            "models": models
+        }
+
+
+model_router = ModelRouter(
+    models=[model.strip() for model in settings.ocr_model_chain.split(",") if model.strip()],
+    hedge_after=settings.ocr_hedge_after_seconds
+)
@@ -0,0 +1,195 @@
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Dict, Any
+import httpx
+from backend.config import get_settings
+
+settings = get_settings()
+
+# Статусы OpenRouter, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+# Сколько последних ожиданий в очереди хранить для перцентилей
+QUEUE_WAIT_WINDOW = 500
+
+
+class OCRServiceUnavailable(Exception):
+    """OpenRouter не ответил успешно после всех повторов (лимиты, 5xx, сеть)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate запросов в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _parse_retry_after(response: httpx.Response) -> Optional[float]:
+    """Retry-After в секундах (поддерживаются оба формата: число и HTTP-дата)"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class OCRScheduler:
+    """
+    Планировщик допуска запросов к OpenRouter.
+
+    - не больше max_concurrency запросов одновременно (остальные ждут в очереди)
+    - не чаще rate запросов в секунду (token bucket)
+    - 429/5xx/сетевые ошибки повторяются с экспоненциальной задержкой и джиттером;
+      Retry-After от провайдера приостанавливает все запросы процесса
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        rate: float,
+        burst: int,
+        max_retries: int,
+        base_delay: float,
+        max_delay: float
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate, burst)
+        self._paused_until = 0.0
+        self._queue_waits = deque(maxlen=QUEUE_WAIT_WINDOW)
+        self.max_concurrency = max_concurrency
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "waiting": 0,
+            "in_flight": 0
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: случайная задержка в [0, base * 2^attempt]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _wait_for_pause(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def run(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """
+        Выполнение запроса с допуском и повторами.
+        send вызывается заново на каждой попытке. Для потоковых ответов
+        слот параллельности освобождается после получения заголовков.
+        Бросает OCRServiceUnavailable, если повторы исчерпаны.
+        """
+        enqueued = time.monotonic()
+        self.stats["waiting"] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+        self._queue_waits.append(time.monotonic() - enqueued)
+
+        self.stats["in_flight"] += 1
+        try:
+            attempt = 0
+            while True:
+                await self._wait_for_pause()
+                await self._bucket.acquire()
+                self.stats["requests"] += 1
+
+                retry_after = None
+                try:
+                    response = await send()
+                except httpx.TransportError as e:
+                    error = f"{type(e).__name__}: {e}"
+                    status_code = None
+                else:
+                    if response.status_code not in RETRYABLE_STATUSES:
+                        return response
+                    # Для потоковых ответов тело ещё не прочитано
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    await response.aclose()
+                    error = f"{response.status_code} - {body[:500]}"
+                    status_code = response.status_code
+                    retry_after = _parse_retry_after(response)
+                    if response.status_code == 429:
+                        self.stats["rate_limited"] += 1
+
+                if attempt >= self.max_retries:
+                    self.stats["failures"] += 1
+                    raise OCRServiceUnavailable(f"OpenRouter unavailable: {error}", status_code)
+
+                if retry_after is not None:
+                    delay = min(retry_after, self.max_delay)
+                    # Лимит общий для ключа - притормаживаем все запросы процесса
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                else:
+                    delay = self._backoff(attempt)
+
+                attempt += 1
+                self.stats["retries"] += 1
+                print(f"OpenRouter retry {attempt}/{self.max_retries} in {delay:.1f}s: {error}")
+                await asyncio.sleep(delay)
+        finally:
+            self.stats["in_flight"] -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущие метрики планировщика (время ожидания в очереди - в мс)"""
+        waits = sorted(self._queue_waits)
+        queue_wait = {"samples": len(waits)}
+        if waits:
+            queue_wait.update({
+                "avg_ms": round(sum(waits) / len(waits) * 1000, 1),
+                "p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1),
+                "max_ms": round(waits[-1] * 1000, 1)
+            })
+        return {
+            **self.stats,
+            "max_concurrency": self.max_concurrency,
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "queue_wait": queue_wait
+        }
+
+
+ocr_scheduler = OCRScheduler(
+    max_concurrency=settings.ocr_max_concurrency,
+    rate=settings.ocr_rate_limit_rps,
+    burst=settings.ocr_rate_limit_burst,
+    max_retries=settings.ocr_max_retries,
+    base_delay=settings.ocr_retry_base_delay,
+    max_delay=settings.ocr_retry_max_delay
+)
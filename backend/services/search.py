@@ -0,0 +1,164 @@
+import re
+from typing import Any, Dict, List, Optional
+from backend.database.mongodb import get_database
+
+# Длина n-граммы для поиска подстроки (слово короче ищется только по префиксу)
+TRIGRAM = 3
+# Цифры запроса от этой длины - кусок телефона (с 7 или 8 в начале ищется и без кода страны)
+PHONE_PREFIX_MIN = 5
+# Поля заявки, из которых строятся ключи поиска
+SEARCH_SOURCE_FIELDS = ("fio", "school", "phone", "parent_phone")
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+
+
+def normalize_text(value: Any) -> str:
+    """Нормализованный текст для поиска: нижний регистр, ё -> е, только буквы и цифры через пробел"""
+    if not value:
+        return ""
+    text = str(value).lower().replace("ё", "е")
+    return " ".join(_WORD_RE.findall(text))
+
+
+def phone_digits(value: Any) -> str:
+    """Цифры телефона без кода страны: +7 999 ... и 8 999 ... дают один ключ"""
+    digits = re.sub(r"\D", "", str(value or ""))
+    if len(digits) == 11 and digits[0] in "78":
+        digits = digits[1:]
+    return digits
+
+
+def trigrams(word: str) -> List[str]:
+    return [word[i:i + TRIGRAM] for i in range(len(word) - TRIGRAM + 1)]
+
+
+def search_fields(student: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ключи поиска заявки (поле search), пишутся вместе с заявкой:
+    - fio, school - нормализованный текст (текстовый индекс с русской морфологией)
+    - text - всё вместе одной строкой (точная проверка подстроки)
+    - tokens - слова и цифры телефонов (поиск по префиксу)
+    - trigrams - триграммы слов (поиск подстроки: «ванов» найдёт «Иванов»)
+    """
+    fio = normalize_text(student.get("fio"))
+    school = normalize_text(student.get("school"))
+    phones = [digits for digits in (phone_digits(student.get(field)) for field in ("phone", "parent_phone")) if digits]
+    words = fio.split() + school.split() + phones
+    tokens = sorted(set(words))
+    return {
+        "search": {
+            "fio": fio,
+            "school": school,
+            "text": " ".join(words),
+            "tokens": tokens,
+            "trigrams": sorted({gram for token in tokens for gram in trigrams(token)})
+        }
+    }
+
+
+def _phone_variants(digits: str) -> List[str]:
+    if len(digits) >= PHONE_PREFIX_MIN and digits[0] in "78":
+        return [digits, digits[1:]]
+    return [digits]
+
+
+def _query_words(query: str) -> List[List[str]]:
+    """
+    Слова запроса, у каждого - варианты написания. Группы цифр подряд
+    («+7 916 123») - один кусок телефона: его ищем и с кодом страны, и без.
+    Короткие группы («лицей 57 10») остаются отдельными словами.
+    """
+    words: List[List[str]] = []
+    groups: List[str] = []
+    for word in normalize_text(query).split() + [""]:
+        if word.isdigit():
+            groups.append(word)
+            continue
+        if groups:
+            joined = "".join(groups)
+            if len(groups) > 1 and len(joined) < PHONE_PREFIX_MIN:
+                words.extend([group] for group in groups)
+            else:
+                words.append(_phone_variants(joined))
+            groups = []
+        if word:
+            words.append([word])
+    return words
+
+
+def _word_condition(word: str) -> Dict[str, Any]:
+    prefix = {"search.tokens": {"$regex": f"^{re.escape(word)}"}}
+    if len(word) < TRIGRAM:
+        return prefix
+    substring = {
+        "search.trigrams": {"$all": trigrams(word)},
+        "search.text": {"$regex": re.escape(word)}
+    }
+    return {"$or": [prefix, substring]}
+
+
+def search_filter(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Фильтр MongoDB для строки поиска (None - искать нечего).
+    Каждое слово запроса должно найтись в заявке: как начало слова
+    (индекс search.tokens, регулярное выражение с ^ по нормализованным
+    ключам идёт по индексу) или как подстрока (индекс search.trigrams,
+    затем точная проверка по search.text только у найденных кандидатов).
+    """
+    conditions = []
+    for variants in _query_words(query):
+        branches = [_word_condition(word) for word in variants]
+        conditions.append(branches[0] if len(branches) == 1 else {"$or": branches})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class StudentSearch:
+    """
+    Поиск заявок по ФИО, школе и телефону.
+
+    Ключи поиска (search_fields) считаются при записи заявки, поэтому запрос
+    идёт по индексам, а не сканированием коллекции регулярным выражением:
+    - search_filter - фильтр списка заявок и экспорта (префикс/подстрока);
+      индексы объявлены в backend/database/migrations.py;
+    - ranked - лучшие совпадения по текстовому индексу с русской морфологией
+      («Иванова» найдёт «Иванов»), дополненные совпадениями по префиксу.
+
+    Заявкам, сохранённым до появления ключей, их дописывает миграция схемы
+    (backend/database/migrations.py).
+    """
+
+    @staticmethod
+    def _collection():
+        return get_database().students
+
+    async def ranked(self, query: str, limit: int, base_query: Optional[dict] = None) -> List[Dict[str, Any]]:
+        """
+        Лучшие совпадения для строки поиска: сначала по текстовому индексу
+        (score), затем по префиксу/подстроке (новые сверху), без повторов.
+        """
+        text = normalize_text(query)
+        if not text:
+            return []
+        base_query = base_query or {}
+        collection = self._collection()
+
+        results = await collection.find(
+            {**base_query, "$text": {"$search": text}},
+            {"score": {"$meta": "textScore"}, "ocr_raw": 0}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit).to_list(length=limit)
+
+        if len(results) < limit:
+            seen = [student["_id"] for student in results]
+            conditions = [search_filter(query), {"_id": {"$nin": seen}}]
+            if base_query:
+                conditions.append(base_query)
+            more = await collection.find({"$and": conditions}, {"ocr_raw": 0}).sort(
+                [("created_at", -1), ("_id", -1)]
+            ).limit(limit - len(results)).to_list(length=limit - len(results))
+            results.extend(more)
+        return results
+
+
+student_search = StudentSearch()
@@ -0,0 +1,375 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, NamedTuple, Optional
+from urllib.parse import quote
+import aiofiles
+import httpx
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+
+settings = get_settings()
+
+# Размер куска при чтении и записи объектов
+STORAGE_CHUNK = 256 * 1024
+# Префикс URL, по которому изображения отдаются клиенту (см. routes/files.py)
+IMAGE_URL_PREFIX = "uploads"
+
+# Архивные копии могут быть в AVIF - mimetypes его знает не во всех версиях Python
+mimetypes.add_type("image/avif", ".avif")
+
+
+class StoredObject(NamedTuple):
+    """Метаданные сохранённого объекта"""
+    key: str
+    size: int
+    content_type: str
+    etag: str
+    last_modified: datetime
+
+
+def image_path(key: str) -> str:
+    """Путь изображения, который хранится в заявке и используется клиентом как URL"""
+    return f"{IMAGE_URL_PREFIX}/{key}"
+
+
+def storage_key(path: str) -> str:
+    """Ключ объекта по пути изображения (в том числе старому локальному uploads/<имя>)"""
+    return os.path.basename(path)
+
+
+def _guess_type(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+class Storage:
+    """
+    Хранилище изображений.
+
+    Все операции асинхронные и потоковые: запись принимает асинхронный
+    итератор кусков, чтение отдаёт куски (в том числе диапазон байт),
+    файл целиком в памяти не собирается.
+    """
+
+    name = "base"
+
+    async def put(self, key: str, chunks: AsyncIterator[bytes], size: int, content_type: str) -> None:
+        """Запись объекта; size - точный размер (нужен S3 для Content-Length)"""
+        raise NotImplementedError
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        """Метаданные объекта или None, если его нет"""
+        raise NotImplementedError
+
+    def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Чтение объекта кусками, end - последний байт диапазона включительно"""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        """Удаление объекта (отсутствующий объект - не ошибка)"""
+        raise NotImplementedError
+
+    async def rename(self, key: str, new_key: str) -> None:
+        """
+        Перенос объекта под новый ключ. По умолчанию - потоковое копирование
+        и удаление исходного объекта, хранилища с атомарным переносом переопределяют.
+        """
+        stored = await self.stat(key)
+        if stored is None:
+            raise FileNotFoundError(key)
+        await self.put(new_key, self.get(key), stored.size, stored.content_type)
+        await self.delete(key)
+
+    async def read(self, key: str) -> bytes:
+        """Объект целиком - только там, где без этого не обойтись (OCR)"""
+        return b"".join([chunk async for chunk in self.get(key)])
+
+    async def close(self):
+        """Освобождение ресурсов (вызывается в lifespan)"""
+
+
+class LocalStorage(Storage):
+    """Локальный диск (UPLOAD_DIR). Подходит для одного инстанса с постоянным диском"""
+
+    name = "local"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, storage_key(key))
+
+    async def put(self, key: str, chunks: AsyncIterator[bytes], size: int, content_type: str) -> None:
+        path = self._path(key)
+        # Пишем во временный файл: недописанный объект никогда не виден читателям
+        partial = f"{path}.part"
+        try:
+            async with aiofiles.open(partial, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return StoredObject(
+            key=key,
+            size=stat.st_size,
+            content_type=_guess_type(key),
+            etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            last_modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        )
+
+    async def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        async with aiofiles.open(self._path(key), "rb") as f:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await f.read(STORAGE_CHUNK if remaining is None else min(STORAGE_CHUNK, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def rename(self, key: str, new_key: str) -> None:
+        os.replace(self._path(key), self._path(new_key))
+
+
+class GridFSStorage(Storage):
+    """MongoDB GridFS: общее хранилище для всех инстансов без отдельного сервиса"""
+
+    name = "gridfs"
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    def _get_bucket(self):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        if self._bucket is None:
+            database = get_database()
+            if database is None:
+                raise RuntimeError("MongoDB не подключена")
+            self._bucket = AsyncIOMotorGridFSBucket(database, bucket_name=self.bucket_name)
+        return self._bucket
+
+    async def put(self, key: str, chunks: AsyncIterator[bytes], size: int, content_type: str) -> None:
+        grid_in = self._get_bucket().open_upload_stream_with_id(
+            key, key, metadata={"content_type": content_type}
+        )
+        try:
+            async for chunk in chunks:
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        doc = await get_database()[f"{self.bucket_name}.files"].find_one({"_id": key})
+        if not doc:
+            return None
+        upload_date = doc["uploadDate"].replace(tzinfo=timezone.utc)
+        return StoredObject(
+            key=key,
+            size=doc["length"],
+            content_type=(doc.get("metadata") or {}).get("content_type") or _guess_type(key),
+            etag=f"{int(upload_date.timestamp() * 1000):x}-{doc['length']:x}",
+            last_modified=upload_date
+        )
+
+    async def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        grid_out = await self._get_bucket().open_download_stream(key)
+        try:
+            if start:
+                grid_out.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await grid_out.read(STORAGE_CHUNK if remaining is None else min(STORAGE_CHUNK, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            grid_out.close()
+
+    async def delete(self, key: str) -> None:
+        from gridfs.errors import NoFile
+
+        try:
+            await self._get_bucket().delete(key)
+        except NoFile:
+            pass
+
+
+class S3Storage(Storage):
+    """
+    S3-совместимое хранилище (AWS S3, MinIO, Yandex Object Storage).
+    Запросы подписываются AWS Signature V4, адресация path-style
+    (endpoint/bucket/key) - работает и с локальным MinIO.
+    """
+
+    name = "s3"
+
+    def __init__(self, endpoint_url: str, bucket: str, access_key: str, secret_key: str, region: str):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            )
+        return self._client
+
+    def _url(self, key: str) -> str:
+        return f"{self.endpoint_url}/{self.bucket}/{quote(key, safe='')}"
+
+    def sign(self, method: str, url: str, headers: dict, now: Optional[datetime] = None) -> dict:
+        """Заголовки AWS Signature V4 (тело не подписывается: UNSIGNED-PAYLOAD)"""
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        parsed = httpx.URL(url)
+
+        headers = {
+            **headers,
+            "host": parsed.netloc.decode("ascii"),
+            "x-amz-date": amz_date,
+            "x-amz-content-sha256": headers.get("x-amz-content-sha256", "UNSIGNED-PAYLOAD")
+        }
+        signed = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+        canonical_headers = "".join(f"{name}:{lowered[name]}\n" for name in signed)
+        signed_headers = ";".join(signed)
+        query = "&".join(
+            f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}"
+            for name, value in sorted(parsed.params.multi_items())
+        )
+        canonical_request = "\n".join([
+            method,
+            parsed.raw_path.split(b"?")[0].decode("ascii"),
+            query,
+            canonical_headers,
+            signed_headers,
+            lowered["x-amz-content-sha256"]
+        ])
+
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+        ])
+        signing_key = f"AWS4{self.secret_key}".encode("utf-8")
+        for part in (date, self.region, "s3", "aws4_request"):
+            signing_key = hmac.new(signing_key, part.encode("utf-8"), hashlib.sha256).digest()
+        signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return headers
+
+    async def put(self, key: str, chunks: AsyncIterator[bytes], size: int, content_type: str) -> None:
+        url = self._url(key)
+        headers = self.sign("PUT", url, {"content-type": content_type, "content-length": str(size)})
+        response = await self._get_client().put(url, headers=headers, content=chunks)
+        if response.status_code >= 300:
+            raise RuntimeError(f"S3 PUT {key} failed: {response.status_code} - {response.text[:300]}")
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        url = self._url(key)
+        response = await self._get_client().head(url, headers=self.sign("HEAD", url, {}))
+        if response.status_code == 404:
+            return None
+        if response.status_code >= 300:
+            raise RuntimeError(f"S3 HEAD {key} failed: {response.status_code}")
+        last_modified = response.headers.get("last-modified")
+        return StoredObject(
+            key=key,
+            size=int(response.headers.get("content-length", 0)),
+            content_type=response.headers.get("content-type") or _guess_type(key),
+            etag=response.headers.get("etag", "").strip('"'),
+            last_modified=parsedate_to_datetime(last_modified) if last_modified else datetime.now(timezone.utc)
+        )
+
+    async def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        url = self._url(key)
+        extra = {}
+        if start or end is not None:
+            extra["range"] = f"bytes={start}-{'' if end is None else end}"
+        client = self._get_client()
+        request = client.build_request("GET", url, headers=self.sign("GET", url, extra))
+        response = await client.send(request, stream=True)
+        try:
+            if response.status_code >= 300:
+                raise RuntimeError(f"S3 GET {key} failed: {response.status_code}")
+            async for chunk in response.aiter_bytes(STORAGE_CHUNK):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def delete(self, key: str) -> None:
+        url = self._url(key)
+        response = await self._get_client().delete(url, headers=self.sign("DELETE", url, {}))
+        if response.status_code >= 300 and response.status_code != 404:
+            raise RuntimeError(f"S3 DELETE {key} failed: {response.status_code}")
+
+    async def rename(self, key: str, new_key: str) -> None:
+        # Копирование на стороне S3 (CopyObject) - данные через приложение не идут
+        url = self._url(new_key)
+        headers = self.sign("PUT", url, {"x-amz-copy-source": f"/{self.bucket}/{quote(key, safe='')}"})
+        response = await self._get_client().put(url, headers=headers)
+        if response.status_code >= 300:
+            raise RuntimeError(f"S3 COPY {key} -> {new_key} failed: {response.status_code} - {response.text[:300]}")
+        await self.delete(key)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_storage() -> Storage:
+    """Хранилище по настройке STORAGE_BACKEND: local, gridfs или s3"""
+    if settings.storage_backend == "gridfs":
+        return GridFSStorage(settings.gridfs_bucket)
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            endpoint_url=settings.s3_endpoint_url,
+            bucket=settings.s3_bucket,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            region=settings.s3_region
+        )
+    return LocalStorage(os.getenv("UPLOAD_DIR", "uploads"))
+
+
+storage = create_storage()
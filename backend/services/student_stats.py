@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from backend.config import get_settings
+from backend.database.mongodb import get_database
+
+settings = get_settings()
+
+# Документ счётчиков в коллекции counters
+COUNTERS_COLLECTION = "counters"
+STUDENTS_COUNTERS_ID = "students"
+# Счётчики: всего заявок, отправлено в AMO, не отправлено
+COUNTER_FIELDS = ("total", "sent_to_amo", "not_sent")
+
+
+def _status_field(sent_to_amo: Any) -> Optional[str]:
+    """Счётчик статуса AMO для значения поля sent_to_amo (у старых заявок поля может не быть)"""
+    if sent_to_amo is True:
+        return "sent_to_amo"
+    if sent_to_amo is False:
+        return "not_sent"
+    return None
+
+
+class StudentStats:
+    """
+    Статистика заявок для админ-панели без подсчёта по коллекции.
+
+    Счётчики лежат в одном документе (counters/students) и меняются через $inc
+    теми же путями, что создают, удаляют заявки и меняют статус AMO, - поэтому
+    /api/admin/stats читает один документ по _id при любом размере коллекции.
+    Чтобы расхождение (упавший между двумя записями запрос, ручная правка базы)
+    не копилось, раз в сутки счётчики сверяются с коллекцией одной агрегацией
+    $facet и перезаписываются. Сверку выполняет один воркер.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.last_reconcile: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _collection():
+        return get_database()[COUNTERS_COLLECTION]
+
+    async def _inc(self, changes: Dict[str, int]):
+        # Без upsert: документа ещё нет - значит, его создаст подсчёт по коллекции (get/start),
+        # а документ из одних приращений показывал бы 1 вместо реального числа
+        changes = {field: value for field, value in changes.items() if field and value}
+        if changes:
+            await self._collection().update_one(
+                {"_id": STUDENTS_COUNTERS_ID},
+                {"$inc": changes, "$set": {"updated_at": datetime.utcnow()}}
+            )
+
+    async def student_created(self, sent_to_amo: bool = False):
+        await self._inc({"total": 1, _status_field(sent_to_amo): 1})
+
+    async def student_deleted(self, sent_to_amo: Any):
+        """sent_to_amo - значение поля удалённой заявки"""
+        await self._inc({"total": -1, _status_field(sent_to_amo): -1})
+
+    async def amo_status_changed(self, before: Any, after: bool):
+        """Смена статуса AMO: before - значение до записи (из find_one_and_update)"""
+        if before is after:
+            return
+        await self._inc({_status_field(before): -1, _status_field(after): 1})
+
+    async def get(self) -> Dict[str, Any]:
+        """Счётчики заявок (если документа ещё нет - считаются по коллекции)"""
+        counters = await self._collection().find_one({"_id": STUDENTS_COUNTERS_ID})
+        if counters is None:
+            counters = await self.reconcile()
+        return {field: counters.get(field, 0) for field in COUNTER_FIELDS}
+
+    async def count(self) -> Dict[str, int]:
+        """Точные значения по коллекции: одна агрегация $facet вместо трёх count_documents"""
+        result = await get_database().students.aggregate([
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "sent_to_amo": [{"$match": {"sent_to_amo": True}}, {"$count": "n"}],
+                "not_sent": [{"$match": {"sent_to_amo": False}}, {"$count": "n"}]
+            }}
+        ]).to_list(length=1)
+        facets = result[0] if result else {}
+        return {field: (facets.get(field) or [{"n": 0}])[0]["n"] for field in COUNTER_FIELDS}
+
+    async def reconcile(self) -> Dict[str, Any]:
+        """Сверка счётчиков с коллекцией: значения перезаписываются, расхождение пишется в лог"""
+        started = datetime.utcnow()
+        actual = await self.count()
+        before = await self._collection().find_one_and_update(
+            {"_id": STUDENTS_COUNTERS_ID},
+            {"$set": {**actual, "updated_at": datetime.utcnow(), "reconciled_at": started}},
+            upsert=True
+        ) or {}
+        drift = {field: actual[field] - before.get(field, 0) for field in COUNTER_FIELDS}
+        self.last_reconcile = {
+            "at": started,
+            "elapsed_ms": round((datetime.utcnow() - started).total_seconds() * 1000, 1),
+            "drift": drift
+        }
+        if before and any(drift.values()):
+            print(f"📊 Student counters reconciled, drift {drift}")
+        return actual
+
+    async def start(self):
+        """Первый подсчёт (если счётчиков ещё нет) и ночная сверка (вызывается в lifespan)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _claim(self, slot: datetime) -> bool:
+        """Сверку за эти сутки выполняет первый воркер, отметивший её в документе"""
+        result = await self._collection().update_one(
+            {
+                "_id": STUDENTS_COUNTERS_ID,
+                "$or": [{"reconcile_slot": {"$exists": False}}, {"reconcile_slot": {"$lt": slot}}]
+            },
+            {"$set": {"reconcile_slot": slot}}
+        )
+        return result.modified_count == 1
+
+    async def _run(self):
+        try:
+            if await self._collection().find_one({"_id": STUDENTS_COUNTERS_ID}, {"_id": 1}) is None:
+                await self.reconcile()
+        except Exception as e:
+            print(f"Student counters init failed: {e}")
+        if settings.stats_reconcile_hour_utc < 0:
+            return
+        while True:
+            now = datetime.utcnow()
+            slot = now.replace(hour=settings.stats_reconcile_hour_utc, minute=0, second=0, microsecond=0)
+            if slot <= now:
+                slot += timedelta(days=1)
+            await asyncio.sleep((slot - now).total_seconds())
+            try:
+                if await self._claim(slot):
+                    await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Student counters reconcile failed: {e}")
+
+    async def snapshot(self) -> dict:
+        counters = await self._collection().find_one({"_id": STUDENTS_COUNTERS_ID}) or {}
+        return {
+            **{field: counters.get(field, 0) for field in COUNTER_FIELDS},
+            "updated_at": counters.get("updated_at"),
+            "reconciled_at": counters.get("reconciled_at"),
+            "last_reconcile": self.last_reconcile
+        }
+
+
+student_stats = StudentStats()
@@ -0,0 +1,87 @@
+import binascii
+import json
+import uuid
+from typing import AsyncIterator, List
+
+# Кусок исходных данных для base64 (кратен 3 - без паддинга посередине)
+ENCODE_CHUNK = 3 * 64 * 1024
+# Кусок, которым тело отдаётся в httpx
+SEND_CHUNK = 64 * 1024
+
+
+class InlineImage:
+    """
+    Изображение внутри JSON тела запроса.
+    При сборке тела превращается в строку data URL, base64 пишется сразу в буфер.
+    """
+
+    __slots__ = ("data", "mime_type")
+
+    def __init__(self, data: bytes, mime_type: str):
+        self.data = data
+        self.mime_type = mime_type
+
+    @property
+    def encoded_size(self) -> int:
+        return len(self.prefix) + 4 * ((len(self.data) + 2) // 3)
+
+    @property
+    def prefix(self) -> bytes:
+        return f"data:{self.mime_type};base64,".encode("ascii")
+
+
+def build_json_body(payload: dict) -> bytearray:
+    """
+    JSON тела запроса с изображениями (InlineImage) без промежуточных строк.
+
+    Структура сериализуется json.dumps с маркерами вместо изображений,
+    затем в заранее выделенный буфер точного размера копируются куски JSON,
+    а base64 каждого изображения кодируется прямо в буфер по частям.
+    В памяти одновременно: исходные байты изображений + итоговое тело.
+    """
+    images: List[InlineImage] = []
+    marker = f"@@inline-image-{uuid.uuid4().hex}@@"
+
+    def collect(value):
+        if isinstance(value, InlineImage):
+            images.append(value)
+            return marker
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    text = json.dumps(payload, ensure_ascii=False, default=collect)
+    parts = [part.encode("utf-8") for part in text.split(f'"{marker}"')]
+
+    size = sum(len(part) for part in parts) + sum(image.encoded_size + 2 for image in images)
+    body = bytearray(size)
+    view = memoryview(body)
+    pos = 0
+
+    def write(chunk: bytes):
+        nonlocal pos
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+
+    for index, part in enumerate(parts):
+        write(part)
+        if index == len(images):
+            break
+        image = images[index]
+        write(b'"')
+        write(image.prefix)
+        source = memoryview(image.data)
+        for start in range(0, len(source), ENCODE_CHUNK):
+            write(binascii.b2a_base64(source[start:start + ENCODE_CHUNK], newline=False))
+        write(b'"')
+
+    view.release()
+    return body
+
+
+async def iter_body(body: bytearray) -> AsyncIterator[bytes]:
+    """Отдача тела кусками: httpx не делает собственную копию всего буфера"""
+    view = memoryview(body)
+    try:
+        for start in range(0, len(view), SEND_CHUNK):
+            yield bytes(view[start:start + SEND_CHUNK])
+    finally:
+        view.release()
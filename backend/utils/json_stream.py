@@ -0,0 +1,150 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class JSONFieldStream:
+    """
+    Инкрементальный разбор JSON объекта, приходящего по частям.
+
+    Текст подаётся кусками через feed(); как только очередное поле верхнего
+    уровня полностью получено, оно возвращается как пара (ключ, значение).
+    Всё до первой "{" (например, markdown ```json) пропускается.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._string_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self.finished = False
+
+    def _emit(self, end: int) -> Optional[Tuple[str, Any]]:
+        if self._key is None or self._value_start is None:
+            return None
+        raw_value = self.buffer[self._value_start:end].strip()
+        key = self._key
+        self._key = None
+        self._value_start = None
+        try:
+            return key, json.loads(raw_value)
+        except json.JSONDecodeError:
+            return None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Добавление куска текста, возвращает завершённые поля"""
+        fields = []
+        self.buffer += chunk
+        while self._pos < len(self.buffer) and not self.finished:
+            char = self.buffer[self._pos]
+
+            if self._depth == 0:
+                # Ищем начало объекта, всё остальное пропускаем
+                if char == "{":
+                    self._depth = 1
+                    self._expect_key = True
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key and self._string_start is not None:
+                        try:
+                            self._key = json.loads(self.buffer[self._string_start:self._pos + 1])
+                        except json.JSONDecodeError:
+                            self._key = None
+                        self._string_start = None
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._string_start = self._pos
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 1:
+                    field = self._emit(self._pos)
+                    if field:
+                        fields.append(field)
+                    self.finished = True
+                self._depth -= 1
+            elif self._depth == 1 and char == ":" and self._expect_key:
+                self._expect_key = False
+                self._value_start = self._pos + 1
+            elif self._depth == 1 and char == ",":
+                field = self._emit(self._pos)
+                if field:
+                    fields.append(field)
+                self._expect_key = True
+
+            self._pos += 1
+        return fields
+
+
+# Висячие запятые перед закрывающей скобкой: {"a": 1,} / [1, 2,]
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def _find_balanced_end(text: str, start: int) -> Optional[int]:
+    """Индекс закрывающей "}" для объекта, начинающегося в start (с учётом строк)"""
+    depth = 0
+    in_string = False
+    escape = False
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return pos
+    return None
+
+
+def extract_json_object(text: str) -> Dict[str, Any]:
+    """
+    Извлечение первого JSON объекта из ответа модели.
+
+    Терпимо к мусору вокруг JSON (пояснения, markdown блоки), висячим запятым
+    и обрезанному по max_tokens ответу - в последнем случае возвращаются
+    поля, которые модель успела закончить.
+    Бросает json.JSONDecodeError, если объект найти не удалось.
+    """
+    start = text.find("{")
+    while start != -1:
+        end = _find_balanced_end(text, start)
+        if end is None:
+            break
+        candidate = text[start:end + 1]
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                parsed = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, dict):
+                return parsed
+        start = text.find("{", start + 1)
+
+    # Сбалансированного объекта нет (ответ обрезан) - берём завершённые поля
+    if start != -1:
+        parser = JSONFieldStream()
+        fields = dict(parser.feed(text[start:]))
+        if fields:
+            return fields
+
+    raise json.JSONDecodeError("No JSON object found", text, 0)
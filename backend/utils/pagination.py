@@ -0,0 +1,123 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+
+# Порядок списка заявок: новые сверху, _id разрешает одинаковое время создания
+SORT_FIELD = "created_at"
+KEYSET_SORT = [(SORT_FIELD, -1), ("_id", -1)]
+
+
+# Типы created_at в порядке сортировки по убыванию (в BSON дата > строка > null).
+# У заявок старых версий время могло сохраниться строкой или не сохраниться вовсе:
+# такие заявки идут в конце списка, и курсор должен уметь пройти и через них
+CURSOR_KINDS = ("date", "string", "null")
+
+
+def _cursor_kind(value: Any) -> str:
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, str):
+        return "string"
+    if value is None:
+        return "null"
+    raise ValueError(f"Unsupported {SORT_FIELD} type for cursor: {type(value).__name__}")
+
+
+def _kind_filter(kind: str) -> Dict[str, Any]:
+    """Все документы с created_at данного типа (null - в том числе без поля)"""
+    if kind == "null":
+        return {SORT_FIELD: None}
+    return {SORT_FIELD: {"$type": kind}}
+
+
+def encode_cursor(document: Dict[str, Any], direction: str) -> str:
+    """
+    Непрозрачный курсор страницы: позиция (created_at, _id) документа и направление
+    ("next" - записи после него, "prev" - перед ним), base64url от JSON.
+    Тип created_at (дата, строка, нет значения) сохраняется в курсоре.
+    """
+    value = document.get(SORT_FIELD)
+    kind = _cursor_kind(value)
+    payload = {
+        "d": direction,
+        "k": kind,
+        "t": value.isoformat() if kind == "date" else value,
+        "i": str(document["_id"])
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str, Any, ObjectId]:
+    """Разбор курсора: (направление, тип created_at, created_at, _id). Испорченный курсор - 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        direction = payload["d"]
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        value = payload["t"]
+        # Курсоры без типа выдавались до его появления: строка в них - всегда дата
+        kind = payload.get("k") or ("null" if value is None else "date")
+        if kind == "date":
+            value = datetime.fromisoformat(value)
+        if kind not in CURSOR_KINDS or _cursor_kind(value) != kind:
+            raise ValueError(kind)
+        return direction, kind, value, ObjectId(payload["i"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Неверный курсор пагинации"
+        )
+
+
+def keyset_query(query: Dict[str, Any], cursor: Optional[str]) -> Tuple[Dict[str, Any], List[Tuple[str, int]], str]:
+    """
+    Фильтр и сортировка страницы по курсору.
+    Условие «после (t, id)» идёт по составному индексу (created_at, _id) без skip:
+    любая страница стоит как первая.
+    Возвращает (фильтр, сортировка, направление).
+    """
+    if not cursor:
+        return query, KEYSET_SORT, "next"
+
+    direction, kind, value, object_id = decode_cursor(cursor)
+    op = "$lt" if direction == "next" else "$gt"
+    branches = []
+    if kind != "null":
+        # Сравнение в MongoDB идёт только внутри одного типа
+        branches.append({SORT_FIELD: {op: value}})
+    branches.append({SORT_FIELD: value, "_id": {op: object_id}})
+    # Документы с created_at другого типа целиком лежат по одну сторону от курсора
+    index = CURSOR_KINDS.index(kind)
+    other_kinds = CURSOR_KINDS[index + 1:] if direction == "next" else CURSOR_KINDS[:index]
+    branches.extend(_kind_filter(other) for other in other_kinds)
+    position = {"$or": branches}
+    # Назад читаем в обратном порядке от курсора, потом разворачиваем
+    sort = KEYSET_SORT if direction == "next" else [(field, -order) for field, order in KEYSET_SORT]
+    return ({"$and": [query, position]} if query else position), sort, direction
+
+
+def page_cursors(
+    documents: List[Dict[str, Any]],
+    direction: str,
+    has_more: bool,
+    from_cursor: bool
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Курсоры соседних страниц для уже упорядоченных (новые сверху) документов.
+    has_more - в направлении чтения нашлась ещё запись (запрошено limit + 1),
+    from_cursor - страница открыта по курсору (значит, с другой стороны записи есть).
+    """
+    if not documents:
+        return None, None
+    more_after = has_more if direction == "next" else from_cursor
+    more_before = from_cursor if direction == "next" else has_more
+    next_cursor = encode_cursor(documents[-1], "next") if more_after else None
+    prev_cursor = encode_cursor(documents[0], "prev") if more_before else None
+    return next_cursor, prev_cursor
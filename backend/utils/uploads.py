@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, NamedTuple, Optional
+from fastapi import HTTPException, UploadFile, status
+
+# Размер куска при потоковом чтении загрузки
+CHUNK_SIZE = 256 * 1024
+# Код 413 числом: название константы различается между версиями starlette
+HTTP_413_TOO_LARGE = 413
+
+# Сигнатуры (magic bytes) поддерживаемых изображений: MIME тип -> расширение
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif"
+}
+
+
+class IngestedFile(NamedTuple):
+    """
+    Сохранённая загрузка: ключ в хранилище, размер, SHA-256 содержимого и тип по сигнатуре.
+    deduplicated - такое же изображение уже было в хранилище (см. services/images.py).
+    """
+    key: str
+    size: int
+    sha256: str
+    mime_type: str
+    deduplicated: bool = False
+
+
+def detect_image_type(head: bytes) -> Optional[str]:
+    """MIME тип изображения по первым байтам файла (None - не изображение)"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return None
+
+
+def _too_large_error(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=HTTP_413_TOO_LARGE,
+        detail=f"Файл слишком большой. Максимальный размер: {max_size // (1024 * 1024)}MB"
+    )
+
+
+async def ingest_upload(file: UploadFile, storage, max_size: int) -> IngestedFile:
+    """
+    Потоковое сохранение загруженного изображения в хранилище (см. services/storage.py).
+
+    Файл читается кусками по CHUNK_SIZE: тип определяется по сигнатуре первого
+    куска (content_type от клиента не учитывается), SHA-256 считается на лету,
+    куски сразу уходят в хранилище без блокировки event loop. Слишком большой
+    файл отклоняется до начала записи, недописанный объект хранилище удаляет само.
+    """
+    head = await file.read(CHUNK_SIZE)
+    mime_type = detect_image_type(head)
+    if mime_type is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(IMAGE_EXTENSIONS)}"
+        )
+
+    size = file.size
+    if size is None:
+        # Старые версии starlette не заполняют size - тело уже лежит во временном файле
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+        file.file.seek(len(head))
+    if size > max_size:
+        raise _too_large_error(max_size)
+
+    key = f"{uuid.uuid4()}{IMAGE_EXTENSIONS[mime_type]}"
+    digest = hashlib.sha256()
+
+    async def chunks():
+        received = 0
+        chunk = head
+        while chunk:
+            received += len(chunk)
+            if received > max_size:
+                raise _too_large_error(max_size)
+            digest.update(chunk)
+            yield chunk
+            chunk = await file.read(CHUNK_SIZE)
+
+    await storage.put(key, chunks(), size, mime_type)
+    return IngestedFile(key, size, digest.hexdigest(), mime_type)
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Ограничение размера тела запроса до разбора multipart.
+
+    limits - префикс пути -> максимум байт (берётся самый длинный подходящий префикс).
+    Запрос с заведомо большим Content-Length отклоняется 413 без чтения тела,
+    тело без Content-Length (chunked) обрывается, как только превысит лимит.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit_for(self, path: str) -> Optional[int]:
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps(
+            {"detail": f"Запрос слишком большой. Максимальный размер: {limit // (1024 * 1024)}MB"},
+            ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": HTTP_413_TOO_LARGE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            return await self._reject(send, limit)
+
+        received = 0
+        exceeded = False
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Обрываем чтение: для приложения это выглядит как отключение клиента
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started, rejected
+            if exceeded:
+                # Ответ приложения на оборванное тело (400/500) заменяем на 413
+                if not response_started and not rejected:
+                    rejected = True
+                    await self._reject(send, limit)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except Exception:
+            if not exceeded or response_started:
+                raise
+        if exceeded and not response_started and not rejected:
+            await self._reject(send, limit)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Локальная замена OpenRouter для нагрузочного тестирования.
+
+Отвечает на POST /api/v1/chat/completions готовым JSON анкеты
+(ученик / обратная связь / обе страницы) с настраиваемой задержкой,
+долей ошибок 5xx и ответов 429. Поддерживает stream=true (SSE).
+
+Запуск:
+    python -m bench.fake_openrouter --port 8099 --latency-ms 800 --error-rate 0.02
+
+и в .env приложения:
+    OPENROUTER_API_URL=http://127.0.0.1:8099/api/v1/chat/completions
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic_settings import BaseSettings
+
+
+class FakeSettings(BaseSettings):
+    latency_ms: float = 800.0  # Средняя задержка ответа модели
+    jitter_ms: float = 200.0  # Разброс задержки (равномерно +-)
+    error_rate: float = 0.0  # Доля ответов 500
+    rate_limit_rate: float = 0.0  # Доля ответов 429
+    retry_after: int = 1  # Retry-After в ответах 429, сек
+    stream_chunk_chars: int = 12  # Размер куска текста в потоковом ответе
+
+    class Config:
+        env_prefix = "FAKE_OPENROUTER_"
+
+
+settings = FakeSettings()
+app = FastAPI(title="Fake OpenRouter")
+
+# Готовые ответы по типу формы
+CANNED = {
+    "student": {
+        "fio": "Иванов Иван Иванович",
+        "school": "Школа №57",
+        "class": "11Б",
+        "phone": "+7 999 123-45-67",
+        "parent_name": "Иванова Мария Петровна",
+        "parent_phone": "+7 999 765-43-21"
+    },
+    "feedback": {
+        "masterclass_rating": 9,
+        "speaker_rating": 10,
+        "feedback": "Было интересно, хотелось бы больше практики"
+    }
+}
+CANNED["combined"] = {
+    "pages": {"student": 0, "feedback": 1},
+    "student": CANNED["student"],
+    "feedback": CANNED["feedback"]
+}
+
+stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+
+def _form_kind(payload: dict) -> str:
+    """Тип формы по имени JSON-схемы или (без structured output) по тексту промпта"""
+    name = ((payload.get("response_format") or {}).get("json_schema") or {}).get("name", "")
+    for kind in ("combined", "feedback", "student"):
+        if name.startswith(kind):
+            return kind
+
+    prompt = ""
+    for message in payload.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            prompt += " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        elif isinstance(content, str):
+            prompt += content
+    if "двух страниц" in prompt:
+        return "combined"
+    if "обратной связи" in prompt:
+        return "feedback"
+    return "student"
+
+
+def _usage(payload: dict, content: str) -> dict:
+    images = sum(
+        1
+        for message in payload.get("messages") or []
+        if isinstance(message.get("content"), list)
+        for part in message["content"]
+        if part.get("type") == "image_url"
+    )
+    # Порядок величины как у Gemini: ~260 токенов на изображение
+    prompt_tokens = 200 + images * 258
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(content) // 3,
+        "total_tokens": prompt_tokens + len(content) // 3
+    }
+
+
+def _latency() -> float:
+    return max(0.0, settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)) / 1000
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    stats["requests"] += 1
+
+    roll = random.random()
+    if roll < settings.rate_limit_rate:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit exceeded", "code": 429}},
+            headers={"Retry-After": str(settings.retry_after)}
+        )
+    if roll < settings.rate_limit_rate + settings.error_rate:
+        stats["errors"] += 1
+        await asyncio.sleep(_latency() / 4)
+        return JSONResponse(status_code=500, content={"error": {"message": "Internal error", "code": 500}})
+
+    content = json.dumps(CANNED[_form_kind(payload)], ensure_ascii=False)
+    model = payload.get("model", "fake/model")
+    completion_id = f"gen-{uuid.uuid4().hex[:16]}"
+    usage = _usage(payload, content)
+
+    if not payload.get("stream"):
+        await asyncio.sleep(_latency())
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    async def event_stream():
+        chunks = [
+            content[i:i + settings.stream_chunk_chars]
+            for i in range(0, len(content), settings.stream_chunk_chars)
+        ]
+        # Задержка делится на время до первого токена и генерацию
+        total = _latency()
+        await asyncio.sleep(total / 2)
+        for chunk in chunks:
+            await asyncio.sleep(total / 2 / len(chunks))
+            data = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {"content": chunk}}]}
+            yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({'id': completion_id, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    """Счётчики запросов фейкового сервера"""
+    return stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenRouter для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--jitter-ms", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--rate-limit-rate", type=float)
+    args = parser.parse_args()
+
+    for name in ("latency_ms", "jitter_ms", "error_rate", "rate_limit_rate"):
+        value = getattr(args, name)
+        if value is not None:
+            setattr(settings, name, value)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест загрузки анкет.
+
+Поднимает фейковый OpenRouter (bench/fake_openrouter.py) и приложение
+(uvicorn backend.main:app) с OPENROUTER_API_URL, указывающим на фейк,
+и гоняет параллельные запросы по путям upload / feedback / save / batch.
+Для каждого пути выводит пропускную способность, p50/p95/p99 задержки,
+коды ответов и память каждого воркера uvicorn (RSS и пик).
+Параллельно нагрузке опрашивается /api/admin/metrics (пароль ADMIN_PASSWORD):
+задержка ответа админ-панели и задержка event loop показывают,
+не блокирует ли обработка загрузок остальные запросы.
+
+Нужна запущенная MongoDB (MONGODB_URI из .env).
+
+Примеры:
+    python -m bench.load_upload --requests 200 --concurrency 16
+    python -m bench.load_upload --paths upload,batch --workers 2 --latency-ms 1500 --rate-limit-rate 0.05
+    python -m bench.load_upload --target http://localhost:8000 --server-pid 12345
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+import httpx
+from PIL import Image
+
+PATHS = ("upload", "feedback", "save", "batch")
+APP_PORT = 8098
+FAKE_PORT = 8099
+# Период запросов к админ-панели во время прогона, сек
+PROBE_INTERVAL = 0.2
+
+
+def make_image(size: int, seed: int) -> bytes:
+    """Синтетическое «фото анкеты»: шум в JPEG, размер как у снимка с телефона"""
+    random.seed(seed)
+    image = Image.effect_noise((size, size * 4 // 3), 48).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def unique(image: bytes) -> bytes:
+    """Уникальный вариант изображения (данные после маркера конца JPEG игнорируются
+    декодерами), чтобы каждый запрос проходил мимо кэша OCR"""
+    return image + os.urandom(16)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def read_memory(pid: int) -> Optional[Dict[str, int]]:
+    """RSS и пиковый RSS процесса в МБ (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    return {
+        "rss_mb": int(fields.get("VmRSS", "0 kB").split()[0]) // 1024,
+        "peak_rss_mb": int(fields.get("VmHWM", "0 kB").split()[0]) // 1024
+    }
+
+
+def worker_pids(server_pid: int) -> List[int]:
+    """PID воркеров uvicorn (дочерние процессы мастера или сам процесс при --workers 1)"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # ppid - четвёртое поле после имени процесса в скобках
+        if int(stat.rsplit(")", 1)[1].split()[1]) == server_pid:
+            children.append(int(entry))
+    return children or [server_pid]
+
+
+class Runner:
+    def __init__(self, client: httpx.AsyncClient, images: List[bytes], upload_paths: List[str]):
+        self.client = client
+        self.images = images
+        self.upload_paths = upload_paths
+
+    def _image(self, name: str):
+        return (name, unique(random.choice(self.images)), "image/jpeg")
+
+    async def upload(self) -> httpx.Response:
+        return await self.client.post(
+            "/api/upload",
+            files={"file": self._image("page1.jpg")},
+            data={"application_type": "Мастер-класс"}
+        )
+
+    async def feedback(self) -> httpx.Response:
+        return await self.client.post("/api/upload/feedback", files={"file": self._image("page2.jpg")})
+
+    async def save(self) -> httpx.Response:
+        return await self.client.post("/api/upload/save", data={
+            "fio": "Иванов Иван Иванович",
+            "school": "Школа №57",
+            "student_class": "11Б",
+            "phone": "+79991234567",
+            "application_type": "Мастер-класс",
+            "image_paths": json.dumps(random.sample(self.upload_paths, min(2, len(self.upload_paths)))),
+            "masterclass_rating": "9",
+            "speaker_rating": "10",
+            "feedback": "Нагрузочный тест"
+        })
+
+    async def batch(self) -> httpx.Response:
+        return await self.client.post(
+            "/api/upload/batch",
+            files=[
+                ("files", self._image("page1.jpg")),
+                ("files", self._image("page2.jpg")),
+                ("files", self._image("extra.jpg"))
+            ],
+            data={"application_type": "Мастер-класс", "pages": json.dumps(["student", "feedback", "skip"])}
+        )
+
+
+async def admin_login(client: httpx.AsyncClient) -> Optional[Dict[str, str]]:
+    """Заголовки авторизации админ-панели (None - пароль не подошёл)"""
+    response = await client.post("/api/admin/login", json={"password": os.environ.get("ADMIN_PASSWORD", "admin")})
+    if response.status_code != 200:
+        return None
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+async def probe_admin(client: httpx.AsyncClient, headers: Dict[str, str], stop: asyncio.Event) -> List[float]:
+    """Запросы к /api/admin/metrics во время нагрузки (отдельный клиент - без очереди за соединением)"""
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = await client.get("/api/admin/metrics", headers=headers)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=PROBE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    return latencies
+
+
+async def run_path(
+    runner: Runner,
+    path: str,
+    total: int,
+    concurrency: int,
+    probe: Optional[Tuple[httpx.AsyncClient, Dict[str, str]]] = None
+) -> dict:
+    """
+    Прогон одного пути: total запросов при concurrency одновременных.
+    probe - (клиент, заголовки) для опроса админ-панели во время прогона.
+    """
+    send = getattr(runner, path)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await send()
+                code = str(response.status_code)
+                if path in ("upload", "feedback") and response.status_code == 200:
+                    runner.upload_paths.append(response.json()["image_path"])
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            statuses[code] = statuses.get(code, 0) + 1
+            if code == "200":
+                latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe_admin(*probe, stop)) if probe else None
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    admin = None
+    if prober is not None:
+        admin_latencies = await prober
+        client, headers = probe
+        # Задержка event loop воркера, ответившего на запрос (при нескольких воркерах - одного из них)
+        metrics = (await client.get("/api/admin/metrics", headers=headers)).json()
+        admin = {
+            "requests": len(admin_latencies),
+            "p50_ms": round(percentile(admin_latencies, 0.50) * 1000, 1),
+            "p99_ms": round(percentile(admin_latencies, 0.99) * 1000, 1),
+            "event_loop": metrics.get("event_loop")
+        }
+
+    return {
+        "path": path,
+        "requests": total,
+        "ok": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "statuses": statuses,
+        "admin": admin
+    }
+
+
+def spawn(args) -> List[subprocess.Popen]:
+    """Запуск фейкового OpenRouter и приложения"""
+    env = {
+        **os.environ,
+        "FAKE_OPENROUTER_LATENCY_MS": str(args.latency_ms),
+        "FAKE_OPENROUTER_ERROR_RATE": str(args.error_rate),
+        "FAKE_OPENROUTER_RATE_LIMIT_RATE": str(args.rate_limit_rate),
+        "OPENROUTER_API_URL": f"http://127.0.0.1:{FAKE_PORT}/api/v1/chat/completions",
+        "OPENROUTER_API_KEY": os.environ.get("OPENROUTER_API_KEY") or "fake",
+        "OPENROUTER_HTTP2": "false"
+    }
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.fake_openrouter:app",
+         "--port", str(FAKE_PORT), "--log-level", "warning"],
+        env=env
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app",
+         "--port", str(APP_PORT), "--workers", str(args.workers), "--log-level", "warning"],
+        env=env
+    )
+    return [fake, app]
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.3)
+    raise RuntimeError("Приложение не поднялось за отведённое время")
+
+
+async def main(args):
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        raise SystemExit(f"Неизвестные пути: {', '.join(sorted(unknown))}. Доступны: {', '.join(PATHS)}")
+
+    processes = []
+    base_url = args.target
+    server_pid = args.server_pid
+    if not base_url:
+        processes = spawn(args)
+        base_url = f"http://127.0.0.1:{APP_PORT}"
+        server_pid = processes[1].pid
+
+    print("=" * 60)
+    print(f"🚀 Нагрузочный тест: {base_url}")
+    print(f"   запросов на путь: {args.requests}, параллельно: {args.concurrency}")
+    if processes:
+        print(
+            f"   fake OpenRouter: {args.latency_ms} мс, ошибки {args.error_rate:.0%}, "
+            f"429 {args.rate_limit_rate:.0%}, воркеров uvicorn: {args.workers}"
+        )
+    print("=" * 60)
+
+    images = [make_image(args.image_size, seed) for seed in range(4)]
+    print(f"📷 Размер тестового изображения: {len(images[0]) // 1024} КБ")
+
+    results = []
+    memory = {}
+    try:
+        timeout = httpx.Timeout(300.0, connect=10.0)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+            await wait_ready(client)
+            runner = Runner(client, images, upload_paths=[])
+            if "save" in paths and "upload" not in paths:
+                # Для save нужны реальные пути загруженных файлов
+                await run_path(runner, "upload", min(args.concurrency, args.requests), args.concurrency)
+
+            probe = None
+            probe_client = httpx.AsyncClient(base_url=base_url, timeout=timeout)
+            headers = await admin_login(probe_client)
+            if headers:
+                probe = (probe_client, headers)
+            else:
+                print("⚠️ Не удалось войти в админ-панель (ADMIN_PASSWORD) - задержка админки не замеряется")
+
+            for path in paths:
+                result = await run_path(runner, path, args.requests, args.concurrency, probe)
+                if server_pid:
+                    result["memory"] = {pid: read_memory(pid) for pid in worker_pids(server_pid)}
+                results.append(result)
+                print(
+                    f"✅ {path:<9} {result['throughput_rps']:>7} req/s  "
+                    f"p50 {result['p50_ms']:>8} мс  p95 {result['p95_ms']:>8} мс  "
+                    f"p99 {result['p99_ms']:>8} мс  {result['statuses']}"
+                )
+                for pid, usage in (result.get("memory") or {}).items():
+                    if usage:
+                        print(f"   воркер {pid}: RSS {usage['rss_mb']} МБ, пик {usage['peak_rss_mb']} МБ")
+                if result["admin"]:
+                    loop = result["admin"]["event_loop"] or {}
+                    print(
+                        f"   админка: p50 {result['admin']['p50_ms']} мс, p99 {result['admin']['p99_ms']} мс; "
+                        f"event loop: p99 {loop.get('p99_ms')} мс, макс {loop.get('window_max_ms')} мс, "
+                        f"зависаний {loop.get('stalls')}"
+                    )
+            await probe_client.aclose()
+    finally:
+        for process in reversed(processes):
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"📝 Результаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест загрузки анкет")
+    parser.add_argument("--paths", default=",".join(PATHS), help="Пути через запятую: upload,feedback,save,batch")
+    parser.add_argument("--requests", type=int, default=100, help="Запросов на каждый путь")
+    parser.add_argument("--concurrency", type=int, default=16, help="Одновременных запросов")
+    parser.add_argument("--image-size", type=int, default=1500, help="Ширина тестового изображения, px")
+    parser.add_argument("--workers", type=int, default=1, help="Воркеров uvicorn (при запуске приложения)")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Задержка фейкового OpenRouter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500 фейкового OpenRouter")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429 фейкового OpenRouter")
+    parser.add_argument("--target", help="Адрес уже запущенного приложения (тогда ничего не запускается)")
+    parser.add_argument("--server-pid", type=int, help="PID uvicorn для замера памяти при --target")
+    parser.add_argument("--json", help="Сохранить результаты в JSON файл")
+    asyncio.run(main(parser.parse_args()))
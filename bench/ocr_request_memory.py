@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Пиковое потребление памяти на один запрос к OpenRouter.
+
+Сравнивает сборку тела запроса:
+- legacy: base64 строка + data URL f-строка + json= в httpx (как было раньше)
+- buffer: build_json_body - base64 пишется прямо в буфер тела, тело отдаётся кусками
+
+Запрос уходит в транспорт, который читает тело потоком и отбрасывает
+(httpx.MockTransport читает тело целиком и исказил бы замер),
+так что замер включает и сериализацию внутри httpx. Память считается через tracemalloc
+(только аллокации Python, исходные байты изображения в замер не входят).
+
+Запуск:
+    python -m bench.ocr_request_memory --sizes 1,5,10
+"""
+import argparse
+import asyncio
+import base64
+import os
+import tracemalloc
+import httpx
+from backend.services.ocr import _completion_payload, _image_part, _request_body
+from backend.utils.json_body import iter_body
+
+URL = "http://fake-openrouter/api/v1/chat/completions"
+
+
+class DrainTransport(httpx.AsyncBaseTransport):
+    """Транспорт-заглушка: тело запроса вычитывается кусками, как при отправке в сокет"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async for _ in request.stream:
+            pass
+        return httpx.Response(200, json={"choices": []})
+
+
+async def send_legacy(client: httpx.AsyncClient, image: bytes):
+    base64_image = base64.b64encode(image).decode("utf-8")
+    payload = _completion_payload("student", [], "fake/model")
+    payload["messages"][0]["content"].append({
+        "type": "image_url",
+        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+    })
+    await client.post(URL, json=payload)
+
+
+async def send_buffer(client: httpx.AsyncClient, image: bytes):
+    body, headers = await _request_body(
+        _completion_payload("student", [_image_part(image, "image/jpeg")], "fake/model")
+    )
+    await client.post(URL, headers=headers, content=iter_body(body))
+
+
+async def measure(send, image: bytes) -> float:
+    async with httpx.AsyncClient(transport=DrainTransport()) as client:
+        # Прогрев: импорты и кэши httpx не должны попадать в замер
+        await send(client, b"\xff\xd8\xff")
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        await send(client, image)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+async def main(sizes):
+    print("=" * 60)
+    print("📊 Пиковая память на запрос к OpenRouter (МБ, сверх исходного изображения)")
+    print("=" * 60)
+    print(f"{'изображение':>12} {'legacy':>10} {'buffer':>10} {'экономия':>10}")
+    for size_mb in sizes:
+        image = os.urandom(int(size_mb * 1024 * 1024))
+        legacy = await measure(send_legacy, image)
+        buffer = await measure(send_buffer, image)
+        print(f"{size_mb:>10} МБ {legacy:>10.1f} {buffer:>10.1f} {legacy / buffer:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пиковая память на запрос к OpenRouter")
+    parser.add_argument("--sizes", default="1,5,10", help="Размеры изображений в МБ через запятую")
+    args = parser.parse_args()
+    asyncio.run(main([float(size) for size in args.sizes.split(",")]))
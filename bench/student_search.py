@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Поиск заявок: полный проход регулярным выражением против индексов поиска.
+
+Заполняет отдельную базу (<MONGODB_DB_NAME>_bench_search) синтетическими
+заявками с ключами поиска (search_fields) и для набора запросов сравнивает:
+- scan - как было раньше: {"fio": {"$regex": q, "$options": "i"}}
+- index - search_filter: префикс по search.tokens / подстрока по search.trigrams
+- ranked - StudentSearch.ranked: текстовый индекс с русской морфологией + index
+
+По каждому запросу выводится медиана времени и по explain() план,
+число просмотренных ключей индекса и документов.
+
+Запуск (нужна запущенная MongoDB, рабочая база не затрагивается):
+    python -m bench.student_search --students 500000
+    python -m bench.student_search --reuse  # без повторного заполнения базы
+"""
+import argparse
+import asyncio
+import random
+import re
+import statistics
+import time
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorClient
+from backend.config import get_settings
+from backend.database import mongodb
+from backend.database.migrations import sync_indexes
+from backend.services.search import search_fields, search_filter, student_search
+
+SURNAMES = [
+    "Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев", "Соколов",
+    "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов",
+    "Егоров", "Павлов", "Козлов", "Степанов", "Николаев", "Орлов", "Андреев", "Макаров"
+]
+FIRST_NAMES = [
+    ("Александр", "Александра"), ("Дмитрий", "Дарья"), ("Максим", "Мария"), ("Артём", "Анна"),
+    ("Иван", "Екатерина"), ("Михаил", "Полина"), ("Никита", "Алёна"), ("Кирилл", "Ксения")
+]
+PATRONYMICS = [("Сергеевич", "Сергеевна"), ("Андреевич", "Андреевна"), ("Алексеевич", "Алексеевна")]
+SCHOOLS = ["Школа №{}", "Лицей №{}", "Гимназия №{}", "МБОУ СОШ №{}"]
+CITIES = ["Москва", "Казань", "Пермь", "Тверь", "Самара", "Томск"]
+
+QUERIES = [
+    "иванов",           # частая фамилия целиком
+    "семенов",          # ё в данных, е в запросе
+    "ксен",             # начало имени
+    "ванов",            # подстрока из середины
+    "лебедева мария",   # два слова
+    "лицей 57",         # школа
+    "9161234",          # часть телефона
+]
+PAGE = 50
+
+
+def make_student(rng: random.Random, created_at: datetime) -> dict:
+    female = rng.random() < 0.5
+    surname = rng.choice(SURNAMES) + ("а" if female else "")
+    first = rng.choice(FIRST_NAMES)[female]
+    patronymic = rng.choice(PATRONYMICS)[female]
+    student = {
+        "fio": f"{surname} {first} {patronymic}",
+        "school": f"{rng.choice(SCHOOLS).format(rng.randint(1, 300))} г. {rng.choice(CITIES)}",
+        "class": str(rng.randint(5, 11)),
+        "phone": f"+7 9{rng.randint(10, 99)} {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+        "parent_phone": None,
+        "application_type": "bench",
+        "created_at": created_at,
+        "sent_to_amo": rng.random() < 0.3
+    }
+    student.update(search_fields(student))
+    return student
+
+
+async def fill(collection, count: int, batch: int):
+    rng = random.Random(42)
+    await collection.drop()
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    for offset in range(0, count, batch):
+        size = min(batch, count - offset)
+        await collection.insert_many(
+            [make_student(rng, now - timedelta(seconds=offset + i)) for i in range(size)],
+            ordered=False
+        )
+    await sync_indexes(collection.database, ["students"])
+    print(f"Filled {count} students in {time.perf_counter() - started:.1f}s")
+
+
+def _plan_stages(plan: dict) -> list:
+    stages = [plan.get("stage")]
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        stages.extend(_plan_stages(child))
+    return [stage for stage in stages if stage]
+
+
+async def explain(cursor) -> str:
+    report = await cursor.explain()
+    stats = report.get("executionStats", {})
+    stages = _plan_stages(report.get("queryPlanner", {}).get("winningPlan", {}))
+    return (
+        f"keys {stats.get('totalKeysExamined', '?'):>7} docs {stats.get('totalDocsExamined', '?'):>7} "
+        f"plan {'>'.join(dict.fromkeys(stages))}"
+    )
+
+
+async def timed(run, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+async def bench(collection, repeat: int):
+    sort = [("created_at", -1), ("_id", -1)]
+    print(f"\n{'query':<18} {'path':<7} {'median ms':>10} {'found':>6}  explain")
+    for query in QUERIES:
+        paths = {
+            "scan": {"fio": {"$regex": re.escape(query), "$options": "i"}},
+            "index": search_filter(query)
+        }
+        for name, flt in paths.items():
+            ms, found = await timed(
+                lambda: collection.find(flt, {"_id": 1}).sort(sort).limit(PAGE).to_list(length=PAGE), repeat
+            )
+            plan = await explain(collection.find(flt, {"_id": 1}).sort(sort).limit(PAGE))
+            print(f"{query:<18} {name:<7} {ms:>10.2f} {len(found):>6}  {plan}")
+        ms, found = await timed(lambda: student_search.ranked(query, PAGE), repeat)
+        best = found[0]["fio"] if found else "-"
+        print(f"{query:<18} {'ranked':<7} {ms:>10.2f} {len(found):>6}  top: {best}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Student search: scan vs index")
+    parser.add_argument("--students", type=int, default=500_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="Не заполнять базу заново")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    client = AsyncIOMotorClient(settings.mongodb_uri)
+    database = client[f"{settings.mongodb_db_name}_bench_search"]
+    # StudentSearch.ranked работает с базой приложения - подменяем её на тестовую
+    mongodb.db.db = database
+    collection = database.students
+    try:
+        if not args.reuse:
+            await fill(collection, args.students, args.batch)
+        await bench(collection, args.repeat)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,7 +2,11 @@
 let token = localStorage.getItem('admin_token');
 let currentPage = 0;
 let pageSize = 20;
-let totalStudents = 0;
+let totalStudents = null;
+// Курсоры пагинации: текущая страница и соседние (null - первая страница / соседней нет)
+let currentCursor = null;
+let nextCursor = null;
+let prevCursor = null;
 let currentFilter = '';
 let searchQuery = '';
 let deleteStudentId = null;
@@ -144,7 +148,7 @@ async function loadStats() {
 async function loadStudents() {
     studentsTable.innerHTML = `
         <tr>
-            <td colspan="7">
+            <td colspan="9">
                 <div class="loading">
                     <div class="spinner"></div>
                 </div>
@@ -153,7 +157,14 @@ async function loadStudents() {
     `;
     
     try {
-        let url = `/api/admin/students?skip=${currentPage * pageSize}&limit=${pageSize}`;
+        let url = `/api/admin/students?limit=${pageSize}`;
+        
+        if (currentCursor) {
+            url += `&cursor=${encodeURIComponent(currentCursor)}`;
+        } else {
+            // Общее число нужно только для подписи - запрашиваем его на первой странице
+            url += '&with_total=true';
+        }
         
         if (currentFilter !== '') {
             url += `&sent_to_amo=${currentFilter}`;
@@ -171,7 +182,11 @@ async function loadStudents() {
         
         if (response.ok) {
             const data = await response.json();
-            totalStudents = data.total;
+            if (data.total !== null) {
+                totalStudents = data.total;
+            }
+            nextCursor = data.next;
+            prevCursor = data.prev;
             renderStudents(data.students);
             updatePagination();
         } else if (response.status === 401) {
@@ -181,7 +196,7 @@ async function loadStudents() {
         console.error('Error loading students:', error);
         studentsTable.innerHTML = `
             <tr>
-                <td colspan="8">
+                <td colspan="9">
                     <div class="empty-state">
                         <p>Ошибка загрузки данных</p>
                     </div>
@@ -195,7 +210,7 @@ function renderStudents(students) {
     if (students.length === 0) {
         studentsTable.innerHTML = `
             <tr>
-                <td colspan="8">
+                <td colspan="9">
                     <div class="empty-state">
                         <svg fill="none" stroke="currentColor" viewBox="0 0 24 24">
                             <path stroke-linecap="round" stroke-linejoin="round" stroke-width="1.5" d="M9 12h6m-6 4h6m2 5H7a2 2 0 01-2-2V5a2 2 0 012-2h5.586a1 1 0 01.707.293l5.414 5.414a1 1 0 01.293.707V19a2 2 0 01-2 2z"/>
@@ -230,6 +245,7 @@ function renderStudents(students) {
         
         return `
         <tr>
+            <td>${renderThumbnails(student.image_paths)}</td>
             <td><span style="font-size: 12px; color: var(--accent-primary);">${escapeHtml(student.application_type || '-')}</span></td>
             <td><strong>${escapeHtml(student.fio || '-')}</strong>${feedbackInfo}</td>
             <td>${escapeHtml(student.school || '-')}</td>
@@ -262,32 +278,73 @@ function renderStudents(students) {
     }).join('');
 }
 
+// Миниатюры фото анкеты: в таблицу грузятся уменьшенные копии, оригинал - только по ссылке
+function imageUrl(path, variant) {
+    const key = path.split('/').pop();
+    return variant ? `/uploads/${variant}/${encodeURIComponent(key)}` : `/uploads/${encodeURIComponent(key)}`;
+}
+
+function renderThumbnails(paths) {
+    const images = (paths || []).filter(Boolean);
+    if (images.length === 0) {
+        return '<span style="color: var(--text-secondary);">-</span>';
+    }
+    return `<div class="thumbnails">${images.map(path => `
+        <img class="thumbnail" src="${imageUrl(path, 'thumb')}" loading="lazy" decoding="async"
+             width="48" height="48" alt="Фото анкеты" data-path="${escapeHtml(path)}" onclick="openImage(this.dataset.path)">
+    `).join('')}</div>`;
+}
+
+function openImage(path) {
+    document.getElementById('imagePreview').src = imageUrl(path, 'preview');
+    document.getElementById('imageOriginalLink').href = imageUrl(path);
+    document.getElementById('imageModal').classList.add('active');
+}
+
+function closeImage() {
+    document.getElementById('imageModal').classList.remove('active');
+    document.getElementById('imagePreview').src = '';
+}
+
 function updatePagination() {
-    const totalPages = Math.ceil(totalStudents / pageSize);
     const pageInfo = document.getElementById('pageInfo');
     const prevBtn = document.getElementById('prevPage');
     const nextBtn = document.getElementById('nextPage');
     
-    pageInfo.textContent = `Страница ${currentPage + 1} из ${totalPages || 1}`;
-    prevBtn.disabled = currentPage === 0;
-    nextBtn.disabled = currentPage >= totalPages - 1;
+    const totalPages = totalStudents !== null ? Math.ceil(totalStudents / pageSize) : null;
+    pageInfo.textContent = totalPages
+        ? `Страница ${currentPage + 1} из ${Math.max(totalPages, currentPage + 1)}`
+        : `Страница ${currentPage + 1}`;
+    prevBtn.disabled = !prevCursor;
+    nextBtn.disabled = !nextCursor;
 }
 
 function changePage(delta) {
-    currentPage += delta;
+    const cursor = delta > 0 ? nextCursor : prevCursor;
+    if (!cursor) {
+        return;
+    }
+    currentCursor = cursor;
+    currentPage = Math.max(0, currentPage + delta);
     loadStudents();
 }
 
+function resetPagination() {
+    currentPage = 0;
+    currentCursor = null;
+    totalStudents = null;
+}
+
 // Search and Filter
 function handleSearch() {
     searchQuery = searchInput.value.trim();
-    currentPage = 0;
+    resetPagination();
     loadStudents();
 }
 
 function handleFilter() {
     currentFilter = filterSelect.value;
-    currentPage = 0;
+    resetPagination();
     loadStudents();
 }
 
@@ -547,6 +604,7 @@ function debounce(func, wait) {
 document.addEventListener('keydown', (e) => {
     if (e.key === 'Escape') {
         closeModal();
+        closeImage();
     }
 });
 
@@ -557,3 +615,8 @@ document.getElementById('deleteModal').addEventListener('click', (e) => {
     }
 });
 
+document.getElementById('imageModal').addEventListener('click', (e) => {
+    if (e.target.classList.contains('modal-overlay')) {
+        closeImage();
+    }
+});
@@ -0,0 +1,46 @@
+import asyncio
+import io
+import pytest
+from PIL import Image
+from backend.services import image_processing
+from backend.services.image_processing import normalize_image, original_mime_type, prepare_image_for_ocr
+
+
+def _image(output_format: str) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buffer, output_format)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("output_format, filename, expected", [
+    ("PNG", "scan.jpg", "image/png"),
+    ("JPEG", "scan.png", "image/jpeg"),
+    ("WEBP", "scan.jpeg", "image/webp"),
+    ("GIF", "scan", "image/gif"),
+])
+def test_original_mime_type_uses_signature(output_format, filename, expected):
+    assert original_mime_type(_image(output_format), filename) == expected
+
+
+def test_original_mime_type_unknown_signature_uses_extension():
+    assert original_mime_type(b"not an image", "scan.png") == "image/png"
+
+
+def test_prepare_without_preprocessing_sends_detected_type(monkeypatch):
+    monkeypatch.setattr(image_processing.settings, "image_preprocess_enabled", False)
+    data = _image("PNG")
+    assert asyncio.run(prepare_image_for_ocr(data, "scan.jpg")) == (data, "image/png", {"skipped": True})
+
+
+def test_prepare_kept_original_sends_detected_type(monkeypatch):
+    async def run_process(function, *args):
+        return function(*args)
+
+    monkeypatch.setattr(image_processing.settings, "image_preprocess_enabled", True)
+    monkeypatch.setattr(image_processing.executors, "run_process", run_process)
+    data = _image("PNG")
+    # Крошечный PNG перекодированием не уменьшить - в модель уходит оригинал
+    assert normalize_image(data)[2]["processed_bytes"] >= len(data)
+    prepared, mime_type, stats = asyncio.run(prepare_image_for_ocr(data, "scan.jpg"))
+    assert prepared == data and stats["kept_original"]
+    assert mime_type == "image/png"
@@ -0,0 +1,74 @@
+import asyncio
+import base64
+import json
+import os
+import pytest
+from backend.utils.json_body import ENCODE_CHUNK, SEND_CHUNK, InlineImage, build_json_body, iter_body
+
+
+def _reference(payload) -> bytes:
+    """То же тело обычным способом: data URL строкой и json.dumps"""
+    def inline(value):
+        if isinstance(value, InlineImage):
+            return f"data:{value.mime_type};base64,{base64.b64encode(value.data).decode('ascii')}"
+        if isinstance(value, dict):
+            return {key: inline(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [inline(item) for item in value]
+        return value
+    return json.dumps(inline(payload), ensure_ascii=False).encode("utf-8")
+
+
+def _payload(*images: InlineImage) -> dict:
+    """Тело запроса к OpenRouter: текст промпта и изображения"""
+    return {
+        "model": "google/gemini-2.0-flash-001",
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Распознай анкету: ФИО, «школа», \"класс\"\n\ttab \\ slash"},
+                *({"type": "image_url", "image_url": {"url": image}} for image in images)
+            ]
+        }],
+        "temperature": 0.1,
+        "stream": False,
+        "max_tokens": None
+    }
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, ENCODE_CHUNK - 1, ENCODE_CHUNK, ENCODE_CHUNK + 1, 2 * ENCODE_CHUNK + 2])
+def test_body_equals_json_dumps(size):
+    payload = _payload(InlineImage(os.urandom(size), "image/jpeg"))
+    body = build_json_body(payload)
+    assert bytes(body) == _reference(payload)
+    assert json.loads(body)["messages"][0]["content"][1]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+
+
+def test_body_with_several_images_and_no_images():
+    images = [InlineImage(os.urandom(size), mime) for size, mime in ((10, "image/png"), (ENCODE_CHUNK + 5, "image/webp"))]
+    assert bytes(build_json_body(_payload(*images))) == _reference(_payload(*images))
+    assert bytes(build_json_body(_payload())) == _reference(_payload())
+
+
+def test_encoded_size_is_exact():
+    for size in (0, 1, 2, 3, 100, ENCODE_CHUNK + 1):
+        image = InlineImage(os.urandom(size), "image/jpeg")
+        expected = f"data:image/jpeg;base64,{base64.b64encode(image.data).decode('ascii')}"
+        assert image.encoded_size == len(expected)
+
+
+def test_unsupported_value_raises():
+    with pytest.raises(TypeError):
+        build_json_body({"value": object()})
+
+
+def test_iter_body_yields_whole_body_in_chunks():
+    body = build_json_body(_payload(InlineImage(os.urandom(3 * SEND_CHUNK), "image/jpeg")))
+
+    async def collect():
+        return [chunk async for chunk in iter_body(body)]
+
+    chunks = asyncio.run(collect())
+    assert b"".join(chunks) == bytes(body)
+    assert all(len(chunk) <= SEND_CHUNK for chunk in chunks)
+    assert len(chunks) == -(-len(body) // SEND_CHUNK)
@@ -0,0 +1,79 @@
+import json
+import pytest
+from backend.utils.json_stream import JSONFieldStream, extract_json_object
+
+
+def _stream(text: str, chunk: int) -> list:
+    parser = JSONFieldStream()
+    fields = []
+    for pos in range(0, len(text), chunk):
+        fields.extend(parser.feed(text[pos:pos + chunk]))
+    return fields
+
+
+ANSWER = {
+    "fio": "Иванов \"Ваня\" Иван",
+    "school": "Лицей №57 {корпус 2}",
+    "class": "9А",
+    "phone": "+7 (916) 123-45-67",
+    "parent": {"name": "Иванова, Мария", "phones": ["8 916 000", None]},
+    "note": "путь C:\\temp\\} и \\\" в конце"
+}
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 7, 10_000])
+def test_stream_fields_any_chunking(chunk):
+    text = "```json\n" + json.dumps(ANSWER, ensure_ascii=False, indent=2) + "\n```"
+    assert _stream(text, chunk) == list(ANSWER.items())
+
+
+def test_stream_escaped_quotes_and_braces_in_strings():
+    text = r'{"fio": "А \"Б\" {В}", "class": "10, 11"}'
+    assert _stream(text, 3) == [("fio", 'А "Б" {В}'), ("class", "10, 11")]
+
+
+def test_stream_emits_field_once_complete():
+    parser = JSONFieldStream()
+    assert parser.feed('{"fio": "Иванов", "sch') == [("fio", "Иванов")]
+    assert parser.feed('ool": {"n": [1, 2]}') == []
+    assert parser.feed("}") == [("school", {"n": [1, 2]})]
+    assert parser.finished
+    assert parser.feed(', "late": 1}') == []
+
+
+def test_stream_truncated_keeps_finished_fields():
+    assert _stream('{"fio": "Иванов", "class": "9", "phone": "+7 91', 5) == [("fio", "Иванов"), ("class", "9")]
+
+
+def test_stream_trailing_comma():
+    assert _stream('{"fio": "Иванов", "class": null,\n}', 4) == [("fio", "Иванов"), ("class", None)]
+
+
+def test_extract_with_text_around():
+    text = 'Вот результат:\n```json\n{"fio": "Иванов", "nested": {"a": [1, {"b": "}"}]}}\n```\nГотово.'
+    assert extract_json_object(text) == {"fio": "Иванов", "nested": {"a": [1, {"b": "}"}]}}
+
+
+def test_extract_escaped_quotes():
+    assert extract_json_object(r'{"fio": "Иванов \"Ваня\"", "x": "\\"}') == {"fio": 'Иванов "Ваня"', "x": "\\"}
+
+
+def test_extract_trailing_commas():
+    assert extract_json_object('{"fio": "Иванов", "phones": ["1", "2",],}') == {"fio": "Иванов", "phones": ["1", "2"]}
+
+
+def test_extract_skips_non_json_braces():
+    assert extract_json_object('шаблон {ФИО} заполнен: {"fio": "Иванов"}') == {"fio": "Иванов"}
+
+
+def test_extract_truncated_returns_finished_fields():
+    assert extract_json_object('```json\n{"fio": "Иванов", "school": "Лицей", "feedback": "Очень понра') == {
+        "fio": "Иванов",
+        "school": "Лицей"
+    }
+
+
+@pytest.mark.parametrize("text", ["", "нет json", '{"fio": "Ива'])
+def test_extract_without_object_raises(text):
+    with pytest.raises(json.JSONDecodeError):
+        extract_json_object(text)
@@ -0,0 +1,48 @@
+import asyncio
+from backend.services.ocr_routing import ModelRouter
+
+
+def test_cancelled_hedged_call_cancels_model_requests():
+    """Отмена вызова (клиент ушёл) отменяет и запрос к модели, а не оставляет его висеть"""
+    router = ModelRouter(["fast", "strong"], hedge_after=10)
+    started, cancelled = [], []
+
+    async def call(model):
+        started.append(model)
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return {}, {}, None
+
+    async def scenario():
+        task = asyncio.create_task(router.run("student", call))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        # Проверка до выхода из asyncio.run: он сам отменяет оставшиеся задачи
+        assert cancelled == ["fast"]
+
+    asyncio.run(scenario())
+    assert started == ["fast"]
+
+
+def test_hedged_call_cancels_losing_request():
+    router = ModelRouter(["fast", "strong"], hedge_after=0.01)
+    cancelled = []
+
+    async def call(model):
+        try:
+            await asyncio.sleep(60 if model == "fast" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return {"fio": "Иванов", "class": "5", "phone": "9161234567"}, {"model": model}, None
+
+    (parsed, raw, error), routing = asyncio.run(router.run("student", call))
+    assert raw == {"model": "strong"} and error is None
+    assert routing["models"] == ["strong"]
+    assert cancelled == ["fast"]
+    assert router.stats["hedge_wins"] == 1
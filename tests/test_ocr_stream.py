@@ -0,0 +1,104 @@
+import asyncio
+import io
+import json
+import httpx
+import pytest
+from PIL import Image
+from backend.services import ocr
+from backend.services.http_client import openrouter_http
+from backend.services.ocr_routing import model_router
+from backend.services.ocr_scheduler import ocr_scheduler
+
+FAST, STRONG = "test/fast", "test/strong"
+STUDENT = {
+    "fio": "Иванов Иван Иванович",
+    "school": "Лицей 57",
+    "class": "9А",
+    "phone": "+7 916 123-45-67",
+    "parent_name": None,
+    "parent_phone": None
+}
+
+
+def _image() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def openrouter(monkeypatch):
+    """OpenRouter с заданным ответом первой (потоковой) модели; вторая отвечает STUDENT"""
+    requests = []
+    replies = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        model = json.loads(request.content)["model"]
+        requests.append(model)
+        if model == FAST:
+            return replies[FAST]
+        return httpx.Response(200, json={
+            "model": STRONG,
+            "choices": [{"message": {"role": "assistant", "content": json.dumps(STUDENT)}}]
+        })
+
+    monkeypatch.setattr(openrouter_http, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(model_router, "models", [FAST, STRONG])
+    monkeypatch.setattr(model_router, "hedge_after", 0)
+    monkeypatch.setattr(ocr_scheduler, "max_retries", 0)
+    monkeypatch.setattr(ocr.settings, "ocr_cache_enabled", False)
+    monkeypatch.setattr(ocr.settings, "image_preprocess_enabled", False)
+    yield replies, requests
+    asyncio.run(openrouter_http.client.aclose())
+
+
+def _stream(kind: str = "student"):
+    async def collect():
+        return [event async for event in ocr.stream_page_ocr(_image(), "page.png", kind)]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("status", [429, 500, 400])
+def test_first_model_error_falls_back_to_chain(openrouter, status):
+    replies, requests = openrouter
+    replies[FAST] = httpx.Response(status, text="provider error")
+
+    events = _stream()
+
+    assert requests == [FAST, STRONG]
+    assert events[0] == ("started", {"from_cache": False})
+    fields = {data["name"]: data["value"] for event, data in events if event == "field"}
+    assert fields["fio"] == STUDENT["fio"] and fields["phone"] == STUDENT["phone"]
+    event, payload = events[-1]
+    assert event == "done"
+    assert payload["data"]["fio"] == STUDENT["fio"]
+    assert payload["data"]["class"] == "9А"
+    assert payload["ocr_raw"]["model"] == STRONG
+    assert payload["ocr_raw"]["routing"]["models"] == [STRONG]
+
+
+def test_unparsed_stream_falls_back_to_chain(openrouter):
+    replies, requests = openrouter
+    chunk = {"choices": [{"delta": {"content": "не JSON"}}]}
+    replies[FAST] = httpx.Response(200, text=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n")
+
+    events = _stream()
+
+    assert requests == [FAST, STRONG]
+    assert events[-1][1]["data"]["school"] == STUDENT["school"]
+
+
+def test_streamed_fields_without_fallback(openrouter):
+    replies, requests = openrouter
+    content = json.dumps(STUDENT, ensure_ascii=False)
+    lines = [
+        f"data: {json.dumps({'model': FAST, 'choices': [{'delta': {'content': content[i:i + 7]}}]})}\n\n"
+        for i in range(0, len(content), 7)
+    ]
+    replies[FAST] = httpx.Response(200, text="".join(lines) + "data: [DONE]\n\n")
+
+    events = _stream()
+
+    assert requests == [FAST]
+    assert [data["name"] for event, data in events if event == "field"] == list(STUDENT)
+    assert events[-1][1]["ocr_raw"]["routing"]["models"] == [FAST]
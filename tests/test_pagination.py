@@ -0,0 +1,177 @@
+import base64
+import json
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from backend.utils.pagination import KEYSET_SORT, decode_cursor, encode_cursor, keyset_query, page_cursors
+
+# Порядок типов BSON при сравнении (для полей сортировки списка заявок)
+_TYPE_ORDER = {type(None): 0, str: 1, ObjectId: 2, datetime: 3}
+_TYPE_NAMES = {"string": str, "date": datetime}
+
+
+def _matches(document: dict, query: dict) -> bool:
+    """Проверка документа фильтром - подмножество языка запросов MongoDB, которое строит keyset_query"""
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(_matches(document, part) for part in condition):
+                return False
+        elif field == "$or":
+            if not any(_matches(document, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = document.get(field)
+            for op, operand in condition.items():
+                if op == "$type":
+                    ok = isinstance(value, _TYPE_NAMES[operand])
+                else:
+                    # Сравнение - только внутри одного типа
+                    ok = type(value) is type(operand) and (value < operand if op == "$lt" else value > operand)
+                if not ok:
+                    return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+def _sort(documents: list, sort: list) -> list:
+    for field, order in reversed(sort):
+        documents = sorted(
+            documents,
+            key=lambda document: (_TYPE_ORDER[type(document.get(field))], document.get(field) or ""),
+            reverse=order < 0
+        )
+    return documents
+
+
+def _page(documents: list, cursor, limit: int) -> tuple:
+    """Одна страница так же, как в GET /api/admin/students"""
+    query, sort, direction = keyset_query({}, cursor)
+    found = _sort([document for document in documents if _matches(document, query)], sort)[:limit + 1]
+    has_more = len(found) > limit
+    found = found[:limit]
+    if direction == "prev":
+        found.reverse()
+    return found, page_cursors(found, direction, has_more, from_cursor=bool(cursor))
+
+
+@pytest.fixture
+def students() -> list:
+    """Заявки с одинаковым временем создания, со строковым created_at и без него"""
+    created = datetime(2024, 9, 1, 12, 0)
+    documents = [{"_id": ObjectId(), "created_at": created - timedelta(hours=index // 3)} for index in range(8)]
+    documents += [{"_id": ObjectId(), "created_at": f"2023-05-0{index + 1} 10:00:00"} for index in range(3)]
+    documents += [{"_id": ObjectId(), "created_at": None}, {"_id": ObjectId()}, {"_id": ObjectId(), "created_at": None}]
+    return documents
+
+
+def test_cursor_round_trip():
+    object_id = ObjectId()
+    created = datetime(2024, 9, 1, 12, 30, 15, 123000)
+    assert decode_cursor(encode_cursor({"_id": object_id, "created_at": created}, "next")) == ("next", "date", created, object_id)
+    assert decode_cursor(encode_cursor({"_id": object_id, "created_at": "2023-05-01"}, "prev")) == ("prev", "string", "2023-05-01", object_id)
+    assert decode_cursor(encode_cursor({"_id": object_id, "created_at": None}, "next")) == ("next", "null", None, object_id)
+    assert decode_cursor(encode_cursor({"_id": object_id}, "next")) == ("next", "null", None, object_id)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor({"_id": ObjectId(), "created_at": datetime(2024, 9, 1)}, "next")
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+def test_cursor_without_kind_is_a_date():
+    """Курсоры, выданные до появления типа в курсоре"""
+    object_id = ObjectId()
+    raw = json.dumps({"d": "next", "t": "2024-09-01T12:00:00", "i": str(object_id)}).encode()
+    cursor = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    assert decode_cursor(cursor) == ("next", "date", datetime(2024, 9, 1, 12), object_id)
+
+
+@pytest.mark.parametrize("payload", [
+    "не base64 !",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(json.dumps({"d": "up", "t": None, "i": str(ObjectId())}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"d": "next", "k": "date", "t": "вчера", "i": str(ObjectId())}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"d": "next", "k": "string", "t": 5, "i": str(ObjectId())}).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"d": "next", "k": "date", "t": "2024-09-01", "i": "xyz"}).encode()).decode(),
+])
+def test_broken_cursor_is_400(payload):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(payload)
+    assert error.value.status_code == 400
+
+
+def test_unsupported_created_at_is_rejected():
+    with pytest.raises(ValueError):
+        encode_cursor({"_id": ObjectId(), "created_at": 1693569600}, "next")
+
+
+def test_first_page_without_cursor():
+    query = {"sent_to_amo": False}
+    assert keyset_query(query, None) == (query, KEYSET_SORT, "next")
+
+
+def test_cursor_keeps_base_query():
+    cursor = encode_cursor({"_id": ObjectId(), "created_at": datetime(2024, 9, 1)}, "next")
+    page_query, _, _ = keyset_query({"sent_to_amo": False}, cursor)
+    assert page_query["$and"][0] == {"sent_to_amo": False}
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5, 20])
+def test_walk_forward_and_back(students, limit):
+    expected = [document["_id"] for document in _sort(students, KEYSET_SORT)]
+
+    pages = []
+    cursor = None
+    while True:
+        found, (next_cursor, prev_cursor) = _page(students, cursor, limit)
+        pages.append((found, prev_cursor))
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+    forward = [document["_id"] for found, _ in pages for document in found]
+    assert forward == expected
+
+    # Первая страница - без prev, последняя - без next
+    assert pages[0][1] is None
+    assert _page(students, None, limit)[1][1] is None
+
+    backward = [document["_id"] for document in pages[-1][0]]
+    cursor = pages[-1][1]
+    while cursor is not None:
+        found, (_, cursor) = _page(students, cursor, limit)
+        backward = [document["_id"] for document in found] + backward
+    assert backward == expected
+
+
+def test_ties_are_broken_by_id():
+    created = datetime(2024, 9, 1)
+    documents = [{"_id": ObjectId(), "created_at": created} for _ in range(5)]
+    first, (next_cursor, _) = _page(documents, None, 2)
+    second, _ = _page(documents, next_cursor, 2)
+    assert [document["_id"] for document in first + second] == sorted((document["_id"] for document in documents), reverse=True)[:4]
+
+
+def test_single_page_has_no_cursors(students):
+    found, cursors = _page(students, None, len(students))
+    assert len(found) == len(students)
+    assert cursors == (None, None)
+
+
+def test_empty_page_has_no_cursors():
+    assert page_cursors([], "next", False, True) == (None, None)
+
+
+def test_prev_from_first_dated_row_is_empty(students):
+    newest = _sort(students, KEYSET_SORT)[0]
+    found, cursors = _page(students, encode_cursor(newest, "prev"), 5)
+    assert found == []
+    assert cursors == (None, None)
+
+
+def test_next_from_last_row_is_empty(students):
+    oldest = _sort(students, KEYSET_SORT)[-1]
+    assert oldest.get("created_at") is None
+    found, _ = _page(students, encode_cursor(oldest, "next"), 5)
+    assert found == []
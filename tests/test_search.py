@@ -0,0 +1,126 @@
+import re
+import pytest
+from backend.services.search import TRIGRAM, normalize_text, phone_digits, search_fields, search_filter, trigrams
+
+
+def _matches(student: dict, query: dict) -> bool:
+    """Проверка заявки фильтром search_filter: $and/$or, $regex и $all по полям search.*"""
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(_matches(student, part) for part in condition):
+                return False
+        elif field == "$or":
+            if not any(_matches(student, part) for part in condition):
+                return False
+        else:
+            value = student["search"][field.split(".", 1)[1]]
+            values = value if isinstance(value, list) else [value]
+            if "$regex" in condition and not any(re.search(condition["$regex"], item) for item in values):
+                return False
+            if "$all" in condition and not set(condition["$all"]) <= set(values):
+                return False
+    return True
+
+
+def _student(**fields) -> dict:
+    student = {"fio": None, "school": None, "phone": None, "parent_phone": None, **fields}
+    student.update(search_fields(student))
+    return student
+
+
+SEMENOVA = _student(fio="Семёнова Алёна Петровна", school="Лицей №57, г. Москва", phone="+7 (916) 123-45-67", parent_phone="8 903 000 11 22")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Семёнова  Алёна", "семенова алена"),
+    ("ЁЛКИН-Иванов", "елкин иванов"),
+    ("Лицей №57, г. Москва", "лицей 57 г москва"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_text(value, expected):
+    assert normalize_text(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("+7 (916) 123-45-67", "9161234567"),
+    ("8 916 123 45 67", "9161234567"),
+    ("79161234567", "9161234567"),
+    ("9161234567", "9161234567"),
+    ("123-45-67", "1234567"),
+    # 11 цифр не с 7/8 - не российский номер, код не отрезается
+    ("+1 916 123 45 67", "19161234567"),
+    ("", ""),
+    (None, ""),
+])
+def test_phone_digits(value, expected):
+    assert phone_digits(value) == expected
+
+
+def test_trigrams():
+    assert trigrams("иванов") == ["ива", "ван", "ано", "нов"]
+    assert trigrams("ива") == ["ива"]
+    assert trigrams("ив") == []
+
+
+def test_search_fields():
+    search = SEMENOVA["search"]
+    assert search["fio"] == "семенова алена петровна"
+    assert search["school"] == "лицей 57 г москва"
+    assert search["text"] == "семенова алена петровна лицей 57 г москва 9161234567 9030001122"
+    assert search["tokens"] == sorted({"семенова", "алена", "петровна", "лицей", "57", "г", "москва", "9161234567", "9030001122"})
+    assert "мен" in search["trigrams"] and "916" in search["trigrams"]
+    assert all(len(gram) == TRIGRAM for gram in search["trigrams"])
+
+
+def test_search_fields_empty_student():
+    assert search_fields({})["search"] == {"fio": "", "school": "", "text": "", "tokens": [], "trigrams": []}
+
+
+@pytest.mark.parametrize("query", [
+    "Семёнова", "семенова", "СЕМЕН",  # ё/е и регистр
+    "менова",                         # подстрока из середины слова
+    "алена семенова",                 # слова в любом порядке
+    "лицей 57",
+    "+7 916 123",                     # телефон с кодом страны и пробелами
+    "8 (916) 123-45",
+    "9161234567",
+    "4567",                           # конец номера
+    "903 000",
+    "ал",                             # короткий запрос - начало слова
+])
+def test_search_filter_finds(query):
+    assert _matches(SEMENOVA, search_filter(query))
+
+
+@pytest.mark.parametrize("query", [
+    "иванова",
+    "лицей 58",
+    "+7 916 999",
+    "ле",   # короткий запрос ищется только как начало слова, «алена» не подходит
+    "семенова 58",
+])
+def test_search_filter_skips(query):
+    assert not _matches(SEMENOVA, search_filter(query))
+
+
+def test_short_query_is_prefix_only():
+    query = search_filter("Ал")
+    assert query == {"search.tokens": {"$regex": "^ал"}}
+
+
+def test_phone_query_with_country_code_has_both_variants():
+    query = search_filter("+7 916 123")
+    assert {"search.tokens": {"$regex": "^7916123"}} in [branch["$or"][0] for branch in query["$or"]]
+    assert {"search.tokens": {"$regex": "^916123"}} in [branch["$or"][0] for branch in query["$or"]]
+
+
+def test_regex_special_characters_are_escaped():
+    query = search_filter("a.b")
+    assert query == {"$and": [{"search.tokens": {"$regex": "^a"}}, {"search.tokens": {"$regex": "^b"}}]}
+    assert search_filter("(.*)") is None
+
+
+@pytest.mark.parametrize("query", ["", "   ", "!!!", None])
+def test_empty_query(query):
+    assert search_filter(query or "") is None